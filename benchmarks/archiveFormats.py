@@ -0,0 +1,179 @@
+"""
+archiveFormats.py
+Compares the cold start time of PyRAM for each format lib/pypy.so can be packed in
+(tar, xz, zstd and lz4), so the trade-off between archive size and startup time can be chosen
+before building the package with PYRAM_FORMAT.
+
+The PyPy tree is extracted from an existing pypy.so, packed again in every format with the same
+commands used by build/build, then `pyram` runs an empty script with PYRAM_ARCHIVE pointing to each
+archive and PYRAM_COLD=1, so every run extracts the whole tree again.
+
+Usage (as root, pyram must be installed):
+    python3 archiveFormats.py [--archive /usr/share/pyram/lib/pypy.so] [--runs 5] [--drop-caches]
+
+Output: a JSON object in the same format as benchmarks.py, one test per archive format where
+"input" is the run number, plus the archive size in bytes:
+{
+    "zstd": [
+        {"input": 1, "time": 0.91, "size": 98765432},
+        ...
+    ]
+}
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from typing import Dict, List
+
+DEFAULT_ARCHIVE = "/usr/share/pyram/lib/pypy.so"
+
+# Same compressors and levels as pack_pypy() in build/build
+PACK_COMMANDS: Dict[str, List[str]] = {
+    "tar": [],
+    "xz": ["xz", "-T0", "-9", "-q", "-c"],
+    "zstd": ["zstd", "-T0", "-19", "-q", "-c"],
+    "lz4": ["lz4", "-9", "-q", "-c"],
+}
+
+
+def pack(tree: str, fmt: str, output: str) -> None:
+    """
+    Packs the pypy/ directory of tree into output using the given format.
+    Args:
+        tree (str): Directory containing the extracted pypy/ directory.
+        fmt (str): One of the keys of PACK_COMMANDS.
+        output (str): Path of the archive to create.
+    Raises:
+        subprocess.CalledProcessError: If tar or the compressor fails.
+    """
+
+    with open(output, "wb") as out:
+
+        if not PACK_COMMANDS[fmt]:
+
+            subprocess.run(["tar", "-C", tree, "-cf", "-", "pypy"], stdout=out, check=True)
+            return
+
+        tar = subprocess.Popen(["tar", "-C", tree, "-cf", "-", "pypy"], stdout=subprocess.PIPE)
+        subprocess.run(PACK_COMMANDS[fmt], stdin=tar.stdout, stdout=out, check=True)
+        tar.stdout.close()
+
+        if tar.wait() != 0:
+
+            raise subprocess.CalledProcessError(tar.returncode, "tar")
+
+
+def drop_caches() -> None:
+    """
+    Writes dirty pages and drops the page cache, so the archive is read from the disk.
+    """
+
+    os.sync()
+
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+
+        f.write("3\n")
+
+
+def cold_start(archive: str, script: str, should_drop_caches: bool) -> float:
+    """
+    Runs pyram once, forcing the extraction of the given archive.
+    Args:
+        archive (str): Path of the pypy.so to extract.
+        script (str): Python script to run.
+        should_drop_caches (bool): Drop the page cache before the run.
+    Returns:
+        float: Wall clock time of the run in seconds.
+    """
+
+    env = dict(os.environ, PYRAM_ARCHIVE=archive, PYRAM_COLD="1")
+
+    if should_drop_caches:
+
+        drop_caches()
+
+    start = time.perf_counter()
+    subprocess.run(
+        ["pyram", f"./{os.path.basename(script)}"],
+        cwd=os.path.dirname(script), env=env, check=True, stdout=subprocess.DEVNULL
+    )
+
+    return time.perf_counter() - start
+
+
+def benchmark(archive: str, runs: int, should_drop_caches: bool) -> Dict[str, List[Dict[str, float]]]:
+    """
+    Packs the tree of archive in every format and times the cold starts of each one.
+    Args:
+        archive (str): Existing pypy.so in any format supported by tar.
+        runs (int): Number of cold starts per format.
+        should_drop_caches (bool): Drop the page cache before each run.
+    Returns:
+        dict: Results in the benchmarks.py JSON format.
+    """
+
+    results: Dict[str, List[Dict[str, float]]] = dict()
+    workdir = tempfile.mkdtemp(prefix="pyram_formats_")
+
+    try:
+
+        tree = os.path.join(workdir, "tree")
+        os.makedirs(tree)
+        subprocess.run(["tar", "-xf", archive, "-C", tree], check=True)
+
+        script = os.path.join(workdir, "empty.py")
+
+        with open(script, "w") as f:
+
+            f.write("pass\n")
+
+        for fmt in PACK_COMMANDS:
+
+            if PACK_COMMANDS[fmt] and shutil.which(PACK_COMMANDS[fmt][0]) is None:
+
+                print(f"{PACK_COMMANDS[fmt][0]} not found, skipping {fmt}...", file=sys.stderr)
+                continue
+
+            packed = os.path.join(workdir, f"pypy.{fmt}")
+            pack(tree, fmt, packed)
+            size = os.path.getsize(packed)
+
+            results[fmt] = []
+
+            for run in range(1, runs + 1):
+
+                results[fmt].append({
+                    "input": run,
+                    "time": cold_start(packed, script, should_drop_caches),
+                    "size": size,
+                })
+
+    finally:
+
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compare PyRAM cold starts for each pypy.so format.")
+    parser.add_argument("--archive", default=DEFAULT_ARCHIVE, help="pypy.so to repack")
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per format")
+    parser.add_argument("--drop-caches", action="store_true", help="drop the page cache before each run")
+    args = parser.parse_args()
+
+    try:
+
+        print(json.dumps(benchmark(args.archive, args.runs, args.drop_caches), indent=4))
+
+    except Exception as e:
+
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -1,7 +1,103 @@
+"""
+benchmarks.py
+CPU benchmarks run by runSpeedTests.sh with each interpreter (pyram, pypy3, python3).
+
+Every case is run for a number of warmup iterations, which are not measured and let the JIT of
+PyPy compile the hot loops, then for a number of measured iterations timed with
+time.perf_counter_ns(). Inputs are generated again before every iteration, outside the timing.
+
+Usage:
+    python3 benchmarks.py [--warmups 3] [--iterations 10] [--bootstrap 2000] [--confidence 0.95]
+                          [--seed 0] [--only fibonacci,manual_sort] [--skip string_concat]
+    python3 benchmarks.py --warmup-curve [--curve-iterations 200] [--window 5] [--tolerance 0.1]
+
+Output: a JSON object with one list per case, one entry per input size, and the metadata of the
+interpreter and the machine. "time" is the median in seconds, as read by jsonToLinearGraphic.py:
+{
+    "metadata": {"interpreter": "pypy", "version": "3.10.14", "cpu": "...", ...},
+    "fibonacci": [
+        {"input": 30, "time": 0.0121, "median": 0.0121, "mean": 0.0123, "stddev": 0.0004,
+         "min": 0.0119, "max": 0.0131, "ci_low": 0.0120, "ci_high": 0.0124, "iterations": 10,
+         "samples": [0.0121, ...]},
+        ...
+    ]
+}
+
+With --warmup-curve, every case is run on its middle input size for a number of
+iterations without any warmup, and the time of each iteration is kept, so the cost of the JIT
+compiling the hot loops shows up apart from the steady state. "input" is then the iteration number
+and a "warmup" key summarizes the curve of each case:
+{
+    "metadata": {...},
+    "fibonacci": [{"input": 1, "time": 0.0104}, {"input": 2, "time": 0.0051}, ...],
+    "warmup": {
+        "fibonacci": {"input": 20, "iterations": 200, "steady_iteration": 14, "time_to_steady": 0.061,
+                      "steady_time": 0.0009, "throughput": 1111.1},
+        ...
+    }
+}
+"""
+import os
+import sys
 import time
 import json
 import random
+import socket
+import argparse
+import platform
+import statistics
 
+from typing import Any, Callable, Dict, List, Tuple
+
+# Name, function, input sizes, arguments built for an input size before each iteration and suite
+CASES: List[Tuple[str, Callable, List[int], Callable[[int], tuple], str]] = []
+
+SUITES = ["micro", "macro"]
+
+
+def size_argument(size):
+
+    return (size,)
+
+
+def random_list(size, high):
+
+    return ([random.randint(0, high) for _ in range(size)],)
+
+
+def random_matrices(size):
+
+    return tuple([[random.random() for _ in range(size)] for _ in range(size)] for _ in range(2))
+
+
+def register(name: str, sizes: List[int], make_args: Callable[[int], tuple] = size_argument,
+             suite: str = "micro") -> Callable[[Callable], Callable]:
+    """
+    Decorator adding a function to the benchmark cases.
+    Args:
+        name (str): Name of the case in the results.
+        sizes (list[int]): Input sizes the case is run with.
+        make_args (callable): Builds the arguments of the function for an input size, outside the timing.
+            By default the function receives the size itself.
+        suite (str): "micro" for the kernels of this file, "macro" for the workloads of macroBenchmarks.py.
+    Returns:
+        callable: The decorator, which returns the function unchanged.
+    """
+
+    def decorator(function: Callable) -> Callable:
+
+        if any(case[0] == name for case in CASES):
+
+            raise ValueError(f"benchmark case {name} is registered twice")
+
+        CASES.append((name, function, sizes, make_args, suite))
+
+        return function
+
+    return decorator
+
+
+@register("fibonacci", [10, 15, 20, 30, 35])
 def fib_recursive(n):
     """
     Calculate the nth Fibonacci number using a recursive approach.
@@ -25,6 +121,7 @@ def fib_recursive(n):
         return n
     return fib_recursive(n-1) + fib_recursive(n-2)
 
+@register("manual_sort", [10, 100, 1000, 10000, 50000], lambda size: random_list(size, 10000))
 def manual_sort(lst):
     """
     Sorts a list in ascending order using the bubble sort algorithm.
@@ -48,6 +145,7 @@ def manual_sort(lst):
 
     return lst
 
+@register("sum_large_list", [10**2, 10**3, 10**4, 10**5, (10**5)*2], lambda size: random_list(size, 100))
 def sum_large_list(lst):
     """
     Calculates the sum of all elements in a given list.
@@ -65,18 +163,18 @@ def sum_large_list(lst):
 
     return total
 
-def matrix_multiplication(size):
+@register("matrix_multiplication", [10, 20, 25, 30, 35], random_matrices)
+def matrix_multiplication(A, B):
     """
-    Performs matrix multiplication of two randomly generated square matrices of the given size.
+    Performs matrix multiplication of two square matrices of the same size.
     Args:
-        size (int): The number of rows and columns for the square matrices.
+        A (list[list[float]]): The left matrix.
+        B (list[list[float]]): The right matrix.
     Returns:
-        list[list[int]]: The resulting matrix after multiplying two randomly generated matrices.
+        list[list[int]]: The resulting matrix, with each product truncated to an integer.
     """
 
-
-    A = [[random.random() for _ in range(size)] for _ in range(size)]
-    B = [[random.random() for _ in range(size)] for _ in range(size)]
+    size = len(A)
     result = [[0 for _ in range(size)] for _ in range(size)]
 
     for i in range(size):
@@ -89,6 +187,7 @@ def matrix_multiplication(size):
 
     return result
 
+@register("string_concat", [1000, 5000, 10000, 30000, 40000])
 def string_concat(n):
     """
     Concatenates the string representations of integers from 0 to n-1.
@@ -106,82 +205,317 @@ def string_concat(n):
 
     return s
 
-def benchmark():
+
+def bootstrap_ci(samples: List[float], resamples: int, confidence: float, rng: random.Random) -> Tuple[float, float]:
     """
-    Runs a series of benchmark tests on various algorithms and prints the results as a JSON object.
-    The benchmarks include:
+    Percentile bootstrap confidence interval of the median.
+    Args:
+        samples (list[float]): Measured times.
+        resamples (int): Number of resamples drawn with replacement.
+        confidence (float): Confidence level, e.g. 0.95.
+        rng (random.Random): Generator of the resamples, separate from the one of the inputs.
+    Returns:
+        tuple: Lower and upper bounds of the interval.
+    """
+
+    if len(samples) < 2 or resamples < 1:
+
+        return samples[0], samples[0]
+
+    medians = sorted(
+        statistics.median(rng.choices(samples, k=len(samples))) for _ in range(resamples)
+    )
+    tail = (1 - confidence) / 2
+
+    return medians[int(tail * (resamples - 1))], medians[int((1 - tail) * (resamples - 1))]
+
+
+def summarize(samples: List[float], resamples: int, confidence: float, rng: random.Random) -> Dict[str, Any]:
+    """
+    Statistics of the measured times of one input size.
+    Args:
+        samples (list[float]): Measured times in seconds.
+        resamples (int): Bootstrap resamples.
+        confidence (float): Confidence level of the interval.
+        rng (random.Random): Generator of the bootstrap resamples.
+    Returns:
+        dict: median (also as "time"), mean, stddev, min, max, ci_low, ci_high, iterations and samples.
+    """
+
+    ci_low, ci_high = bootstrap_ci(samples, resamples, confidence, rng)
+    median = statistics.median(samples)
+
+    return {
+        "time": median,
+        "median": median,
+        "mean": statistics.fmean(samples),
+        "stddev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "min": min(samples),
+        "max": max(samples),
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "iterations": len(samples),
+        "samples": samples,
+    }
+
+
+def cpu_model() -> str:
+    """
+    Returns:
+        str: The CPU model from /proc/cpuinfo, or platform.processor() elsewhere.
+    """
+
+    try:
+
+        with open("/proc/cpuinfo") as cpuinfo:
+
+            for line in cpuinfo:
+
+                if line.startswith("model name"):
+
+                    return line.split(":", 1)[1].strip()
+
+    except OSError:
+
+        pass
+
+    return platform.processor()
+
+
+def machine_metadata() -> Dict[str, Any]:
+    """
+    Describes the interpreter and the machine the results come from.
+    Returns:
+        dict: Interpreter, versions, executable, host, OS, CPU and timer resolution.
+    """
+
+    pypy_version = getattr(sys, "pypy_version_info", None)
+
+    return {
+        "interpreter": sys.implementation.name,
+        "version": platform.python_version(),
+        "pypy_version": ".".join(str(part) for part in pypy_version[:3]) if pypy_version else None,
+        "executable": sys.executable,
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu": cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "timer_resolution": time.get_clock_info("perf_counter").resolution,
+        "timestamp": time.time(),
+    }
+
+
+def measure(function: Callable, make_args: Callable[[int], tuple], size: int, warmups: int, iterations: int) -> List[float]:
+    """
+    Times one input size of a case.
+    Args:
+        function (callable): Benchmarked function.
+        make_args (callable): Builds the arguments of the function for the input size.
+        size (int): Input size.
+        warmups (int): Iterations run before the measured ones, not timed.
+        iterations (int): Measured iterations.
+    Returns:
+        list[float]: Time of each measured iteration in seconds.
+    """
+
+    samples = []
+
+    for iteration in range(warmups + iterations):
+
+        args = make_args(size)
+        start = time.perf_counter_ns()
+        function(*args)
+        end = time.perf_counter_ns()
+
+        if iteration >= warmups:
+
+            samples.append((end - start) / 1e9)
+
+    return samples
+
+
+def steady_state(times: List[float], window: int, tolerance: float) -> Dict[str, Any]:
+    """
+    Finds where a warmup curve reaches its steady state.
+    The steady time is the median of the last quarter of the iterations, and the steady state starts
+    at the first iteration from which the median of every window of iterations stays within
+    tolerance of it.
+    Args:
+        times (list[float]): Time of each iteration in seconds, in the order they ran.
+        window (int): Number of iterations of the rolling median, which ignores isolated spikes (GC).
+        tolerance (float): Relative distance to the steady time still considered steady, 0.1 for 10%.
+    Returns:
+        dict: steady_iteration (1-based), time_to_steady (seconds spent in the iterations before it),
+              steady_time and throughput (iterations per second in the steady state).
+    """
+
+    window = max(1, min(window, len(times)))
+    steady_time = statistics.median(times[-max(window, len(times) // 4):])
+    start = len(times) - window
+
+    while start > 0 and statistics.median(times[start - 1:start - 1 + window]) <= steady_time * (1 + tolerance):
+
+        start -= 1
+
+    return {
+        "steady_iteration": start + 1,
+        "time_to_steady": sum(times[:start]),
+        "steady_time": steady_time,
+        "throughput": 1 / steady_time if steady_time > 0 else None,
+    }
+
+
+def warmup_curves(cases: List[Tuple], iterations: int = 200, window: int = 5, tolerance: float = 0.1,
+                  seed: int = 0) -> Dict[str, Any]:
+    """
+    Records the time of every iteration of each case, from the first one, on its middle input size.
+    Args:
+        cases (list[tuple]): Cases to run, from select_cases.
+        iterations (int): Iterations per case, all of them measured.
+        window (int): Rolling median window of steady_state.
+        tolerance (float): Tolerance of steady_state.
+        seed (int): Seed of the generated inputs.
+    Returns:
+        dict: The metadata, one curve per case and the "warmup" summary of each curve.
+    """
+
+    random.seed(seed)
+
+    results: Dict[str, Any] = {"metadata": machine_metadata()}
+    results["metadata"].update({
+        "mode": "warmup", "iterations": iterations, "window": window, "tolerance": tolerance, "seed": seed,
+    })
+    summary: Dict[str, Any] = {}
+
+    for name, function, sizes, make_args, _ in cases:
+
+        size = sizes[len(sizes) // 2]
+        times = measure(function, make_args, size, 0, iterations)
+        results[name] = [{"input": index, "time": elapsed} for index, elapsed in enumerate(times, 1)]
+        summary[name] = dict(input=size, iterations=iterations, **steady_state(times, window, tolerance))
+
+    results["warmup"] = summary
+
+    return results
+
+
+def benchmark(cases: List[Tuple], warmups: int = 3, iterations: int = 10, resamples: int = 2000,
+              confidence: float = 0.95, seed: int = 0) -> Dict[str, Any]:
+    """
+    Runs the benchmark cases and collects their statistics.
+    The micro benchmarks include:
         - Recursive Fibonacci calculation for different input sizes.
         - Manual sorting of lists with varying lengths.
         - Summing elements of large lists.
         - Multiplication of square matrices of different sizes.
         - String concatenation for different string lengths.
-    Each benchmark records the input size and the time taken to execute the corresponding function.
+    Args:
+        cases (list[tuple]): Cases to run, from select_cases.
+        warmups (int): Unmeasured iterations per input size.
+        iterations (int): Measured iterations per input size.
+        resamples (int): Bootstrap resamples of the confidence intervals.
+        confidence (float): Confidence level of the intervals.
+        seed (int): Seed of the generated inputs and of the bootstrap, so runs are comparable.
+    Returns:
+        dict: The metadata and one list of results per case.
+    """
+
+    random.seed(seed)
+    rng = random.Random(seed)
+
+    results: Dict[str, Any] = {"metadata": machine_metadata()}
+    results["metadata"].update({
+        "warmups": warmups, "iterations": iterations, "bootstrap_resamples": resamples,
+        "confidence": confidence, "seed": seed,
+    })
+
+    for name, function, sizes, make_args, _ in cases:
+
+        results[name] = []
+
+        for size in sizes:
+
+            samples = measure(function, make_args, size, warmups, iterations)
+            results[name].append(dict(input=size, **summarize(samples, resamples, confidence, rng)))
+
+    return results
+
+
+def select_cases(suite: str, only: List[str], skip: List[str]) -> List[Tuple]:
+    """
+    Picks the registered cases to run.
+    Args:
+        suite (str): Suite of the cases, "micro" or "macro".
+        only (list[str]): Names of the cases to run, all of the suite when empty.
+        skip (list[str]): Names of the cases not to run.
     Returns:
-        None. Prints the benchmark results as a formatted JSON string.
+        list[tuple]: The cases, in the order they were registered.
+    Raises:
+        ValueError: If a name is not a case of the suite.
     """
 
-    results = dict()
+    names = {case[0] for case in CASES if case[4] == suite}
+    unknown = (set(only) | set(skip)) - names
 
-    # Fibonacci
-    fib_inputs = [10, 15, 20, 30, 35]
+    if unknown:
 
-    results['fibonacci'] = []
+        raise ValueError(f"unknown cases: {', '.join(sorted(unknown))}, {suite} cases are {', '.join(sorted(names))}")
 
-    for n in fib_inputs:
+    return [case for case in CASES if case[4] == suite and (not only or case[0] in only) and case[0] not in skip]
 
-        start = time.time()
-        fib_recursive(n)
-        end = time.time()
-        results['fibonacci'].append({'input': n, 'time': end - start})
 
-    # Manual sort
-    sort_sizes = [10, 100, 1000, 10000, 50000]
-    results['manual_sort'] = []
+def main(suite: str = "micro") -> None:
+    """
+    Command line of benchmarks.py and macroBenchmarks.py, prints the results of the cases of a suite.
+    Args:
+        suite (str): Suite of the cases to run.
+    """
+
+    parser = argparse.ArgumentParser(description=f"PyRAM {suite} benchmarks")
+    parser.add_argument("--warmups", type=int, default=3, help="unmeasured iterations per input size")
+    parser.add_argument("--iterations", type=int, default=10, help="measured iterations per input size")
+    parser.add_argument("--bootstrap", type=int, default=2000, help="bootstrap resamples of the confidence interval")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of the interval")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the inputs and of the bootstrap")
+    parser.add_argument("--only", default="", help="comma separated cases to run, e.g. fibonacci,manual_sort")
+    parser.add_argument("--skip", default="", help="comma separated cases not to run")
+    parser.add_argument("--warmup-curve", action="store_true", help="record the time of every iteration from the first one")
+    parser.add_argument("--curve-iterations", type=int, default=200, help="iterations per case of the warmup curve")
+    parser.add_argument("--window", type=int, default=5, help="rolling median window of the steady state detection")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="distance to the steady time still steady, 0.1 for 10%%")
+    args = parser.parse_args()
 
-    for size in sort_sizes:
+    if args.warmups < 0 or args.iterations < 1 or not 0 < args.confidence < 1:
 
-        lst = [random.randint(0, 10000) for _ in range(size)]
-        start = time.time()
-        manual_sort(lst)
-        end = time.time()
-        results['manual_sort'].append({'input': size, 'time': end - start})
+        parser.error("--warmups must be >= 0, --iterations >= 1 and --confidence between 0 and 1")
 
-    # Sum large list
-    sum_sizes = [10**2, 10**3, 10**4, 10**5, (10**5)*2]
-    results['sum_large_list'] = []
+    if args.curve_iterations < 1 or args.window < 1 or args.tolerance < 0:
 
-    for size in sum_sizes:
+        parser.error("--curve-iterations and --window must be >= 1 and --tolerance >= 0")
 
-        lst = [random.randint(0, 100) for _ in range(size)]
-        start = time.time()
-        sum_large_list(lst)
-        end = time.time()
-        results['sum_large_list'].append({'input': size, 'time': end - start})
+    try:
 
-    # Matrix multiplication
-    matrix_sizes = [10, 20, 25, 30, 35]
-    results['matrix_multiplication'] = []
+        cases = select_cases(
+            suite, [name for name in args.only.split(",") if name], [name for name in args.skip.split(",") if name]
+        )
 
-    for size in matrix_sizes:
+    except ValueError as e:
 
-        start = time.time()
-        matrix_multiplication(size)
-        end = time.time()
-        results['matrix_multiplication'].append({'input': size, 'time': end - start})
+        parser.error(str(e))
 
-    # String concatenation
-    concat_sizes = [1000, 5000, 10000, 30000, 40000]
-    results['string_concat'] = []
+    if args.warmup_curve:
 
-    for size in concat_sizes:
+        results = warmup_curves(cases, args.curve_iterations, args.window, args.tolerance, args.seed)
 
-        start = time.time()
-        string_concat(size)
-        end = time.time()
-        results['string_concat'].append({'input': size, 'time': end - start})
-    
+    else:
+
+        results = benchmark(cases, args.warmups, args.iterations, args.bootstrap, args.confidence, args.seed)
+
+    results["metadata"]["suite"] = suite
     print(json.dumps(results, indent=4))
 
+
 if __name__ == "__main__":
 
-    benchmark()
+    main()
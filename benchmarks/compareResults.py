@@ -0,0 +1,247 @@
+"""
+compareResults.py
+Compares benchmark results against a baseline and fails when a case became significantly slower,
+so an upgrade of the PyPy image (or of PyRAM) can be gated on the benchmarks.
+
+The first file is the baseline, every other file is compared with it. For each test and input
+present in both, the ratio candidate median / baseline median is computed. When both results kept
+their samples (benchmarks.py since it repeats the runs) a bootstrap confidence interval of the
+ratio tells whether the difference is significant; results with a single "time" (older files,
+archiveFormats.py) have no interval and are compared on the threshold alone.
+
+A case is a regression when its ratio exceeds 1 + threshold and, if it has an interval, the whole
+interval lies above 1. Cases whose baseline median is under --min-time are only reported, their
+timings are dominated by the timer and the scheduler.
+
+Usage:
+    python3 compareResults.py <baseline.json> <candidate.json> [<candidate.json>...]
+                              [--threshold 0.05] [--min-time 0.0001] [--confidence 0.95]
+                              [--bootstrap 2000] [--seed 0]
+
+Example:
+    python3 compareResults.py tests/pypy3.json tests/pyram.json
+
+Exit status: 0 when no case regressed, 1 when at least one did, 2 on invalid input.
+"""
+import sys
+import json
+import random
+import argparse
+import statistics
+
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def load_results(path: str) -> Dict[str, Dict[Any, Dict[str, Any]]]:
+    """
+    Loads a result file and indexes its entries by test and input.
+    Args:
+        path (str): JSON file written by benchmarks.py or in the same format.
+    Returns:
+        dict: {test: {input: {"median": float, "samples": list[float]}}}, without the metadata.
+    """
+
+    with open(path) as f:
+
+        data = json.load(f)
+
+    if not isinstance(data, dict):
+
+        raise ValueError(f"{path}: expected a JSON object of tests")
+
+    results: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+
+    for test, entries in data.items():
+
+        # Interpreter and machine metadata, summary of the warmup curves
+        if test in ("metadata", "warmup"):
+
+            continue
+
+        if not isinstance(entries, list):
+
+            raise ValueError(f"{path}: invalid data format for test '{test}', expected a list")
+
+        results[test] = {}
+
+        for entry in entries:
+
+            if "input" not in entry or "time" not in entry:
+
+                raise ValueError(f"{path}: entry of '{test}' without input or time")
+
+            samples = [float(sample) for sample in entry.get("samples", [])]
+            median = float(entry.get("median", entry["time"]))
+            results[test][entry["input"]] = {"median": median, "samples": samples}
+
+    return results
+
+
+def ratio_ci(baseline: List[float], candidate: List[float], resamples: int, confidence: float,
+             rng: random.Random) -> Optional[Tuple[float, float]]:
+    """
+    Percentile bootstrap confidence interval of candidate median / baseline median.
+    Args:
+        baseline (list[float]): Samples of the baseline.
+        candidate (list[float]): Samples of the candidate.
+        resamples (int): Number of resamples drawn with replacement from each side.
+        confidence (float): Confidence level, e.g. 0.95.
+        rng (random.Random): Generator of the resamples.
+    Returns:
+        tuple | None: Lower and upper bounds, None when a side has less than two samples.
+    """
+
+    if len(baseline) < 2 or len(candidate) < 2 or resamples < 1:
+
+        return None
+
+    ratios = []
+
+    for _ in range(resamples):
+
+        base = statistics.median(rng.choices(baseline, k=len(baseline)))
+        new = statistics.median(rng.choices(candidate, k=len(candidate)))
+
+        if base > 0:
+
+            ratios.append(new / base)
+
+    if not ratios:
+
+        return None
+
+    ratios.sort()
+    tail = (1 - confidence) / 2
+
+    return ratios[int(tail * (len(ratios) - 1))], ratios[int((1 - tail) * (len(ratios) - 1))]
+
+
+def compare(baseline: Dict[str, Dict[Any, Dict[str, Any]]], candidate: Dict[str, Dict[Any, Dict[str, Any]]],
+            threshold: float, min_time: float, resamples: int, confidence: float,
+            rng: random.Random) -> List[Dict[str, Any]]:
+    """
+    Compares the cases found in both results.
+    Args:
+        baseline (dict): Results loaded by load_results.
+        candidate (dict): Results loaded by load_results.
+        threshold (float): Relative slowdown tolerated, 0.05 for 5%.
+        min_time (float): Baseline median in seconds under which a case cannot regress.
+        resamples (int): Bootstrap resamples of the intervals.
+        confidence (float): Confidence level of the intervals.
+        rng (random.Random): Generator of the resamples.
+    Returns:
+        list[dict]: One row per case with the medians, the ratio, its interval and the verdict.
+    """
+
+    rows = []
+
+    for test, inputs in baseline.items():
+
+        for size, base in inputs.items():
+
+            new = candidate.get(test, {}).get(size)
+
+            if new is None or base["median"] <= 0:
+
+                continue
+
+            ratio = new["median"] / base["median"]
+            ci = ratio_ci(base["samples"], new["samples"], resamples, confidence, rng)
+
+            # Inside the interval, or equal when there is no interval (e.g. a file compared with itself)
+            if (ci is not None and ci[0] <= 1 <= ci[1]) or ratio == 1:
+
+                verdict = "same"
+
+            elif base["median"] < min_time:
+
+                verdict = "too short"
+
+            elif ratio > 1 + threshold:
+
+                verdict = "REGRESSION"
+
+            elif ratio > 1:
+
+                verdict = "slower"
+
+            else:
+
+                verdict = "faster"
+
+            rows.append({
+                "test": test, "input": size, "baseline": base["median"], "candidate": new["median"],
+                "ratio": ratio, "ci": ci, "verdict": verdict,
+            })
+
+    return rows
+
+
+def print_table(baseline_path: str, candidate_path: str, rows: List[Dict[str, Any]], confidence: float) -> None:
+    """
+    Prints the comparison of one candidate as a table.
+    Args:
+        baseline_path (str): File of the baseline, for the title.
+        candidate_path (str): File of the candidate, for the title.
+        rows (list[dict]): Rows returned by compare.
+        confidence (float): Confidence level, for the header.
+    """
+
+    print(f"{candidate_path} vs {baseline_path} (ratio = candidate / baseline, lower is faster)")
+    print(f"{'test':<24} {'input':>8} {'baseline s':>12} {'candidate s':>12} {'ratio':>7} "
+          f"{f'{confidence:.0%} CI':>17}  verdict")
+
+    for row in rows:
+
+        ci = f"[{row['ci'][0]:.3f}, {row['ci'][1]:.3f}]" if row["ci"] else "n/a"
+        print(f"{row['test']:<24} {row['input']!s:>8} {row['baseline']:>12.6f} {row['candidate']:>12.6f} "
+              f"{row['ratio']:>7.3f} {ci:>17}  {row['verdict']}")
+
+    print()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compare PyRAM benchmark results against a baseline")
+    parser.add_argument("baseline", help="result file used as the reference")
+    parser.add_argument("candidates", nargs="+", help="result files compared with the baseline")
+    parser.add_argument("--threshold", type=float, default=0.05, help="tolerated slowdown, 0.05 for 5%%")
+    parser.add_argument("--min-time", type=float, default=0.0001, help="seconds under which a case is not gated")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of the intervals")
+    parser.add_argument("--bootstrap", type=int, default=2000, help="bootstrap resamples of the intervals")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the bootstrap")
+    args = parser.parse_args()
+
+    if args.threshold < 0 or not 0 < args.confidence < 1:
+
+        parser.error("--threshold must be >= 0 and --confidence between 0 and 1")
+
+    try:
+
+        baseline = load_results(args.baseline)
+        candidates = [(path, load_results(path)) for path in args.candidates]
+
+    except (OSError, ValueError) as e:
+
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    rng = random.Random(args.seed)
+    regressions = 0
+
+    for path, candidate in candidates:
+
+        rows = compare(baseline, candidate, args.threshold, args.min_time, args.bootstrap, args.confidence, rng)
+
+        if not rows:
+
+            print(f"Error: {path} has no test and input in common with {args.baseline}", file=sys.stderr)
+            sys.exit(2)
+
+        print_table(args.baseline, path, rows, args.confidence)
+        regressions += sum(row["verdict"] == "REGRESSION" for row in rows)
+
+    if regressions:
+
+        print(f"{regressions} case(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+        sys.exit(1)
@@ -12,11 +12,12 @@ Arguments:
     <output_image_name>: Base name for the output image files.
     FileNotFoundError: If the specified JSON file does not exist.
     ValueError: If the input file is not a JSON file, is not a file, or if the data format is invalid.
-Example JSON input format:
+Example JSON input format ("time" is the median, "ci_low"/"ci_high" are drawn as error bars when present):
 {
+    "metadata": {"interpreter": "pypy", ...},
     "test1": [
-        {"input": 100, "time": 0.01},
-        {"input": 200, "time": 0.02}
+        {"input": 100, "time": 0.01, "ci_low": 0.009, "ci_high": 0.011},
+        {"input": 200, "time": 0.02, "ci_low": 0.019, "ci_high": 0.022}
     ],
     "test2": [
         {"input": 100, "time": 0.015},
@@ -55,6 +56,17 @@ class JsonToLinearGraphic:
 
         for test_name in self.data.keys():
 
+            # Interpreter and machine the results come from and summary of the warmup curves, not tests
+            if test_name in ("metadata", "warmup"):
+
+                continue
+
+            # Warmup curve of benchmarks.py --warmup-curve, one point per iteration
+            if test_name in self.data.get("warmup", {}):
+
+                self.plot_warmup(self.data[test_name], self.data["warmup"][test_name], test_name)
+                continue
+
             if not isinstance(self.data[test_name], list):
 
                 raise ValueError(f"Invalid data format for test '{test_name}'. Expected a list.")
@@ -64,9 +76,18 @@ class JsonToLinearGraphic:
                 raise ValueError(f"No data found for test '{test_name}'.")
 
             labels: List[str] = [str(item['input']) for item in self.data[test_name]]
-            values: List[str] = [str(item['time']) for item in self.data[test_name]]
+            values: List[float] = [float(item['time']) for item in self.data[test_name]]
+            errors: List[List[float]] = []
+
+            # Confidence interval of the median, written by benchmarks.py since it repeats the runs
+            if all('ci_low' in item and 'ci_high' in item for item in self.data[test_name]):
 
-            self.plot(labels, values, test_name)
+                errors = [
+                    [value - item['ci_low'] for value, item in zip(values, self.data[test_name])],
+                    [item['ci_high'] - value for value, item in zip(values, self.data[test_name])],
+                ]
+
+            self.plot(labels, values, test_name, errors)
 
 
 
@@ -95,32 +116,63 @@ class JsonToLinearGraphic:
             return json.load(f)
         
 
-    def plot(self, labels: List[str], values: List[str], test: str):
+    def plot(self, labels: List[str], values: List[float], test: str, errors: List[List[float]] = None):
         """
         Plot the data as a linear graphic.
         :param labels: Labels for the x-axis.
         :param values: Values for the y-axis.
+        :param errors: Distances from each value to the bounds of its confidence interval, if any.
         """
 
         plt.figure(figsize=(10, 6))
-        plt.plot(labels, values, marker='o', linestyle='-', color='b')
+
+        if errors:
+
+            plt.errorbar(labels, values, yerr=errors, marker='o', linestyle='-', color='b', capsize=4)
+
+        else:
+
+            plt.plot(labels, values, marker='o', linestyle='-', color='b')
 
         self._set_plot_labels(test)
         self._save_plot(test)
 
         plt.close()
 
-    def _set_plot_labels(self, test_name: str):
+    def plot_warmup(self, points: List[Dict[str, float]], summary: Dict[str, float], test: str):
+        """
+        Plot the time of every iteration of a warmup curve, marking where the steady state starts.
+        :param points: Iterations of the curve, "input" is the iteration number.
+        :param summary: Summary of the curve, with steady_iteration and steady_time.
+        :param test: Name of the test.
+        """
+
+        plt.figure(figsize=(10, 6))
+        plt.plot([item['input'] for item in points], [float(item['time']) for item in points],
+                 marker='.', linestyle='-', color='b')
+        plt.axvline(summary['steady_iteration'], color='r', linestyle='--',
+                    label=f"steady from iteration {summary['steady_iteration']} ({summary['time_to_steady']:.3f} s)")
+        plt.axhline(summary['steady_time'], color='g', linestyle=':',
+                    label=f"steady time {summary['steady_time']:.6f} s")
+        plt.legend()
+
+        self._set_plot_labels(f"{test} warmup (input {summary['input']})", 'Iteration')
+        self._save_plot(test)
+
+        plt.close()
+
+    def _set_plot_labels(self, test_name: str, x_label: str = 'Input Size'):
         """
         Sets the labels and title for the plot using matplotlib.
         Parameters:
             test_name (str): The title to be displayed on the plot.
-        This method sets the x-axis label to 'Input Size', the y-axis label to 'Time (seconds)',
+            x_label (str): Label of the x-axis.
+        This method sets the x-axis label to x_label, the y-axis label to 'Time (seconds)',
         applies the provided test name as the plot title, enables the grid, and adjusts the layout
         for better appearance.
         """
 
-        plt.xlabel('Input Size')
+        plt.xlabel(x_label)
         plt.ylabel('Time (seconds)')
         plt.title(test_name)
 
@@ -0,0 +1,1281 @@
+"""
+macroBenchmarks.py
+Workloads closer to the code run by servers than the kernels of benchmarks.py, in the spirit of
+pyperformance: JSON and pickle serialization, regular expressions, unicode processing, generators,
+dict and set heavy code, and the classic object oriented programs nbody, richards, chaos and
+deltablue.
+
+Every workload is registered with the @register decorator of benchmarks.py in the "macro" suite and
+is measured the same way, with the same options and the same JSON output. A new workload only needs
+a function decorated with @register(name, sizes, make_args, suite="macro") in this file.
+
+Usage:
+    python3 macroBenchmarks.py [--only json_dumps,richards] [--skip deltablue] [--iterations 10] ...
+    python3 macroBenchmarks.py --warmup-curve
+
+With pyram --toram, copy both files to the RAM disk:
+    pyram --toram . --include benchmarks.py --include macroBenchmarks.py --args ./macroBenchmarks.py
+"""
+import re
+import json
+import math
+import pickle
+import random
+import unicodedata
+
+from typing import Any, Dict, Iterator, List
+
+from benchmarks import main, register
+
+# Words of the generated documents, with accents and other scripts for the unicode workload
+WORDS = [
+    "pyram", "memory", "server", "request", "worker", "latency", "cache", "python", "interpreter",
+    "café", "naïve", "façade", "straße", "élan", "Ωmega", "δelta", "привет", "данные", "日本語", "数据",
+]
+
+
+def random_text(words: int) -> str:
+
+    return " ".join(random.choice(WORDS) for _ in range(words))
+
+
+def json_document(size):
+    """
+    Builds a list of records like the payloads of a web API.
+    Args:
+        size (int): Number of records.
+    Returns:
+        tuple: The document, as the only argument of the workload.
+    """
+
+    return ([
+        {
+            "id": index,
+            "name": random_text(3),
+            "active": random.random() < 0.5,
+            "score": random.random() * 100,
+            "tags": [random.choice(WORDS) for _ in range(5)],
+            "address": {"street": random_text(2), "number": random.randint(1, 999), "zip": f"{random.randint(0, 99999):05d}"},
+            "history": [random.randint(0, 1000) for _ in range(10)],
+        }
+        for index in range(size)
+    ],)
+
+
+@register("json_dumps", [100, 1000, 10000], json_document, suite="macro")
+def json_dumps(document):
+
+    return json.dumps(document)
+
+
+@register("json_loads", [100, 1000, 10000], lambda size: (json.dumps(json_document(size)[0]),), suite="macro")
+def json_loads(text):
+
+    return json.loads(text)
+
+
+@register("pickle", [100, 1000, 10000], json_document, suite="macro")
+def pickle_round_trip(document):
+
+    return pickle.loads(pickle.dumps(document, pickle.HIGHEST_PROTOCOL))
+
+
+def log_lines(size):
+    """
+    Builds access log lines, with addresses, dates, paths and emails to match.
+    Args:
+        size (int): Number of lines.
+    Returns:
+        tuple: The log, as the only argument of the workload.
+    """
+
+    lines = []
+
+    for _ in range(size):
+
+        address = ".".join(str(random.randint(1, 254)) for _ in range(4))
+        user = random.choice(WORDS[:9])
+        lines.append(
+            f"{address} - {user}@example.com [2026-{random.randint(1, 12):02d}-{random.randint(1, 28):02d} "
+            f"{random.randint(0, 23):02d}:{random.randint(0, 59):02d}:{random.randint(0, 59):02d}] "
+            f"\"GET /api/v1/{user}/{random.randint(1, 100000)}?page={random.randint(1, 50)} HTTP/1.1\" "
+            f"{random.choice([200, 200, 200, 301, 404, 500])} {random.randint(100, 100000)}"
+        )
+
+    return ("\n".join(lines),)
+
+
+LOG_LINE = re.compile(r'^(\d+\.\d+\.\d+\.\d+) - (\S+) \[([^\]]+)\] "(\w+) ([^ ?"]+)(?:\?([^ "]*))? [^"]*" (\d{3}) (\d+)$', re.M)
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+NUMBER = re.compile(r"/(\d+)")
+
+
+@register("regex", [100, 1000, 10000], log_lines, suite="macro")
+def regex(log):
+    """
+    Parses a log with several expressions: full lines, searches, substitutions and splits.
+    Args:
+        log (str): Lines of log_lines.
+    Returns:
+        tuple: Bytes per status, emails found, the log with the dates rewritten and its number of fields.
+    """
+
+    sizes: Dict[str, int] = {}
+
+    for match in LOG_LINE.finditer(log):
+
+        sizes[match.group(7)] = sizes.get(match.group(7), 0) + int(match.group(8))
+
+    emails = EMAIL.findall(log)
+    rewritten = DATE.sub(r"\3/\2/\1", log)
+    ids = NUMBER.sub("/<id>", rewritten)
+
+    return sizes, len(emails), len(ids), len(re.split(r"[\s\[\]\"]+", log))
+
+
+@register("unicode", [100, 1000, 10000], lambda size: ([random_text(12) for _ in range(size)],), suite="macro")
+def unicode_processing(lines):
+    """
+    Normalizes, folds, slugifies and encodes text in several scripts.
+    Args:
+        lines (list[str]): Lines of words.
+    Returns:
+        tuple: Number of distinct slugs and total size in UTF-8 and UTF-16.
+    """
+
+    slugs = set()
+    utf8 = utf16 = 0
+
+    for line in lines:
+
+        folded = unicodedata.normalize("NFKC", line).casefold()
+        ascii_only = unicodedata.normalize("NFKD", folded).encode("ascii", "ignore").decode("ascii")
+        slugs.add("-".join(word for word in ascii_only.split() if word.isalnum()))
+        encoded = line.upper().encode("utf-8")
+        utf8 += len(encoded)
+        utf16 += len(encoded.decode("utf-8").title().encode("utf-16-le"))
+
+    return len(slugs), utf8, utf16
+
+
+class TreeNode:
+
+    def __init__(self, value: int, left: "TreeNode" = None, right: "TreeNode" = None):
+
+        self.value = value
+        self.left = left
+        self.right = right
+
+
+def build_tree(values: List[int]) -> TreeNode:
+
+    if not values:
+
+        return None
+
+    middle = len(values) // 2
+
+    return TreeNode(values[middle], build_tree(values[:middle]), build_tree(values[middle + 1:]))
+
+
+def walk(node: TreeNode) -> Iterator[int]:
+
+    if node is not None:
+
+        yield from walk(node.left)
+        yield node.value
+        yield from walk(node.right)
+
+
+@register("generators", [1000, 10000, 100000], lambda size: (build_tree(list(range(size))), size), suite="macro")
+def generators(tree, size):
+    """
+    Chains generators: an in-order walk of a tree with yield from, filters, maps and a sliding window.
+    Args:
+        tree (TreeNode): Balanced tree of the numbers below size.
+        size (int): Number of values of the tree.
+    Returns:
+        tuple: Sums computed along the pipeline.
+    """
+
+    def window(values: Iterator[int], width: int) -> Iterator[int]:
+
+        last: List[int] = []
+
+        for value in values:
+
+            last.append(value)
+
+            if len(last) > width:
+
+                del last[0]
+
+            yield sum(last)
+
+    evens = (value for value in walk(tree) if value % 2 == 0)
+    squares = (value * value for value in evens)
+    total = sum(window(squares, 8))
+    counted = sum(1 for _ in zip(walk(tree), range(size // 2)))
+
+    return total, counted
+
+
+@register("dict_set", [1000, 10000, 100000], lambda size: ([random.choice(WORDS) + str(random.randint(0, size // 10)) for _ in range(size)],), suite="macro")
+def dict_set(words):
+    """
+    Counts, groups, indexes and intersects words with dicts and sets.
+    Args:
+        words (list[str]): Words, many of them repeated.
+    Returns:
+        tuple: Sizes of the structures built.
+    """
+
+    counts: Dict[str, int] = {}
+
+    for word in words:
+
+        counts[word] = counts.get(word, 0) + 1
+
+    by_prefix: Dict[str, set] = {}
+
+    for word in counts:
+
+        by_prefix.setdefault(word[:3], set()).add(word)
+
+    positions = {word: index for index, word in enumerate(words)}
+    frequent = {word for word, count in counts.items() if count > 1}
+    rare = set(counts) - frequent
+    common = frequent & set(words[::2])
+    inverted = {count: sorted(word for word in counts if counts[word] == count) for count in set(counts.values())}
+
+    return len(counts), len(by_prefix), len(positions), len(rare), len(common), len(inverted)
+
+
+# nbody: the outer planets of the solar system, in astronomical units, years and solar masses
+SOLAR_MASS = 4 * math.pi * math.pi
+DAYS_PER_YEAR = 365.24
+
+BODIES = [
+    # Sun
+    ([0.0, 0.0, 0.0], [0.0, 0.0, 0.0], SOLAR_MASS),
+    # Jupiter
+    ([4.84143144246472090e+00, -1.16032004402742839e+00, -1.03622044471123109e-01],
+     [1.66007664274403694e-03 * DAYS_PER_YEAR, 7.69901118419740425e-03 * DAYS_PER_YEAR, -6.90460016972063023e-05 * DAYS_PER_YEAR],
+     9.54791938424326609e-04 * SOLAR_MASS),
+    # Saturn
+    ([8.34336671824457987e+00, 4.12479856412430479e+00, -4.03523417114321381e-01],
+     [-2.76742510726862411e-03 * DAYS_PER_YEAR, 4.99852801234917238e-03 * DAYS_PER_YEAR, 2.30417297573763929e-05 * DAYS_PER_YEAR],
+     2.85885980666130812e-04 * SOLAR_MASS),
+    # Uranus
+    ([1.28943695621391310e+01, -1.51111514016986312e+01, -2.23307578892655734e-01],
+     [2.96460137564761618e-03 * DAYS_PER_YEAR, 2.37847173959480950e-03 * DAYS_PER_YEAR, -2.96589568540237556e-05 * DAYS_PER_YEAR],
+     4.36624404335156298e-05 * SOLAR_MASS),
+    # Neptune
+    ([1.53796971148509165e+01, -2.59193146099879641e+01, 1.79258772950371181e-01],
+     [2.68067772490389322e-03 * DAYS_PER_YEAR, 1.62824170038242295e-03 * DAYS_PER_YEAR, -9.51592254519715870e-05 * DAYS_PER_YEAR],
+     5.15138902046611451e-05 * SOLAR_MASS),
+]
+
+
+def nbody_system(steps):
+    """
+    Copies the bodies, so every iteration starts from the same state, and sets the momentum of the sun.
+    Args:
+        steps (int): Number of steps of the simulation.
+    Returns:
+        tuple: The bodies and the number of steps.
+    """
+
+    bodies = [([*position], [*velocity], mass) for position, velocity, mass in BODIES]
+    px = py = pz = 0.0
+
+    for _, (vx, vy, vz), mass in bodies:
+
+        px -= vx * mass
+        py -= vy * mass
+        pz -= vz * mass
+
+    sun_velocity = bodies[0][1]
+    sun_velocity[0], sun_velocity[1], sun_velocity[2] = px / SOLAR_MASS, py / SOLAR_MASS, pz / SOLAR_MASS
+
+    return bodies, steps
+
+
+def energy(bodies) -> float:
+
+    total = 0.0
+
+    for index, ((x1, y1, z1), (vx, vy, vz), m1) in enumerate(bodies):
+
+        total += 0.5 * m1 * (vx * vx + vy * vy + vz * vz)
+
+        for (x2, y2, z2), _, m2 in bodies[index + 1:]:
+
+            total -= m1 * m2 / math.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2)
+
+    return total
+
+
+@register("nbody", [1000, 5000, 20000], nbody_system, suite="macro")
+def nbody(bodies, steps, dt=0.01):
+    """
+    Simulates the orbits of the planets with floating point arithmetic on lists.
+    Args:
+        bodies (list): Positions, velocities and masses from nbody_system.
+        steps (int): Number of steps.
+        dt (float): Length of a step in years.
+    Returns:
+        tuple: Energy of the system before and after the simulation.
+    """
+
+    pairs = [(bodies[i], bodies[j]) for i in range(len(bodies)) for j in range(i + 1, len(bodies))]
+    before = energy(bodies)
+
+    for _ in range(steps):
+
+        for ((x1, y1, z1), v1, m1), ((x2, y2, z2), v2, m2) in pairs:
+
+            dx, dy, dz = x1 - x2, y1 - y2, z1 - z2
+            magnitude = dt * ((dx * dx + dy * dy + dz * dz) ** -1.5)
+            b1, b2 = m1 * magnitude, m2 * magnitude
+            v1[0] -= dx * b2
+            v1[1] -= dy * b2
+            v1[2] -= dz * b2
+            v2[0] += dx * b1
+            v2[1] += dy * b1
+            v2[2] += dz * b1
+
+        for position, (vx, vy, vz), _ in bodies:
+
+            position[0] += dt * vx
+            position[1] += dt * vy
+            position[2] += dt * vz
+
+    return before, energy(bodies)
+
+
+# richards: Martin Richards' simulation of the task dispatcher of an operating system
+I_IDLE, I_WORK, I_HANDLERA, I_HANDLERB, I_DEVA, I_DEVB = 1, 2, 3, 4, 5, 6
+K_DEV, K_WORK = 1000, 1001
+BUFSIZE = 4
+
+
+class Packet:
+
+    def __init__(self, link, ident, kind):
+
+        self.link = link
+        self.ident = ident
+        self.kind = kind
+        self.datum = 0
+        self.data = [0] * BUFSIZE
+
+    def append_to(self, queue):
+
+        self.link = None
+
+        if queue is None:
+
+            return self
+
+        last = queue
+
+        while last.link is not None:
+
+            last = last.link
+
+        last.link = self
+
+        return queue
+
+
+class DeviceTaskRec:
+
+    def __init__(self):
+
+        self.pending = None
+
+
+class IdleTaskRec:
+
+    def __init__(self):
+
+        self.control = 1
+        self.count = 10000
+
+
+class HandlerTaskRec:
+
+    def __init__(self):
+
+        self.work_in = None
+        self.device_in = None
+
+
+class WorkerTaskRec:
+
+    def __init__(self):
+
+        self.destination = I_HANDLERA
+        self.count = 0
+
+
+class Scheduler:
+    """
+    Tasks of one run and the counters checked at its end.
+    """
+
+    def __init__(self):
+
+        self.tasks = [None] * 10
+        self.task_list = None
+        self.hold_count = 0
+        self.qpkt_count = 0
+
+    def run(self):
+
+        task = self.task_list
+
+        while task is not None:
+
+            if task.is_holding_or_waiting():
+
+                task = task.link
+
+            else:
+
+                task = task.run_task()
+
+
+class Task:
+
+    def __init__(self, scheduler, ident, priority, queue, packet_pending, waiting, record):
+
+        self.scheduler = scheduler
+        self.link = scheduler.task_list
+        self.ident = ident
+        self.priority = priority
+        self.input = queue
+        self.packet_pending = packet_pending
+        self.task_waiting = waiting
+        self.task_holding = False
+        self.record = record
+        scheduler.task_list = self
+        scheduler.tasks[ident] = self
+
+    def is_holding_or_waiting(self):
+
+        return self.task_holding or (not self.packet_pending and self.task_waiting)
+
+    def add_packet(self, packet, old):
+
+        if self.input is None:
+
+            self.input = packet
+            self.packet_pending = True
+
+            if self.priority > old.priority:
+
+                return self
+
+        else:
+
+            packet.append_to(self.input)
+
+        return old
+
+    def run_task(self):
+
+        if self.packet_pending and self.task_waiting and not self.task_holding:
+
+            packet = self.input
+            self.input = packet.link
+            self.packet_pending = self.input is not None
+            self.task_waiting = False
+
+        else:
+
+            packet = None
+
+        return self.fn(packet, self.record)
+
+    def fn(self, packet, record):
+
+        raise NotImplementedError
+
+    def wait_task(self):
+
+        self.task_waiting = True
+
+        return self
+
+    def hold(self):
+
+        self.scheduler.hold_count += 1
+        self.task_holding = True
+
+        return self.link
+
+    def release(self, ident):
+
+        task = self.scheduler.tasks[ident]
+        task.task_holding = False
+
+        return task if task.priority > self.priority else self
+
+    def qpkt(self, packet):
+
+        task = self.scheduler.tasks[packet.ident]
+        self.scheduler.qpkt_count += 1
+        packet.link = None
+        packet.ident = self.ident
+
+        return task.add_packet(packet, self)
+
+
+class DeviceTask(Task):
+
+    def fn(self, packet, record):
+
+        if packet is None:
+
+            packet = record.pending
+
+            if packet is None:
+
+                return self.wait_task()
+
+            record.pending = None
+
+            return self.qpkt(packet)
+
+        record.pending = packet
+
+        return self.hold()
+
+
+class HandlerTask(Task):
+
+    def fn(self, packet, record):
+
+        if packet is not None:
+
+            if packet.kind == K_WORK:
+
+                record.work_in = packet.append_to(record.work_in)
+
+            else:
+
+                record.device_in = packet.append_to(record.device_in)
+
+        work = record.work_in
+
+        if work is None:
+
+            return self.wait_task()
+
+        count = work.datum
+
+        if count >= BUFSIZE:
+
+            record.work_in = work.link
+
+            return self.qpkt(work)
+
+        device = record.device_in
+
+        if device is None:
+
+            return self.wait_task()
+
+        record.device_in = device.link
+        device.datum = work.data[count]
+        work.datum = count + 1
+
+        return self.qpkt(device)
+
+
+class IdleTask(Task):
+
+    def fn(self, packet, record):
+
+        record.count -= 1
+
+        if record.count == 0:
+
+            return self.hold()
+
+        if record.control & 1 == 0:
+
+            record.control //= 2
+
+            return self.release(I_DEVA)
+
+        record.control = (record.control // 2) ^ 0xD008
+
+        return self.release(I_DEVB)
+
+
+class WorkTask(Task):
+
+    def fn(self, packet, record):
+
+        if packet is None:
+
+            return self.wait_task()
+
+        record.destination = I_HANDLERB if record.destination == I_HANDLERA else I_HANDLERA
+        packet.ident = record.destination
+        packet.datum = 0
+
+        for index in range(BUFSIZE):
+
+            record.count = record.count % 26 + 1
+            packet.data[index] = ord("A") + record.count - 1
+
+        return self.qpkt(packet)
+
+
+@register("richards", [1, 3, 5], suite="macro")
+def richards(iterations):
+    """
+    Runs the task dispatcher simulation and checks its counters.
+    Args:
+        iterations (int): Number of simulations.
+    Returns:
+        int: Number of packets queued by the last simulation.
+    """
+
+    for _ in range(iterations):
+
+        scheduler = Scheduler()
+        IdleTask(scheduler, I_IDLE, 1, None, False, False, IdleTaskRec())
+
+        queue = Packet(Packet(None, 0, K_WORK), 0, K_WORK)
+        WorkTask(scheduler, I_WORK, 1000, queue, True, True, WorkerTaskRec())
+
+        queue = Packet(Packet(Packet(None, I_DEVA, K_DEV), I_DEVA, K_DEV), I_DEVA, K_DEV)
+        HandlerTask(scheduler, I_HANDLERA, 2000, queue, True, True, HandlerTaskRec())
+
+        queue = Packet(Packet(Packet(None, I_DEVB, K_DEV), I_DEVB, K_DEV), I_DEVB, K_DEV)
+        HandlerTask(scheduler, I_HANDLERB, 3000, queue, True, True, HandlerTaskRec())
+
+        DeviceTask(scheduler, I_DEVA, 4000, None, False, True, DeviceTaskRec())
+        DeviceTask(scheduler, I_DEVB, 5000, None, False, True, DeviceTaskRec())
+
+        scheduler.run()
+
+        if scheduler.hold_count != 9297 or scheduler.qpkt_count != 23246:
+
+            raise RuntimeError(f"richards: wrong result {scheduler.hold_count} {scheduler.qpkt_count}")
+
+    return scheduler.qpkt_count
+
+
+class Vector:
+    """
+    Point of the plane, the chaos game computes with many short-lived instances.
+    """
+
+    def __init__(self, x: float, y: float):
+
+        self.x = x
+        self.y = y
+
+    def __add__(self, other: "Vector") -> "Vector":
+
+        return Vector(self.x + other.x, self.y + other.y)
+
+    def __mul__(self, factor: float) -> "Vector":
+
+        return Vector(self.x * factor, self.y * factor)
+
+    def rotate(self, angle: float) -> "Vector":
+
+        cos, sin = math.cos(angle), math.sin(angle)
+
+        return Vector(self.x * cos - self.y * sin, self.x * sin + self.y * cos)
+
+
+# Affine maps of the chaos game (scale, rotation, translation) with their weights
+CHAOS_MAPS = [
+    (0.5, 0.0, Vector(0.0, 0.0), 1.0),
+    (0.5, 0.0, Vector(0.5, 0.0), 1.0),
+    (0.5, 0.0, Vector(0.25, 0.433), 1.0),
+    (0.3, math.pi / 6, Vector(0.35, 0.2), 0.5),
+]
+
+
+@register("chaos", [1000, 10000, 50000], suite="macro")
+def chaos(points, width=256, height=256):
+    """
+    Draws a fractal with the chaos game: a point jumps by randomly chosen affine maps and every
+    position it reaches is painted on a grid.
+    Args:
+        points (int): Number of jumps.
+        width (int): Width of the grid.
+        height (int): Height of the grid.
+    Returns:
+        int: Number of painted cells.
+    """
+
+    grid = [[0] * width for _ in range(height)]
+    weights = [weight for _, _, _, weight in CHAOS_MAPS]
+    point = Vector(random.random(), random.random())
+
+    for _ in range(points):
+
+        scale, angle, offset, _ = random.choices(CHAOS_MAPS, weights)[0]
+        point = point.rotate(angle) * scale + offset
+        x = min(width - 1, max(0, int(point.x * width)))
+        y = min(height - 1, max(0, int(point.y * height)))
+        grid[y][x] += 1
+
+    return sum(1 for row in grid for cell in row if cell)
+
+
+# deltablue: the incremental constraint solver of Freeman-Benson and Maloney
+class Strength:
+
+    def __init__(self, strength: int, name: str):
+
+        self.strength = strength
+        self.name = name
+
+    @staticmethod
+    def stronger(s1: "Strength", s2: "Strength") -> bool:
+
+        return s1.strength < s2.strength
+
+    @staticmethod
+    def weaker(s1: "Strength", s2: "Strength") -> bool:
+
+        return s1.strength > s2.strength
+
+    @staticmethod
+    def weakest_of(s1: "Strength", s2: "Strength") -> "Strength":
+
+        return s1 if Strength.weaker(s1, s2) else s2
+
+    def next_weaker(self) -> "Strength":
+
+        return STRENGTHS[self.strength + 1]
+
+
+STRENGTHS = [
+    Strength(index, name) for index, name in enumerate(
+        ["required", "strongPreferred", "preferred", "strongDefault", "normal", "weakDefault", "weakest"]
+    )
+]
+REQUIRED, STRONG_PREFERRED, PREFERRED, STRONG_DEFAULT, NORMAL, WEAK_DEFAULT, WEAKEST = STRENGTHS
+
+FORWARD, BACKWARD, NONE = 1, -1, 0
+
+
+class Variable:
+
+    def __init__(self, name: str, value: float = 0):
+
+        self.name = name
+        self.value = value
+        self.constraints: List["Constraint"] = []
+        self.determined_by = None
+        self.mark = 0
+        self.walk_strength = WEAKEST
+        self.stay = True
+
+    def remove_constraint(self, constraint: "Constraint") -> None:
+
+        self.constraints.remove(constraint)
+
+        if self.determined_by is constraint:
+
+            self.determined_by = None
+
+
+class Constraint:
+
+    def __init__(self, planner: "Planner", strength: Strength):
+
+        self.planner = planner
+        self.strength = strength
+
+    def add_constraint(self) -> None:
+
+        self.add_to_graph()
+        self.planner.incremental_add(self)
+
+    def satisfy(self, mark: int) -> "Constraint":
+
+        self.choose_method(mark)
+
+        if not self.is_satisfied():
+
+            if self.strength is REQUIRED:
+
+                raise RuntimeError("deltablue: could not satisfy a required constraint")
+
+            return None
+
+        self.mark_inputs(mark)
+        out = self.output()
+        overridden = out.determined_by
+
+        if overridden is not None:
+
+            overridden.mark_unsatisfied()
+
+        out.determined_by = self
+
+        if not self.planner.add_propagate(self, mark):
+
+            raise RuntimeError("deltablue: cycle encountered")
+
+        out.mark = mark
+
+        return overridden
+
+    def destroy_constraint(self) -> None:
+
+        if self.is_satisfied():
+
+            self.planner.incremental_remove(self)
+
+        else:
+
+            self.remove_from_graph()
+
+    def is_input(self) -> bool:
+
+        return False
+
+
+class UnaryConstraint(Constraint):
+
+    def __init__(self, planner: "Planner", variable: Variable, strength: Strength):
+
+        super().__init__(planner, strength)
+        self.my_output = variable
+        self.satisfied = False
+        self.add_constraint()
+
+    def add_to_graph(self) -> None:
+
+        self.my_output.constraints.append(self)
+        self.satisfied = False
+
+    def choose_method(self, mark: int) -> None:
+
+        self.satisfied = self.my_output.mark != mark and Strength.stronger(self.strength, self.my_output.walk_strength)
+
+    def is_satisfied(self) -> bool:
+
+        return self.satisfied
+
+    def mark_inputs(self, mark: int) -> None:
+
+        pass
+
+    def output(self) -> Variable:
+
+        return self.my_output
+
+    def recalculate(self) -> None:
+
+        self.my_output.walk_strength = self.strength
+        self.my_output.stay = not self.is_input()
+
+        if self.my_output.stay:
+
+            self.execute()
+
+    def mark_unsatisfied(self) -> None:
+
+        self.satisfied = False
+
+    def inputs_known(self, mark: int) -> bool:
+
+        return True
+
+    def remove_from_graph(self) -> None:
+
+        self.my_output.remove_constraint(self)
+        self.satisfied = False
+
+    def execute(self) -> None:
+
+        pass
+
+
+class StayConstraint(UnaryConstraint):
+    """
+    Keeps a variable at its value unless a stronger constraint changes it.
+    """
+
+
+class EditConstraint(UnaryConstraint):
+    """
+    Marks a variable changed from outside the solver.
+    """
+
+    def is_input(self) -> bool:
+
+        return True
+
+
+class BinaryConstraint(Constraint):
+
+    def __init__(self, planner: "Planner", v1: Variable, v2: Variable, strength: Strength):
+
+        super().__init__(planner, strength)
+        self.v1 = v1
+        self.v2 = v2
+        self.direction = NONE
+        self.add_constraint()
+
+    def choose_method(self, mark: int) -> None:
+
+        if self.v1.mark == mark:
+
+            forward = self.v2.mark != mark and Strength.stronger(self.strength, self.v2.walk_strength)
+            self.direction = FORWARD if forward else NONE
+
+        elif self.v2.mark == mark:
+
+            backward = self.v1.mark != mark and Strength.stronger(self.strength, self.v1.walk_strength)
+            self.direction = BACKWARD if backward else NONE
+
+        elif Strength.weaker(self.v1.walk_strength, self.v2.walk_strength):
+
+            self.direction = BACKWARD if Strength.stronger(self.strength, self.v1.walk_strength) else NONE
+
+        else:
+
+            self.direction = FORWARD if Strength.stronger(self.strength, self.v2.walk_strength) else NONE
+
+    def add_to_graph(self) -> None:
+
+        self.v1.constraints.append(self)
+        self.v2.constraints.append(self)
+        self.direction = NONE
+
+    def is_satisfied(self) -> bool:
+
+        return self.direction != NONE
+
+    def mark_inputs(self, mark: int) -> None:
+
+        self.input().mark = mark
+
+    def input(self) -> Variable:
+
+        return self.v1 if self.direction == FORWARD else self.v2
+
+    def output(self) -> Variable:
+
+        return self.v2 if self.direction == FORWARD else self.v1
+
+    def recalculate(self) -> None:
+
+        source, out = self.input(), self.output()
+        out.walk_strength = Strength.weakest_of(self.strength, source.walk_strength)
+        out.stay = source.stay
+
+        if out.stay:
+
+            self.execute()
+
+    def mark_unsatisfied(self) -> None:
+
+        self.direction = NONE
+
+    def inputs_known(self, mark: int) -> bool:
+
+        source = self.input()
+
+        return source.mark == mark or source.stay or source.determined_by is None
+
+    def remove_from_graph(self) -> None:
+
+        self.v1.remove_constraint(self)
+        self.v2.remove_constraint(self)
+        self.direction = NONE
+
+
+class ScaleConstraint(BinaryConstraint):
+    """
+    dest = src * scale + offset, in either direction.
+    """
+
+    def __init__(self, planner: "Planner", src: Variable, scale: Variable, offset: Variable, dest: Variable,
+                 strength: Strength):
+
+        self.scale = scale
+        self.offset = offset
+        super().__init__(planner, src, dest, strength)
+
+    def add_to_graph(self) -> None:
+
+        super().add_to_graph()
+        self.scale.constraints.append(self)
+        self.offset.constraints.append(self)
+
+    def remove_from_graph(self) -> None:
+
+        super().remove_from_graph()
+        self.scale.remove_constraint(self)
+        self.offset.remove_constraint(self)
+
+    def mark_inputs(self, mark: int) -> None:
+
+        super().mark_inputs(mark)
+        self.scale.mark = self.offset.mark = mark
+
+    def execute(self) -> None:
+
+        if self.direction == FORWARD:
+
+            self.v2.value = self.v1.value * self.scale.value + self.offset.value
+
+        else:
+
+            self.v1.value = (self.v2.value - self.offset.value) / self.scale.value
+
+    def recalculate(self) -> None:
+
+        source, out = self.input(), self.output()
+        out.walk_strength = Strength.weakest_of(self.strength, source.walk_strength)
+        out.stay = source.stay and self.scale.stay and self.offset.stay
+
+        if out.stay:
+
+            self.execute()
+
+
+class EqualityConstraint(BinaryConstraint):
+
+    def execute(self) -> None:
+
+        self.output().value = self.input().value
+
+
+class Planner:
+
+    def __init__(self):
+
+        self.current_mark = 0
+
+    def new_mark(self) -> int:
+
+        self.current_mark += 1
+
+        return self.current_mark
+
+    def incremental_add(self, constraint: Constraint) -> None:
+
+        mark = self.new_mark()
+        overridden = constraint.satisfy(mark)
+
+        while overridden is not None:
+
+            overridden = overridden.satisfy(mark)
+
+    def incremental_remove(self, constraint: Constraint) -> None:
+
+        out = constraint.output()
+        constraint.mark_unsatisfied()
+        constraint.remove_from_graph()
+        unsatisfied = self.remove_propagate_from(out)
+        strength = REQUIRED
+
+        while strength is not WEAKEST:
+
+            for candidate in unsatisfied:
+
+                if candidate.strength is strength:
+
+                    self.incremental_add(candidate)
+
+            strength = strength.next_weaker()
+
+    def make_plan(self, sources: List[Constraint]) -> List[Constraint]:
+
+        mark = self.new_mark()
+        plan = []
+        todo = sources
+
+        while todo:
+
+            constraint = todo.pop(0)
+
+            if constraint.output().mark != mark and constraint.inputs_known(mark):
+
+                plan.append(constraint)
+                constraint.output().mark = mark
+                self.add_constraints_consuming_to(constraint.output(), todo)
+
+        return plan
+
+    def extract_plan(self, constraints: List[Constraint]) -> List[Constraint]:
+
+        return self.make_plan([c for c in constraints if c.is_input() and c.is_satisfied()])
+
+    def add_propagate(self, constraint: Constraint, mark: int) -> bool:
+
+        todo = [constraint]
+
+        while todo:
+
+            current = todo.pop(0)
+
+            if current.output().mark == mark:
+
+                self.incremental_remove(constraint)
+
+                return False
+
+            current.recalculate()
+            self.add_constraints_consuming_to(current.output(), todo)
+
+        return True
+
+    def remove_propagate_from(self, out: Variable) -> List[Constraint]:
+
+        out.determined_by = None
+        out.walk_strength = WEAKEST
+        out.stay = True
+        unsatisfied = []
+        todo = [out]
+
+        while todo:
+
+            variable = todo.pop(0)
+
+            for constraint in variable.constraints:
+
+                if not constraint.is_satisfied():
+
+                    unsatisfied.append(constraint)
+
+            for constraint in variable.constraints:
+
+                if constraint is not variable.determined_by and constraint.is_satisfied():
+
+                    constraint.recalculate()
+                    todo.append(constraint.output())
+
+        return unsatisfied
+
+    def add_constraints_consuming_to(self, variable: Variable, todo: List[Constraint]) -> None:
+
+        for constraint in variable.constraints:
+
+            if constraint is not variable.determined_by and constraint.is_satisfied():
+
+                todo.append(constraint)
+
+
+def change(planner: Planner, variable: Variable, value: float) -> None:
+
+    edit = EditConstraint(planner, variable, PREFERRED)
+    plan = planner.extract_plan([edit])
+
+    for _ in range(10):
+
+        variable.value = value
+
+        for constraint in plan:
+
+            constraint.execute()
+
+    edit.destroy_constraint()
+
+
+def chain_test(n: int) -> None:
+    """
+    A chain of n equality constraints, the value edited at one end must reach the other one.
+    """
+
+    planner = Planner()
+    variables = [Variable(f"v{index}") for index in range(n + 1)]
+
+    for previous, current in zip(variables, variables[1:]):
+
+        EqualityConstraint(planner, previous, current, REQUIRED)
+
+    first, last = variables[0], variables[-1]
+    StayConstraint(planner, last, STRONG_DEFAULT)
+    plan = planner.extract_plan([EditConstraint(planner, first, PREFERRED)])
+
+    for value in range(100):
+
+        first.value = value
+
+        for constraint in plan:
+
+            constraint.execute()
+
+        if last.value != value:
+
+            raise RuntimeError("deltablue: chain test failed")
+
+
+def projection_test(n: int) -> None:
+    """
+    n scale constraints sharing their scale and offset, edited from both sides.
+    """
+
+    planner = Planner()
+    scale = Variable("scale", 10)
+    offset = Variable("offset", 1000)
+    dests = []
+
+    for index in range(n):
+
+        src = Variable(f"src{index}", index)
+        dst = Variable(f"dst{index}", index)
+        dests.append(dst)
+        StayConstraint(planner, src, NORMAL)
+        ScaleConstraint(planner, src, scale, offset, dst, REQUIRED)
+
+    change(planner, src, 17)
+
+    if dst.value != 1170:
+
+        raise RuntimeError("deltablue: projection test 1 failed")
+
+    change(planner, dst, 1050)
+
+    if src.value != 5:
+
+        raise RuntimeError("deltablue: projection test 2 failed")
+
+    change(planner, scale, 5)
+
+    if any(dests[index].value != index * 5 + 1000 for index in range(n - 1)):
+
+        raise RuntimeError("deltablue: projection test 3 failed")
+
+    change(planner, offset, 2000)
+
+    if any(dests[index].value != index * 5 + 2000 for index in range(n - 1)):
+
+        raise RuntimeError("deltablue: projection test 4 failed")
+
+
+@register("deltablue", [100, 1000, 5000], suite="macro")
+def deltablue(n):
+    """
+    Runs the chain and projection tests of deltablue, which check their own results.
+    Args:
+        n (int): Number of constraints of each test.
+    """
+
+    chain_test(n)
+    projection_test(n)
+
+
+if __name__ == "__main__":
+
+    main("macro")
@@ -37,6 +37,9 @@ cp ./jsonToLinearGraphic.py ./matplotlib/jsonToLinearGraphic.py
 mkdir -p ./tests/
 mkdir -p ./data/
 
+# Options of benchmarks.py, e.g. BENCH_ARGS="--warmups 5 --iterations 30"
+BENCH_ARGS="${BENCH_ARGS:-}"
+
 # Array of interpreters and output names
 
 interpreters=("pyram" "pypy3" "python3")
@@ -58,11 +61,11 @@ for i in "${!interpreters[@]}"; do
 
     if [ "$interp" = "pyram" ]; then
 
-      pyram --toram "./benchmarks.py" > "./tests/${outname}.json"
+      pyram --toram --args "./benchmarks.py" $BENCH_ARGS > "./tests/${outname}.json"
 
     else
 
-      $interp benchmarks.py > "./tests/${outname}.json"
+      $interp benchmarks.py $BENCH_ARGS > "./tests/${outname}.json"
 
     fi
 
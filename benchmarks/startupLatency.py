@@ -0,0 +1,259 @@
+"""
+startupLatency.py
+Measures the end-to-end start of a Python process, the part benchmarks.py never sees: the time
+from launching the interpreter until a small script which imports a library has finished.
+
+Every workload (an empty script, an import of Django, an import of NumPy) is run by every
+interpreter, pyram from the disk, pyram --toram, pypy3 and python3, in two modes:
+    - cold: the page cache is dropped before each run and pyram extracts the PyPy tree again
+      (PYRAM_COLD=1), as after a reboot.
+    - warm: the same command again and again, after a few unmeasured runs.
+
+Workloads whose library cannot be imported by an interpreter are skipped for it.
+
+Usage (as root for the cold mode and --toram, pyram must be installed):
+    python3 startupLatency.py [--runs 20] [--warmups 2] [--modes cold,warm]
+                              [--interpreters pyram,pyram_toram,pypy3,python3]
+                              [--workloads empty,django,numpy]
+
+Output: a JSON object in the benchmarks.py format, one test per workload and mode where "input"
+is the interpreter, "time" the median wall clock time in seconds:
+{
+    "metadata": {...},
+    "numpy_warm": [
+        {"input": "pyram", "time": 0.21, "median": 0.21, "ci_low": 0.20, "ci_high": 0.22, ...},
+        {"input": "python3", "time": 0.09, ...},
+        ...
+    ]
+}
+
+compareResults.py and jsonToLinearGraphic.py read it like the other results.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from typing import Any, Dict, List
+
+from benchmarks import machine_metadata, summarize
+
+# Code of each workload, run as a script file
+WORKLOADS: Dict[str, str] = {
+    "empty": "pass\n",
+    "django": "import django\nimport django.core.handlers.wsgi\nimport django.db.models\n",
+    "numpy": "import numpy\n",
+}
+
+# Command running a script of the working directory with each interpreter
+INTERPRETERS: Dict[str, List[str]] = {
+    "pyram": ["pyram"],
+    "pyram_toram": ["pyram", "--toram"],
+    "pypy3": ["pypy3"],
+    "python3": ["python3"],
+}
+
+MODES = ["cold", "warm"]
+
+
+def drop_caches() -> None:
+    """
+    Writes dirty pages and drops the page cache, so the interpreter and the libraries are read from the disk.
+    """
+
+    os.sync()
+
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+
+        f.write("3\n")
+
+
+def run_once(interpreter: str, script: str, cold: bool) -> float:
+    """
+    Runs a workload once.
+    Args:
+        interpreter (str): One of the keys of INTERPRETERS.
+        script (str): Path of the workload script.
+        cold (bool): Drop the page cache first and make pyram extract the PyPy tree again.
+    Returns:
+        float: Wall clock time of the run in seconds.
+    """
+
+    env = dict(os.environ)
+
+    if cold:
+
+        env["PYRAM_COLD"] = "1"
+        drop_caches()
+
+    start = time.perf_counter_ns()
+    subprocess.run(
+        INTERPRETERS[interpreter] + [f"./{os.path.basename(script)}"],
+        cwd=os.path.dirname(script), env=env, check=True, stdout=subprocess.DEVNULL
+    )
+
+    return (time.perf_counter_ns() - start) / 1e9
+
+
+def can_run(interpreter: str, script: str) -> bool:
+    """
+    Checks that an interpreter can run a workload, e.g. that it has NumPy.
+    Args:
+        interpreter (str): One of the keys of INTERPRETERS.
+        script (str): Path of the workload script.
+    Returns:
+        bool: True when the workload ends successfully.
+    """
+
+    result = subprocess.run(
+        INTERPRETERS[interpreter] + [f"./{os.path.basename(script)}"],
+        cwd=os.path.dirname(script), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    return result.returncode == 0
+
+
+def benchmark(interpreters: List[str], workloads: List[str], modes: List[str], runs: int, warmups: int,
+              resamples: int = 2000, confidence: float = 0.95, seed: int = 0) -> Dict[str, Any]:
+    """
+    Times the start of every workload with every interpreter in every mode.
+    Args:
+        interpreters (list[str]): Keys of INTERPRETERS.
+        workloads (list[str]): Keys of WORKLOADS.
+        modes (list[str]): "cold" and/or "warm".
+        runs (int): Measured runs per workload, interpreter and mode.
+        warmups (int): Unmeasured runs before the warm ones.
+        resamples (int): Bootstrap resamples of the confidence intervals.
+        confidence (float): Confidence level of the intervals.
+        seed (int): Seed of the bootstrap.
+    Returns:
+        dict: The metadata and one list of results per workload and mode.
+    """
+
+    rng = random.Random(seed)
+    results: Dict[str, Any] = {"metadata": machine_metadata()}
+    results["metadata"].update({
+        "runs": runs, "warmups": warmups, "modes": modes, "bootstrap_resamples": resamples,
+        "confidence": confidence, "seed": seed,
+    })
+
+    for interpreter in interpreters:
+
+        if shutil.which(INTERPRETERS[interpreter][0]) is None:
+
+            print(f"Interpreter {interpreter} not found, skipping...", file=sys.stderr)
+
+    interpreters = [interpreter for interpreter in interpreters if shutil.which(INTERPRETERS[interpreter][0])]
+    workdir = tempfile.mkdtemp(prefix="pyram_startup_")
+
+    try:
+
+        for workload in workloads:
+
+            script = os.path.join(workdir, f"{workload}.py")
+
+            with open(script, "w") as f:
+
+                f.write(WORKLOADS[workload])
+
+            available = []
+
+            for interpreter in interpreters:
+
+                if can_run(interpreter, script):
+
+                    available.append(interpreter)
+
+                else:
+
+                    print(f"{interpreter} cannot run the {workload} workload, skipping...", file=sys.stderr)
+
+            for mode in modes:
+
+                results[f"{workload}_{mode}"] = []
+
+                for interpreter in available:
+
+                    if mode == "warm":
+
+                        for _ in range(warmups):
+
+                            run_once(interpreter, script, False)
+
+                    samples = [run_once(interpreter, script, mode == "cold") for _ in range(runs)]
+                    results[f"{workload}_{mode}"].append(
+                        dict(input=interpreter, **summarize(samples, resamples, confidence, rng))
+                    )
+
+                if not results[f"{workload}_{mode}"]:
+
+                    del results[f"{workload}_{mode}"]
+
+    finally:
+
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def parse_list(value: str, choices: List[str], option: str, parser: argparse.ArgumentParser) -> List[str]:
+    """
+    Splits a comma separated option and checks its items.
+    Args:
+        value (str): Value of the option.
+        choices (list[str]): Accepted items.
+        option (str): Name of the option, for the error.
+        parser (argparse.ArgumentParser): Parser reporting the error.
+    Returns:
+        list[str]: The items, in the order given.
+    """
+
+    items = [item for item in value.split(",") if item]
+    unknown = [item for item in items if item not in choices]
+
+    if not items or unknown:
+
+        parser.error(f"{option} accepts {', '.join(choices)}")
+
+    return items
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compare the start time of PyRAM, pypy3 and python3")
+    parser.add_argument("--runs", type=int, default=20, help="measured runs per workload, interpreter and mode")
+    parser.add_argument("--warmups", type=int, default=2, help="unmeasured runs before the warm ones")
+    parser.add_argument("--modes", default="cold,warm", help="cold and/or warm")
+    parser.add_argument("--interpreters", default=",".join(INTERPRETERS), help="interpreters to compare")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="workloads to run")
+    parser.add_argument("--bootstrap", type=int, default=2000, help="bootstrap resamples of the confidence interval")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of the interval")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the bootstrap")
+    args = parser.parse_args()
+
+    modes = parse_list(args.modes, MODES, "--modes", parser)
+    interpreters = parse_list(args.interpreters, list(INTERPRETERS), "--interpreters", parser)
+    workloads = parse_list(args.workloads, list(WORKLOADS), "--workloads", parser)
+
+    if args.runs < 1 or args.warmups < 0 or not 0 < args.confidence < 1:
+
+        parser.error("--runs must be >= 1, --warmups >= 0 and --confidence between 0 and 1")
+
+    if "cold" in modes and os.geteuid() != 0:
+
+        parser.error("the cold mode drops the page cache and needs root, use --modes warm")
+
+    try:
+
+        print(json.dumps(benchmark(interpreters, workloads, modes, args.runs, args.warmups,
+                                   args.bootstrap, args.confidence, args.seed), indent=4))
+
+    except Exception as e:
+
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -22,6 +22,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 */
 
+#define _GNU_SOURCE
+
 #include <stdio.h>
 #include <stdlib.h>
 #include <unistd.h>
@@ -32,621 +34,5688 @@ SOFTWARE.
 #include <sys/stat.h>
 #include <errno.h>
 #include <stdbool.h>
+#include <stdint.h>
+#include <pthread.h>
+#include <signal.h>
+#include <sys/mount.h>
+#include <ftw.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <arpa/inet.h>
+#include <dirent.h>
+#include <fnmatch.h>
+#include <sys/sendfile.h>
+#include <sys/file.h>
+#include <time.h>
+#include <sys/resource.h>
+#include <sys/statvfs.h>
+#include <sched.h>
+#include <sys/mman.h>
+#include <ctype.h>
+
+#ifdef PYRAM_HAVE_ZSTD
+#include <zstd.h>
+#endif
+
+#ifdef PYRAM_HAVE_LZMA
+#include <lzma.h>
+#endif
+
+#ifdef PYRAM_HAVE_LZ4
+#include <lz4frame.h>
+#endif
 
-#define PYPY_PATH "/mnt/pyram_disk/pypy/bin/pypy.elf"
 #define RAMDISK_PATH "/mnt/pyram_disk"
 #define TAR_FILE_PATH "/usr/share/pyram/lib/pypy.so"
+#define CONFIG_PATH "/etc/pyram.conf"
+#define CGROUP_ROOT "/sys/fs/cgroup"
+#define CGROUP_PARENT CGROUP_ROOT "/pyram"
 #define PYFILE_RAMDISK_PATH "/mnt/pyram_pyfile_ramdisk"
+#define STAGE_RAMDISK_PATH "/mnt/pyram_stage"
+#define ZYGOTE_SCRIPT_PATH "/usr/share/pyram/src/pyram_zygote.py"
+#define RUN_DIR "/run/pyram"
+#define ZYGOTE_SOCKET_PATH RUN_DIR "/zygote.sock"
+#define WSGI_SCRIPT_PATH "/usr/share/pyram/src/pyram_wsgi.py"
+#define TRACE_SCRIPT_PATH "/usr/share/pyram/src/pyram_trace.py"
+// Slim images built by build/build from traces, selected with --image <name>
+#define SLIM_IMAGE_PATH "/usr/share/pyram/lib/pypy-%s.so"
+#define DEFAULT_BIND "127.0.0.1:8000"
+
+#define USAGE "Usage: [--timings] [--rusage] [--private] [--memfd] [--stage <src>[:<dest>]]... [--writeback <dir>:<dest>]... [--image <name>] [--trace-imports <file>] [--memory-max <size>] [--cpu-max <cpus>] [--cpuset <cpus>] [--toram [<project_dir>] [--include|--exclude <glob>]...] [--args|-a] <python_file.py> [args...]\n" \
+              "Or: --batch <jobs.txt> [-j <n>]\n" \
+              "Or: -m <module>||-c <code>||-||--help||--version||--gc-mounts [args...]\n" \
+              "Or: --daemon [--preload <modules>] || --client <python_file.py>|-m <module> [args...]\n" \
+              "Or: --workers <n> [--bind <host:port>] <module>[:<callable>]"
+
+/* Size of the PyPy RAM disk when pypy.so comes without a manifest (360MB).
+With the manifest written by build/build the RAM disk is sized from the
+uncompressed tree plus the headroom. */
+#define FALLBACK_IMAGE_SIZE 377487360
+#define DEFAULT_HEADROOM (32LL << 20)
+#define DEFAULT_WRITEBACK_INTERVAL_MS 5000
+
+/* Runtime configuration, read from /etc/pyram.conf (key=value lines, # for
+comments) and overridden by the environment:
+
+  mount_point    PYRAM_MOUNT_POINT    where the PyPy tree lives (/mnt/pyram_disk)
+  archive        PYRAM_ARCHIVE        pypy.so to extract
+  size           PYRAM_SIZE           size of the RAM disk, auto = manifest + headroom
+  headroom       PYRAM_HEADROOM       room left for bytecode caches and temporary files
+  tmpfs_options  PYRAM_TMPFS_OPTIONS  extra tmpfs options, e.g. huge=within_size
+  mount          PYRAM_MOUNT          0 to use mount_point as a plain directory of an
+                                      existing tmpfs (e.g. /dev/shm/pyram)
+  memory_max     PYRAM_MEMORY_MAX     memory.max of the cgroup of each run
+  cpu_max        PYRAM_CPU_MAX        CPUs (e.g. 1.5) each run may use, cpu.max
+  cpuset         PYRAM_CPUSET         cpuset.cpus of the cgroup of each run (e.g. 0-3)
+  private        PYRAM_PRIVATE        1 to mount the RAM disks of each run in a private
+                                      mount namespace
+  memfd          PYRAM_MEMFD          1 to run without root or mounts: the tree lives in a
+                                      directory of the user and pypy.elf runs from a memfd
+  writeback_interval PYRAM_WRITEBACK_INTERVAL
+                                      seconds between two write-backs of the --writeback
+                                      directories (5)
+  image          PYRAM_IMAGE          slim image built by build/build to run from, it gets
+                                      its own archive and RAM disk: <mount_point>-<image> */
+struct pyram_config {
+
+  char mount_point[256];
+  char archive[4096];
+  bool archive_set;
+  char image[64];
+  char tmpfs_options[256];
+  long long size;
+  long long headroom;
+  bool mount;
+
+  // Limits of the cgroup of the run, 0 or empty when not set
+  long long memory_max;
+  long long cpu_quota;
+  char cpuset[256];
+
+  bool private_mounts;
+  bool memfd;
+  bool mount_point_set;
+  long long writeback_interval_ms;
+
+  // Derived from mount_point
+  char pypy_path[512];
+  char stamp_path[512];
+  char pycache_path[512];
+  char setup_lock_path[512];
+  char ref_lock_path[512];
+
+};
+
+static struct pyram_config config;
+
+#define MAX_OWNED_MOUNTS 8
+
+/* tmpfs mounts created for a single run, they are unmounted when the run
+ends, fails or is interrupted. Each one remembers the process which mounted
+it, so forked helpers exiting do not unmount the disks of their parent.
+The shared PyPy image is only unmounted by the last process using it. */
+struct owned_mount {
+
+  char path[256];
+  pid_t owner;
+  bool remove_dir;
+  bool shared_image;
+
+};
+
+static struct owned_mount owned_mounts[MAX_OWNED_MOUNTS];
+static volatile sig_atomic_t owned_mount_count = 0;
+
+/* Locks of the shared PyPy image, in /run/pyram. The setup lock is held
+exclusively while the image is checked, extracted or removed. Every run using
+the image holds the reference lock shared until it ends, and PyPy inherits it,
+so the image is only replaced or removed once flock can take the reference
+lock exclusively, i.e. when no process runs from it anymore. */
+static int image_setup_fd = -1;
+static int image_ref_fd = -1;
+
+// flock retrying when interrupted by a signal
+int flock_retry(int fd, int operation) {
+
+  int result;
+
+  while ((result = flock(fd, operation)) == -1 && errno == EINTR) {}
+
+  return result;
 
-// 360MB You shall need at least more than 360MB of ram to run pyram, I would recommend 2GB or more
-#define SIZE 377487360
+}
 
-// Raise an error message and exit
-void __raise__(const char *message) {
+/* Drop the reference of this process to the PyPy image and check if it was
+the last one. On success the image belongs to this process until it exits.
+Only system calls are used, it also runs from the signal handlers. */
+bool release_image_reference(void) {
 
-   perror(message);
-   exit(EXIT_FAILURE);
+  if (image_setup_fd == -1 || image_ref_fd == -1) {
+
+    return true;
+
+  }
+
+  flock(image_ref_fd, LOCK_UN);
+
+  return flock_retry(image_setup_fd, LOCK_EX) == 0 && flock(image_ref_fd, LOCK_EX | LOCK_NB) == 0;
 
 }
 
-// execute command in terminal
-void execute_command(const char *command) {
+/* Open the locks of the PyPy image. The reference lock is inherited by PyPy,
+so a run keeps its reference even if pyram itself is killed. */
+void open_image_locks() {
+
+  if (image_setup_fd != -1) {
+
+    return;
+
+  }
 
-  int ret = system(command);
+  if (!config.memfd && mkdir(RUN_DIR, 0755) == -1 && errno != EEXIST) {
 
-  if ( ret == -1 ) {
+    perror("Error creating " RUN_DIR);
+    exit(EXIT_FAILURE);
 
-      __raise__("Error while running subprocess\n");
+  }
 
-  } else if (WIFEXITED(ret) && WEXITSTATUS(ret) != 0) {
+  image_setup_fd = open(config.setup_lock_path, O_RDWR | O_CREAT | O_CLOEXEC, 0600);
+  image_ref_fd = open(config.ref_lock_path, O_RDWR | O_CREAT, 0600);
 
-      fprintf(stderr, "Command failed: %s\nExit code: %d\n", command, WEXITSTATUS(ret));
+  if (image_setup_fd == -1 || image_ref_fd == -1) {
 
-      __raise__("Subprocess returned non-zero exit code\n");
+    perror("Error opening the PyPy image locks");
+    exit(EXIT_FAILURE);
 
   }
 
 }
 
-// check if user is root
-bool is_sudo() {
+void lock_image_setup() {
 
-   return (geteuid() == 0);
+  if (flock_retry(image_setup_fd, LOCK_EX) == -1) {
+
+    perror("Error locking the PyPy image");
+    exit(EXIT_FAILURE);
+
+  }
 
 }
 
-// execute pypy already in ramdisk
-void execute_pypy(bool use_toram, const char *py_file_name, const char *pyfile_path, const char *args) {
+void unlock_image_setup() {
 
-  char command[2048];
-  char cwd[1024];
+  flock(image_setup_fd, LOCK_UN);
 
-  if (use_toram) {
+}
 
-    if (args && strlen(args) > 0) {
+/* Take the PyPy image for this process alone, to extract or remove it.
+Must be called with the setup lock held, fails while other runs use it. */
+bool take_image_exclusively() {
 
-      snprintf(command, sizeof(command), "%s %s/%s %s", PYPY_PATH, PYFILE_RAMDISK_PATH, py_file_name, args);
+  return flock(image_ref_fd, LOCK_EX | LOCK_NB) == 0;
 
-    } else {
+}
 
-      snprintf(command, sizeof(command), "%s %s/%s", PYPY_PATH, PYFILE_RAMDISK_PATH, py_file_name);
+/* Wait until no run uses the PyPy image. The setup lock must not be held,
+so the runs ending can still release the image. */
+void wait_for_image_users() {
 
-    }
+  fprintf(stderr, "PyRAM: waiting for the runs using the PyPy image in %s to end\n", config.mount_point);
 
-    execute_command(command);
+  if (flock_retry(image_ref_fd, LOCK_EX) == -1) {
 
-    return;
+    perror("Error waiting for the PyPy image");
+    exit(EXIT_FAILURE);
+
+  }
 
-  } else if (getcwd(cwd, sizeof(cwd)) == NULL) {
+  flock(image_ref_fd, LOCK_UN);
 
-    __raise__("Error in cwd\n");
+}
+
+// Remember a mount which must be unmounted when this process ends
+void register_owned_mount(const char *path, bool remove_dir, bool shared_image) {
+
+  if (owned_mount_count == MAX_OWNED_MOUNTS) {
+
+    return;
 
   }
 
-  if (args && strlen(args) > 0) {
+  struct owned_mount *entry = &owned_mounts[owned_mount_count];
+
+  snprintf(entry->path, sizeof(entry->path), "%s", path);
+  entry->owner = getpid();
+  entry->remove_dir = remove_dir;
+  entry->shared_image = shared_image;
+  owned_mount_count++;
 
-    if (pyfile_path[0] == '/') {
+}
 
-      snprintf(command, sizeof(command), "%s %s/%s %s", PYPY_PATH, cwd, py_file_name, args);
+// Keep a mount after this process ends, e.g. the PyPy tree once it is complete
+void forget_owned_mount(const char *path) {
 
-    } else {
+  for (int i = 0; i < owned_mount_count; i++) {
 
-      snprintf(command, sizeof(command), "%s %s/%s %s", PYPY_PATH, pyfile_path, py_file_name, args);
+    if (strcmp(owned_mounts[i].path, path) == 0) {
+
+      owned_mounts[i] = owned_mounts[owned_mount_count - 1];
+      owned_mount_count--;
+      return;
 
     }
 
+  }
 
-  } else {
+}
 
-    if (pyfile_path[0] == '/') {
-      
-      snprintf(command, sizeof(command), "%s %s/%s", PYPY_PATH, cwd, py_file_name);
+/* Unmount every mount owned by this process. Only async-signal-safe calls are
+used, because it also runs from the SIGINT/SIGTERM handler. */
+void cleanup_owned_mounts(void) {
 
-    } else {
+  pid_t self = getpid();
+
+  while (owned_mount_count > 0) {
+
+    struct owned_mount *entry = &owned_mounts[owned_mount_count - 1];
+
+    // Other runs still executing from the PyPy image keep it mounted
+    if (entry->owner == self && (!entry->shared_image || release_image_reference())) {
 
-      snprintf(command, sizeof(command), "%s %s/%s", PYPY_PATH, pyfile_path, py_file_name);
+      while (umount2(entry->path, MNT_DETACH) == 0) {}
+
+      if (entry->remove_dir) {
+
+        rmdir(entry->path);
+
+      }
 
     }
 
+    owned_mount_count--;
 
   }
 
-  execute_command(command);
-  
 }
 
-/* Allocates the given Python file to a dedicated RAM disk and returns the new path.
-Returns a newly allocated string with the path in the RAM disk, or NULL on error.
-The max size of the python file is 32MB.
-It can only allocate one file at a time. */
-void allocate_python_file_to_ram(const char *python_file) {
+/* cgroup v2 group of the run, /sys/fs/cgroup/pyram/run-<pid>, created when a
+limit is set. pyram moves itself into it before copying --toram files, so the
+RAM disk pages it writes are charged to the run as well as PyPy (which
+inherits the group). Before the group is removed pyram moves back to the
+group it was started in. */
+static struct {
 
-   char dest_path[1024];
-   FILE *src = NULL, *dst = NULL;
-   char buffer[8192];
-   size_t bytes;
+  bool active;
+  pid_t owner;
+  char path[256];
+  char origin_procs[4096];
+  char pid_text[16];
 
-   // Create the RAM disk directory if it doesn't exist
-   if (access(PYFILE_RAMDISK_PATH, F_OK) != 0) {
+} run_cgroup;
 
-     if (mkdir(PYFILE_RAMDISK_PATH, 0777) == -1 && errno != EEXIST) {
+/* Leave and remove the cgroup of the run. Only system calls are used, it
+also runs from the signal handlers. Processes left behind by the script keep
+the group, --gc-mounts removes it once they are gone. */
+void release_run_cgroup(void) {
 
-       __raise__("Error creating pyfile RAM disk directory");
+  if (!run_cgroup.active || run_cgroup.owner != getpid()) {
 
-     }
+    return;
 
-     // Mount tmpfs for the pyfile RAM disk (e.g., 32MB)
-     char mount_cmd[256];
-     snprintf(mount_cmd, sizeof(mount_cmd), "sudo mount -t tmpfs -o size=32M tmpfs %s", PYFILE_RAMDISK_PATH);
+  }
 
-     execute_command(mount_cmd);
+  int fd = open(run_cgroup.origin_procs, O_WRONLY | O_CLOEXEC);
 
-   }
+  if (fd != -1) {
 
-   // Build destination path
-   const char *filename = strrchr(python_file, '/');
-   filename = filename ? filename + 1 : python_file;
-   snprintf(dest_path, sizeof(dest_path), "%s/%s", PYFILE_RAMDISK_PATH, filename);
+    write(fd, run_cgroup.pid_text, strlen(run_cgroup.pid_text));
+    close(fd);
 
-   // Copy file
-   src = fopen(python_file, "rb");
+  }
 
-   if (!src) {
+  rmdir(run_cgroup.path);
+  run_cgroup.active = false;
 
-     __raise__("Error opening source python file");
+}
 
-   }
+// Pid of the running interpreter, signals sent to pyram are forwarded to it
+static volatile pid_t pypy_pid = 0;
 
-   dst = fopen(dest_path, "wb");
+// Most jobs run at the same time by --batch
+#define MAX_BATCH_WORKERS 256
 
-   if (!dst) {
+// Interpreters running the jobs of --batch, 0 for a free slot
+static volatile pid_t batch_pids[MAX_BATCH_WORKERS];
+static volatile sig_atomic_t batch_running = 0;
+static volatile sig_atomic_t batch_signal = 0;
 
-     __raise__("Error creating file in pyfile RAM disk");
-     fclose(src);
+/* While PyPy runs, signals sent to pyram by another process (kill, systemd...)
+are forwarded to it and the RAM disks are released once it exits. Signals
+from the terminal already reach PyPy, which is in the same process group.
+A batch forwards them to every job running and starts no other one.
+Without an interpreter running the RAM disks are unmounted right away. */
+void handle_exit_signal(int signum, siginfo_t *info, void *context) {
 
-   }
+  (void)context;
 
-   while ((bytes = fread(buffer, 1, sizeof(buffer), src)) > 0) {
+  if (batch_running) {
 
-     if (fwrite(buffer, 1, bytes, dst) != bytes) {
+    batch_signal = signum;
 
-       __raise__("Error writing to pyfile RAM disk");
-       fclose(src);
-       fclose(dst);
+    for (int i = 0; i < MAX_BATCH_WORKERS; i++) {
 
-     }
+      if (batch_pids[i] > 0 && (info->si_code == SI_USER || info->si_code == SI_QUEUE)) {
 
-   }
+        kill(batch_pids[i], signum);
 
-   fclose(src);
-   fclose(dst);
+      }
 
-}
+    }
 
-// Frees the RAM disk used for the Python file.
-void free_python_file_ramdisk(void) {
+    return;
 
-   char cmd[256];
+  }
 
-   // Unmount and remove the RAM disk directory
-   if (access(PYFILE_RAMDISK_PATH, F_OK) == 0) {
+  if (pypy_pid > 0) {
 
-     snprintf(cmd, sizeof(cmd), "umount %s && rm -rf %s", PYFILE_RAMDISK_PATH, PYFILE_RAMDISK_PATH);
-     execute_command(cmd);
+    if (info->si_code == SI_USER || info->si_code == SI_QUEUE) {
 
-   }
+      kill(pypy_pid, signum);
 
-}
+    }
 
-void validate_arguments(int argc, char *argv[]) {
+    return;
 
-  if (argc < 2) {
-    __raise__("Usage: [--toram] [--args|-a] <python_file.py> [args...]\nOr: -m||--help||--version [args...]");
   }
 
-  // Use switch on the first character for main options
-  switch (argv[1][0]) {
+  cleanup_owned_mounts();
+  release_run_cgroup();
 
-    case '-':
+  signal(signum, SIG_DFL);
+  raise(signum);
 
-      if (strcmp(argv[1], "--toram") == 0) {
+}
 
-        if (argc < 3) {
-          __raise__("Usage: [--toram] [--args|-a] <python_file.py> [args...]\nOr: -m||--help||--version [args...]");
-        }
+void install_signal_handlers() {
 
-        // Check for --args or -a after --toram
-        if (strcmp(argv[2], "--args") == 0 || strcmp(argv[2], "-a") == 0) {
-          if (argc < 4 || strstr(argv[3], ".py") == NULL) {
-            __raise__("Usage: [--toram] [--args|-a] <python_file.py> [args...]\nOr: -m||--help||--version [args...]");
-          }
-          return;
-        } else if (strstr(argv[2], ".py") != NULL) {
-          return;
-        } else {
-          __raise__("Usage: [--toram] [--args|-a] <python_file.py> [args...]\nOr: -m||--help||--version [args...]");
-        }
+  struct sigaction action;
 
-      } else if (strcmp(argv[1], "--args") == 0 || strcmp(argv[1], "-a") == 0) {
+  memset(&action, 0, sizeof(action));
+  action.sa_sigaction = handle_exit_signal;
+  action.sa_flags = SA_SIGINFO;
+  sigemptyset(&action.sa_mask);
 
-        if (argc < 3 || strstr(argv[2], ".py") == NULL) {
-          __raise__("Usage: [--toram] [--args|-a] <python_file.py> [args...]\nOr: -m||--help||--version [args...]");
-        }
-        return;
+  sigaction(SIGINT, &action, NULL);
+  sigaction(SIGTERM, &action, NULL);
+  sigaction(SIGHUP, &action, NULL);
 
-      } else if (strcmp(argv[1], "-m") == 0) {
+}
 
-        return;
+// Raise an error message and exit
+void __raise__(const char *message) {
 
-      } else if (strcmp(argv[1], "--help") == 0 || strcmp(argv[1], "--version") == 0) {
+   perror(message);
+   cleanup_owned_mounts();
+   release_run_cgroup();
+   exit(EXIT_FAILURE);
 
-        if (argc > 2) {
-          __raise__("Usage: [--toram] [--args|-a] <python_file.py> [args...]\nOr: -m||--help||--version [args...]");
-        }
-        return;
-      }
+}
 
-      // Fall through for unknown options
+// Decode the octal escapes (\040 for spaces...) used in /proc/self/mountinfo
+void unescape_mount_path(char *path) {
 
-      break;
+  char *out = path;
 
-    default:
+  for (char *in = path; *in; in++) {
 
-      // Not an option, check if it's a .py file
-      if (strstr(argv[1], ".py") != NULL) {
-        return;
-      }
+    if (in[0] == '\\' && in[1] >= '0' && in[1] <= '7' && in[2] && in[3]) {
 
-      break;
+      *out++ = (char)(((in[1] - '0') << 6) | ((in[2] - '0') << 3) | (in[3] - '0'));
+      in += 3;
 
-  }
+    } else {
 
-  __raise__("Usage: [--toram] [--args|-a] <python_file.py> [args...]\nOr: -m||--help||--version [args...]");
+      *out++ = *in;
 
-}
+    }
 
-// Print version and exit
-void print_version_and_exit() {
+  }
 
-  printf("PyRAM version 2.0.0\n");
-  exit(EXIT_SUCCESS);
+  *out = '\0';
 
 }
 
-// Print help and exit
-void print_help_and_exit() {
+/* Count the mounts stacked on target, according to /proc/self/mountinfo.
+top_is_tmpfs tells if the visible (last mounted) one is a tmpfs. */
+int count_mounts(const char *target, bool *top_is_tmpfs) {
 
-  printf(
-    "************************************************************\n"
-    "*                   PyRAM - Python in RAM                  *\n"
-    "*                  Version 2.0.0 | MIT License             *\n"
-    "*                  Author: BrunoRNS                        *\n"
-    "************************************************************\n"
-    "\n"
-    "Description:\n"
-    "  PyRAM loads the PyPy interpreter and optionally your Python script into RAM\n"
-    "  for faster execution. It is designed for systems where running Python from\n"
-    "  RAM provides significant performance benefits.\n"
-    "\n"
-    "Usage:\n"
-    "  pyram [--toram] [--args|-a] <python_file.py> [args...]\n"
-    "  pyram -m <module> [args...]\n"
-    "  pyram --help\n"
-    "  pyram --version\n"
-    "\n"
-    "Options:\n"
-    "  --toram         Loads the specified Python file into RAM before execution.\n"
-    "                  This can improve performance for large scripts.\n"
-    "  --args, -a      Allows passing arguments to the Python file. Must be used\n"
-    "                  BEFORE the file name and path, similar to --toram.\n"
-    "                  Example:\n"
-    "                      pyram --args myscript.py arg1 arg2\n"
-    "  -m              Runs a pre-installed library module as a script (like 'python -m').\n"
-    "                  Use this to execute a module with arguments:\n"
-    "                      pyram -m mymodule arg1 arg2\n"
-    "  --help          Shows this detailed help message with usage examples.\n"
-    "  --version       Shows the program version.\n"
-    "\n"
-    "Important Notes:\n"
-    "  - The order of options matters! For example, '--toram' and '--args' or '-a' must come\n"
-    "    before the Python file name and path. '-m' must be the first argument if used.\n"
-    "  - Only one Python file can be loaded into RAM at a time with '--toram'.\n"
-    "  - You must run PyRAM as root (sudo).\n"
-    "\n"
-    "Examples:\n"
-    "  pyram --toram --args myscript.py arg1 arg2\n"
-    "  pyram --args myscript.py arg1 arg2\n"
-    "  pyram myscript.py\n"
-    "  pyram -m mymodule arg1 arg2\n"
-    "\n"
-    "Arguments after the options are passed to the Python script or module.\n"
-    "\n"
-    "Usage summary:\n"
-    "  [--toram] [--args|-a] <python_file.py> [args...]\n"
-    "  -m <module> [args...]\n"
-    "  --help\n"
-    "  --version\n\n"
-  );
+  char line[4096];
+  int count = 0;
 
-  exit(EXIT_SUCCESS);
+  FILE *mountinfo = fopen("/proc/self/mountinfo", "r");
 
-}
+  if (top_is_tmpfs) {
 
-// Ensure running as root
-void ensure_root() {
+    *top_is_tmpfs = false;
 
-  if (!is_sudo()) {
-    printf("You need to run this program as root\n");
-    exit(EXIT_FAILURE);
   }
 
-}
+  if (!mountinfo) {
 
-// Setup RAM disk for PyPy
-void setup_pypy_ramdisk() {
-  char command[256];
+    return 0;
 
-  if (access(RAMDISK_PATH, F_OK) == 0) {
+  }
 
-    snprintf(command, sizeof(command), "rm -rf %s/*", RAMDISK_PATH);
-    execute_command(command);
+  while (fgets(line, sizeof(line), mountinfo)) {
 
-  } else {
+    char mount_point[4096];
+    const char *separator = strstr(line, " - ");
+    char fstype[64] = "";
 
-    if (mkdir(RAMDISK_PATH, 0777) == -1 && errno != EEXIST) {
+    // id parent major:minor root mount_point options ... - fstype source super_options
+    if (sscanf(line, "%*s %*s %*s %*s %4095s", mount_point) != 1 || separator == NULL) {
 
-      __raise__("Error creating /mnt/ramdisk\n");
+      continue;
 
     }
 
-  }
+    unescape_mount_path(mount_point);
 
-  snprintf(command, sizeof(command), "sudo mount -t tmpfs -o size=%d tmpfs %s", SIZE, RAMDISK_PATH);
-  execute_command(command);
+    if (strcmp(mount_point, target) != 0) {
 
-  snprintf(command, sizeof(command), "tar -xJf %s -C %s", TAR_FILE_PATH, RAMDISK_PATH);
-  execute_command(command);
+      continue;
 
-  snprintf(command, sizeof(command), "chmod +x %s", PYPY_PATH);
-  execute_command(command);
+    }
 
-}
+    sscanf(separator + 3, "%63s", fstype);
+    count++;
 
-// Allocate Python file to RAM if needed
-void handle_toram(int argc, char *argv[], bool *use_toram) {
+    if (top_is_tmpfs) {
 
-  if (argc > 1 && strcmp(argv[1], "--toram") == 0) {
+      *top_is_tmpfs = strcmp(fstype, "tmpfs") == 0;
 
-    free_python_file_ramdisk();
-    *use_toram = true;
+    }
 
   }
 
+  fclose(mountinfo);
+
+  return count;
+
 }
 
-// Extracts and returns the Python file name from argv, or NULL if not found.
-// The returned string must be freed by the caller.
-char* get_python_file_name(int argc, char *argv[]) {
+// Check if target has exactly one tmpfs mounted on it
+bool is_single_tmpfs(const char *target) {
+
+  bool top_is_tmpfs;
 
-  for (int i = 1; i < argc; i++) {
+  return count_mounts(target, &top_is_tmpfs) == 1 && top_is_tmpfs;
 
-    const char *py = strstr(argv[i], ".py");
+}
 
-    if (py != NULL) {
+// Unmount every layer stacked on target, returns how many were unmounted
+int unmount_all(const char *target) {
 
-      const char *filename = strrchr(argv[i], '/');
-      filename = filename ? filename + 1 : argv[i];
+  int unmounted = 0;
 
-      return strdup(filename);
+  while (count_mounts(target, NULL) > 0 && umount2(target, MNT_DETACH) == 0) {
 
-    }
+    unmounted++;
 
   }
 
-  return NULL;
+  return unmounted;
 
 }
 
-// Extracts and returns the path (without the file name) of the Python file from argv, or NULL if not found or no path.
-// The returned string must be freed by the caller.
-char* get_python_file_path(int argc, char *argv[]) {
+// Mount a tmpfs of the given size (in bytes) on target, creating it if needed
+void mount_tmpfs(const char *target, long long size) {
 
-  for (int i = 1; i < argc; i++) {
+  char options[512];
 
-    const char *py = strstr(argv[i], ".py");
+  if (mkdir(target, 0777) == -1 && errno != EEXIST) {
 
-    if (py != NULL) {
+    __raise__("Error creating RAM disk directory");
 
-      const char *slash = strrchr(argv[i], '/');
+  }
 
-      if (slash) {
+  snprintf(options, sizeof(options), "size=%lld%s%s", size,
+           config.tmpfs_options[0] ? "," : "", config.tmpfs_options);
 
-        size_t len = slash - argv[i];
-        char *path = (char*)malloc(len + 1);
+  if (mount("tmpfs", target, "tmpfs", MS_NOSUID | MS_NODEV, options) == -1) {
 
-        if (path) {
+    __raise__("Error mounting RAM disk");
 
-          strncpy(path, argv[i], len);
-          path[len] = '\0';
-          return path;
+  }
 
-        }
+}
 
-      } else {
+// Write the whole buffer, retrying on short writes
+bool write_all(int fd, const void *buffer, size_t size) {
+
+  const char *data = buffer;
+
+  while (size > 0) {
 
-        // No path, just file name
-        return strdup("");
+    ssize_t written = write(fd, data, size);
+
+    if (written < 0) {
+
+      if (errno == EINTR) {
+
+        continue;
 
       }
 
+      return false;
+
     }
 
+    data += written;
+    size -= (size_t)written;
+
   }
 
-  return NULL;
+  return true;
 
 }
-/* Returns the full path (including file name) of the Python file from argv, or NULL if not found.
-  The returned string must be freed by the caller. */
-char* get_python_file_fullpath(int argc, char *argv[]) {
-
-   for (int i = 1; i < argc; i++) {
-
-      if (strstr(argv[i], ".py") != NULL) {
 
-        return strdup(argv[i]);
+// Replace the content of a file with text, e.g. a cgroup or /proc setting
+bool write_text_file(const char *path, const char *text) {
 
-      }
+  int fd = open(path, O_WRONLY | O_CLOEXEC);
 
-   }
+  if (fd == -1) {
 
-   return NULL;
+    return false;
 
-}
+  }
 
+  bool ok = write_all(fd, text, strlen(text));
 
-int main(int argc, char *argv[]) {
-  pid_t pid;
-  int status;
-  bool use_toram = false;
-  char *py_file_name = NULL;
-  char *pyfile_path = NULL;
+  return close(fd) == 0 && ok;
 
-  // Validate arguments
-  validate_arguments(argc, argv);
+}
 
-  // Handle --version and --help
-  if (argc > 1 && strcmp(argv[1], "--version") == 0) {
+// Read exactly size bytes, returns false on error or early end of file
+bool read_all(int fd, void *buffer, size_t size) {
 
-    print_version_and_exit();
+  char *data = buffer;
 
-  } else if (argc > 1 && strcmp(argv[1], "--help") == 0) {
+  while (size > 0) {
 
-    print_help_and_exit();
+    ssize_t bytes = read(fd, data, size);
 
-  }
+    if (bytes < 0 && errno == EINTR) {
 
-  // Handle --toram
-  handle_toram(argc, argv, &use_toram);
+      continue;
 
-  // Ensure root
-  ensure_root();
+    }
 
-  // If -m is present, execute pypy with the given args in a subprocess and wait
-  if (argc > 1 && strcmp(argv[1], "-m") == 0) {
+    if (bytes <= 0) {
 
-    pid = fork();
+      return false;
 
-    if (pid < 0) {
-      __raise__("Error while creating subprocess\n");
     }
 
-    if (pid == 0) {
-      setup_pypy_ramdisk();
+    data += bytes;
+    size -= (size_t)bytes;
+
+  }
 
-      char command[2048] = {0};
-      snprintf(command, sizeof(command), "%s", PYPY_PATH);
+  return true;
 
-      for (int i = 1; i < argc; i++) {
+}
 
-        snprintf(command + strlen(command), sizeof(command) - strlen(command), " %s", argv[i]);
+// Number of online cores, used to size the decompression threads
+int online_cpus() {
 
-      }
+  long cpus = sysconf(_SC_NPROCESSORS_ONLN);
 
-      execute_command(command);
+  return cpus > 0 ? (int)cpus : 1;
 
-      exit(EXIT_SUCCESS);
+}
 
-    } else {
+#define MAX_TIMINGS 24
 
-      waitpid(pid, &status, 0);
+/* Phases of the run measured with --timings or PYRAM_TIMINGS. Each phase is
+the time elapsed since the end of the previous one (CLOCK_MONOTONIC), so the
+phases add up to the whole run; a phase entered twice accumulates. */
+struct timing_phase {
 
-      if (!(WIFEXITED(status) && WEXITSTATUS(status) == EXIT_SUCCESS)) {
+  const char *name;
+  long long ns;
 
-        __raise__("Error while allocating memory in ram for pypy\n");
+};
 
-      }
-      // Parent process continues and will exit below
-    }
+static struct {
 
-    exit(EXIT_SUCCESS);
-  }
+  bool enabled;
+  const char *sink;
+  const char *image;
+  struct timespec started;
+  struct timespec mark;
+  struct timing_phase phases[MAX_TIMINGS];
+  int count;
 
-  // Get python file name and path before fork so both parent and child can access
-  py_file_name = get_python_file_name(argc, argv);
+} timings;
 
-  if (!use_toram) {
+// Arguments of pyram, without the report options, written in every report
+static struct {
 
-    pyfile_path = get_python_file_path(argc, argv);
+  int argc;
+  char **argv;
 
-  } else {
+} report_command;
 
-    char* pyfile_fullpath = get_python_file_fullpath(argc, argv);
+long long elapsed_ns(const struct timespec *from, const struct timespec *to) {
 
-    if (pyfile_fullpath == NULL) {
-        // Handle allocation failure
-        fprintf(stderr, "Failed to get Python file full path.\n");
-        exit(EXIT_FAILURE);
-    }
+  return (long long)(to->tv_sec - from->tv_sec) * 1000000000LL + (to->tv_nsec - from->tv_nsec);
 
-    allocate_python_file_to_ram(pyfile_fullpath);
-    
-    free(pyfile_fullpath);
+}
 
-  }
+// Start measuring, the time before main (exec, dynamic linking) is not included
+void start_timings(const char *sink) {
 
-  // Fork subprocess
-  pid = fork();
+  timings.enabled = true;
+  timings.sink = sink;
+  clock_gettime(CLOCK_MONOTONIC, &timings.started);
+  timings.mark = timings.started;
 
-  if (pid < 0) {
+}
 
-    __raise__("Error while creating subprocess\n");
+// Close the phase running since the previous mark
+void mark_phase(const char *name) {
 
-  }
+  struct timespec now;
+  int i;
 
-  if (pid == 0) {
+  if (!timings.enabled) {
 
-    setup_pypy_ramdisk();
+    return;
 
-    exit(EXIT_SUCCESS);
+  }
 
-  } else {
+  clock_gettime(CLOCK_MONOTONIC, &now);
 
-    waitpid(pid, &status, 0);
+  for (i = 0; i < timings.count && strcmp(timings.phases[i].name, name) != 0; i++) {}
 
-    if (WIFEXITED(status) && WEXITSTATUS(status) == EXIT_SUCCESS) {
+  if (i == timings.count) {
 
-      // Prepare args if --args or -a is present
-      char args[1024] = "";
+    if (timings.count == MAX_TIMINGS) {
 
-      for (int i = 1; i < argc; i++) {
+      return;
 
-        if (strcmp(argv[i], "--args") == 0 || strcmp(argv[i], "-a") == 0) {
-          // All arguments after the .py file are considered script args
-          for (int j = i + 1; j < argc; j++) {
+    }
 
-            if (strstr(argv[j], ".py") != NULL) {
+    timings.phases[timings.count++] = (struct timing_phase){ name, 0 };
 
-                for (int k = j + 1; k < argc; k++) {
+  }
 
-                    strncat(args, argv[k], sizeof(args) - strlen(args) - 2);
-                    strncat(args, " ", sizeof(args) - strlen(args) - 2);
+  timings.phases[i].ns += elapsed_ns(&timings.mark, &now);
+  timings.mark = now;
 
-                }
+}
 
-                break;
+// Write a JSON string, escaping quotes, backslashes and control characters
+void write_json_string(FILE *out, const char *text) {
 
-            }
+  fputc('"', out);
 
-          }
+  for (const unsigned char *c = (const unsigned char *)text; *c; c++) {
 
-          break;
+    if (*c == '"' || *c == '\\') {
 
-        }
+      fprintf(out, "\\%c", *c);
 
-      }
+    } else if (*c < 0x20) {
 
-      execute_pypy(use_toram, py_file_name, pyfile_path, args);
+      fprintf(out, "\\u%04x", *c);
 
     } else {
 
-      __raise__("Error while allocating memory in ram for pypy\n");
+      fputc(*c, out);
 
     }
 
   }
 
-  if (use_toram) {
+  fputc('"', out);
 
-    free_python_file_ramdisk();
+}
 
-  }
+/* Start a JSON report line with the fields shared by every report: time,
+pid, command and how PyPy exited. Returns NULL if it cannot be allocated. */
+FILE *open_report(char **line, size_t *size, int status) {
 
-  // Free allocated memory
+  struct timespec wall;
+  FILE *out = open_memstream(line, size);
 
-  if (py_file_name) { free(py_file_name); }
-  if (pyfile_path) { free(pyfile_path); }
+  if (!out) {
 
-  return 0;
+    return NULL;
 
-}
\ No newline at end of file
+  }
+
+  clock_gettime(CLOCK_REALTIME, &wall);
+
+  fprintf(out, "{\"timestamp\": %lld.%03ld, \"pid\": %d, \"command\": [",
+          (long long)wall.tv_sec, wall.tv_nsec / 1000000, (int)getpid());
+
+  for (int i = 1; i < report_command.argc; i++) {
+
+    fputs(i > 1 ? ", " : "", out);
+    write_json_string(out, report_command.argv[i]);
+
+  }
+
+  fputs("]", out);
+
+  if (WIFSIGNALED(status)) {
+
+    fprintf(out, ", \"signal\": %d", WTERMSIG(status));
+
+  } else {
+
+    fprintf(out, ", \"exit_code\": %d", WEXITSTATUS(status));
+
+  }
+
+  return out;
+
+}
+
+/* Close the report line and append it to sink, or write it to stderr when
+sink is NULL. The line is written with a single write so concurrent runs
+appending to the same file do not interleave. */
+void write_report(FILE *out, char **line, size_t *size, const char *sink) {
+
+  fputs("}\n", out);
+  fclose(out);
+
+  int fd = sink ? open(sink, O_WRONLY | O_APPEND | O_CREAT | O_CLOEXEC, 0644) : STDERR_FILENO;
+
+  if (fd == -1 || !write_all(fd, *line, *size)) {
+
+    perror("Error writing the PyRAM report");
+
+  }
+
+  if (sink && fd != -1) {
+
+    close(fd);
+
+  }
+
+  free(*line);
+
+}
+
+// Report of --timings or PYRAM_TIMINGS
+void emit_timings(int status) {
+
+  char *line = NULL;
+  size_t size = 0;
+  struct timespec now;
+
+  if (!timings.enabled) {
+
+    return;
+
+  }
+
+  timings.enabled = false;
+  clock_gettime(CLOCK_MONOTONIC, &now);
+
+  FILE *out = open_report(&line, &size, status);
+
+  if (!out) {
+
+    return;
+
+  }
+
+  fputs(", \"image\": ", out);
+  write_json_string(out, timings.image ? timings.image : "none");
+  fputs(", \"phases_ms\": {", out);
+
+  for (int i = 0; i < timings.count; i++) {
+
+    fprintf(out, "%s\"%s\": %.3f", i > 0 ? ", " : "", timings.phases[i].name, timings.phases[i].ns / 1e6);
+
+  }
+
+  fprintf(out, "}, \"total_ms\": %.3f", elapsed_ns(&timings.started, &now) / 1e6);
+  write_report(out, &line, &size, timings.sink);
+
+}
+
+/* Resources used by PyPy and its descendants, measured with --rusage or
+PYRAM_RUSAGE: the rusage returned by wait4 when PyPy is reaped, and the bytes
+used in the RAM disks (statvfs) just before they are released. */
+static struct {
+
+  bool enabled;
+  const char *sink;
+  struct rusage usage;
+  long long wall_ns;
+  long long image_bytes;
+  long long toram_bytes;
+  long long stage_bytes;
+
+  // Read from the cgroup of the run, when there is one
+  bool limited;
+  long long memory_peak;
+  long long oom_kills;
+  long long throttled_usec;
+
+} resources;
+
+// RAM disk of the inputs staged with --stage, empty without them
+static char stage_root[256];
+
+// RAM disk of the --toram copy, empty without --toram
+static char toram_root[256];
+
+// Bytes used in the filesystem holding path, -1 when it cannot be read
+long long filesystem_used_bytes(const char *path) {
+
+  struct statvfs fs;
+
+  if (statvfs(path, &fs) == -1) {
+
+    return -1;
+
+  }
+
+  return (long long)(fs.f_blocks - fs.f_bfree) * (long long)fs.f_frsize;
+
+}
+
+// Measure the RAM disks before the ones of this run are unmounted
+void measure_ramdisks() {
+
+  if (!resources.enabled) {
+
+    return;
+
+  }
+
+  resources.image_bytes = filesystem_used_bytes(config.mount_point);
+  resources.toram_bytes = toram_root[0] ? filesystem_used_bytes(toram_root) : -1;
+  resources.stage_bytes = stage_root[0] ? filesystem_used_bytes(stage_root) : -1;
+
+}
+
+// Write a text to a file of the cgroup filesystem
+bool write_cgroup_file(const char *group, const char *file, const char *text) {
+
+  char path[512];
+
+  snprintf(path, sizeof(path), "%s/%s", group, file);
+
+  return write_text_file(path, text);
+
+}
+
+/* Read a value of a cgroup file: the first number of the file when key is
+NULL (memory.peak), otherwise the number following key (memory.events,
+cpu.stat). Returns -1 when it is not available. */
+long long read_cgroup_value(const char *file, const char *key) {
+
+  char path[512];
+  char line[256];
+  long long value = -1;
+
+  snprintf(path, sizeof(path), "%s/%s", run_cgroup.path, file);
+
+  FILE *stream = fopen(path, "r");
+
+  if (!stream) {
+
+    return -1;
+
+  }
+
+  while (fgets(line, sizeof(line), stream)) {
+
+    size_t length = key ? strlen(key) : 0;
+
+    if (!key) {
+
+      sscanf(line, "%lld", &value);
+      break;
+
+    }
+
+    if (strncmp(line, key, length) == 0 && line[length] == ' ') {
+
+      sscanf(line + length + 1, "%lld", &value);
+      break;
+
+    }
+
+  }
+
+  fclose(stream);
+
+  return value;
+
+}
+
+/* Create the cgroup of the run with the memory_max, cpu_max and cpuset limits
+and move pyram into it, PyPy inherits it. Controllers are enabled on the way
+down from the root, /sys/fs/cgroup/pyram only holds the groups of the runs. */
+void create_run_cgroup() {
+
+  const char *controllers[3];
+  int controller_count = 0;
+  char path[4096];
+  char line[4096];
+
+  if (config.memory_max == 0 && config.cpu_quota == 0 && config.cpuset[0] == '\0') {
+
+    return;
+
+  }
+
+  if (access(CGROUP_ROOT "/cgroup.controllers", F_OK) != 0) {
+
+    fprintf(stderr, "Resource limits need cgroup v2 mounted on %s\n", CGROUP_ROOT);
+    __raise__("Error creating the cgroup of the run");
+
+  }
+
+  if (config.memory_max > 0) {
+
+    controllers[controller_count++] = "+memory";
+
+  }
+
+  if (config.cpu_quota > 0) {
+
+    controllers[controller_count++] = "+cpu";
+
+  }
+
+  if (config.cpuset[0] != '\0') {
+
+    controllers[controller_count++] = "+cpuset";
+
+  }
+
+  if (mkdir(CGROUP_PARENT, 0755) == -1 && errno != EEXIST) {
+
+    __raise__("Error creating " CGROUP_PARENT);
+
+  }
+
+  for (int i = 0; i < controller_count; i++) {
+
+    if (!write_cgroup_file(CGROUP_ROOT, "cgroup.subtree_control", controllers[i])
+        || !write_cgroup_file(CGROUP_PARENT, "cgroup.subtree_control", controllers[i])) {
+
+      fprintf(stderr, "Cannot enable the %s controller of cgroup v2\n", controllers[i] + 1);
+      __raise__("Error creating the cgroup of the run");
+
+    }
+
+  }
+
+  // The cgroup pyram was started in, "0::<path>" in /proc/self/cgroup
+  FILE *self = fopen("/proc/self/cgroup", "r");
+
+  path[0] = '\0';
+
+  while (self && fgets(line, sizeof(line), self)) {
+
+    if (strncmp(line, "0::", 3) == 0) {
+
+      line[strcspn(line, "\n")] = '\0';
+      snprintf(path, sizeof(path), "%s", line + 3);
+
+    }
+
+  }
+
+  if (self) {
+
+    fclose(self);
+
+  }
+
+  snprintf(run_cgroup.origin_procs, sizeof(run_cgroup.origin_procs), "%s%s/cgroup.procs",
+           CGROUP_ROOT, strcmp(path, "/") == 0 ? "" : path);
+  snprintf(run_cgroup.pid_text, sizeof(run_cgroup.pid_text), "%d", (int)getpid());
+  snprintf(run_cgroup.path, sizeof(run_cgroup.path), "%s/run-%d", CGROUP_PARENT, (int)getpid());
+
+  // A group left by a killed run with the same pid
+  rmdir(run_cgroup.path);
+
+  if (mkdir(run_cgroup.path, 0755) == -1) {
+
+    __raise__("Error creating the cgroup of the run");
+
+  }
+
+  run_cgroup.owner = getpid();
+  run_cgroup.active = true;
+
+  if (config.memory_max > 0) {
+
+    snprintf(line, sizeof(line), "%lld", config.memory_max);
+
+    if (!write_cgroup_file(run_cgroup.path, "memory.max", line)) {
+
+      __raise__("Error setting memory.max");
+
+    }
+
+  }
+
+  if (config.cpu_quota > 0) {
+
+    snprintf(line, sizeof(line), "%lld 100000", config.cpu_quota);
+
+    if (!write_cgroup_file(run_cgroup.path, "cpu.max", line)) {
+
+      __raise__("Error setting cpu.max");
+
+    }
+
+  }
+
+  if (config.cpuset[0] != '\0' && !write_cgroup_file(run_cgroup.path, "cpuset.cpus", config.cpuset)) {
+
+    __raise__("Error setting cpuset.cpus");
+
+  }
+
+  if (!write_cgroup_file(run_cgroup.path, "cgroup.procs", run_cgroup.pid_text)) {
+
+    __raise__("Error moving pyram into the cgroup of the run");
+
+  }
+
+}
+
+/* Read how the run fared against its limits, and explain a run killed for
+using more memory than memory_max, which otherwise looks like a plain SIGKILL. */
+void report_cgroup_limits(int status) {
+
+  if (!run_cgroup.active) {
+
+    return;
+
+  }
+
+  resources.limited = true;
+  resources.memory_peak = read_cgroup_value("memory.peak", NULL);
+  resources.oom_kills = read_cgroup_value("memory.events", "oom_kill");
+  resources.throttled_usec = read_cgroup_value("cpu.stat", "throttled_usec");
+
+  if (resources.oom_kills > 0) {
+
+    fprintf(stderr, "PyRAM: %lld process(es) of the run killed for exceeding the memory limit of %lld bytes%s\n",
+            resources.oom_kills, config.memory_max,
+            WIFSIGNALED(status) && WTERMSIG(status) == SIGKILL ? ", PyPy included" : "");
+
+  }
+
+}
+
+// Report of --rusage or PYRAM_RUSAGE
+void emit_resources(int status) {
+
+  char *line = NULL;
+  size_t size = 0;
+  const struct rusage *usage = &resources.usage;
+
+  if (!resources.enabled) {
+
+    return;
+
+  }
+
+  resources.enabled = false;
+
+  FILE *out = open_report(&line, &size, status);
+
+  if (!out) {
+
+    return;
+
+  }
+
+  fprintf(out, ", \"wall_ms\": %.3f, \"user_s\": %ld.%06ld, \"sys_s\": %ld.%06ld, \"max_rss_kb\": %ld",
+          resources.wall_ns / 1e6, (long)usage->ru_utime.tv_sec, (long)usage->ru_utime.tv_usec,
+          (long)usage->ru_stime.tv_sec, (long)usage->ru_stime.tv_usec, usage->ru_maxrss);
+  fprintf(out, ", \"major_faults\": %ld, \"minor_faults\": %ld", usage->ru_majflt, usage->ru_minflt);
+  fprintf(out, ", \"voluntary_switches\": %ld, \"involuntary_switches\": %ld", usage->ru_nvcsw, usage->ru_nivcsw);
+  fprintf(out, ", \"block_in\": %ld, \"block_out\": %ld", usage->ru_inblock, usage->ru_oublock);
+  fprintf(out, ", \"tmpfs_used_bytes\": {");
+  write_json_string(out, config.mount_point);
+  fprintf(out, ": %lld", resources.image_bytes);
+
+  if (resources.toram_bytes >= 0) {
+
+    fputs(", ", out);
+    write_json_string(out, toram_root);
+    fprintf(out, ": %lld", resources.toram_bytes);
+
+  }
+
+  if (resources.stage_bytes >= 0) {
+
+    fputs(", ", out);
+    write_json_string(out, stage_root);
+    fprintf(out, ": %lld", resources.stage_bytes);
+
+  }
+
+  fputs("}", out);
+
+  if (resources.limited) {
+
+    fprintf(out, ", \"cgroup\": {\"memory_peak_bytes\": %lld, \"oom_kills\": %lld, \"cpu_throttled_usec\": %lld}",
+            resources.memory_peak, resources.oom_kills, resources.throttled_usec);
+
+  }
+
+  write_report(out, &line, &size, resources.sink);
+
+}
+
+/* Index in argv of the Python file, after the options of --toram and --args:
+--toram [<project_dir>] [--include <glob>] [--exclude <glob>] [--args|-a] <python_file.py> */
+int find_script_index(int argc, char *argv[]) {
+
+  int i = 1;
+
+  while (i < argc) {
+
+    if (strcmp(argv[i], "--toram") == 0) {
+
+      struct stat st;
+
+      i++;
+
+      if (i < argc && stat(argv[i], &st) == 0 && S_ISDIR(st.st_mode)) {
+
+        i++;
+
+      }
+
+    } else if ((strcmp(argv[i], "--include") == 0 || strcmp(argv[i], "--exclude") == 0) && i + 1 < argc) {
+
+      i += 2;
+
+    } else if (strcmp(argv[i], "--args") == 0 || strcmp(argv[i], "-a") == 0) {
+
+      i++;
+
+    } else {
+
+      break;
+
+    }
+
+  }
+
+  return i;
+
+}
+
+#define FNV_OFFSET_BASIS 14695981039346656037ULL
+
+// Add bytes to a FNV-1a 64 bits hash
+unsigned long long fnv1a(unsigned long long h, const unsigned char *data, size_t size) {
+
+  for (size_t i = 0; i < size; i++) {
+
+    h ^= data[i];
+    h *= 1099511628211ULL;
+
+  }
+
+  return h;
+
+}
+
+// nftw callback removing every entry below the root directory
+int remove_entry(const char *path, const struct stat *st, int type, struct FTW *ftw) {
+
+  (void)st;
+  (void)type;
+
+  if (ftw->level > 0 && remove(path) == -1) {
+
+    perror(path);
+    return -1;
+
+  }
+
+  return 0;
+
+}
+
+// Remove everything inside dir (hidden files included) but dir itself, like rm -rf dir/* dir/.*
+void remove_tree_contents(const char *dir) {
+
+  if (nftw(dir, remove_entry, 64, FTW_DEPTH | FTW_PHYS | FTW_MOUNT) == -1) {
+
+    __raise__("Error cleaning the RAM disk");
+
+  }
+
+}
+
+/* Parse a size in bytes with an optional K, M or G suffix (powers of 1024).
+Returns -1 when the text is not a valid size. */
+long long parse_size(const char *text) {
+
+  char *end;
+  long long value;
+
+  errno = 0;
+  value = strtoll(text, &end, 10);
+
+  if (errno != 0 || end == text || value < 0) {
+
+    return -1;
+
+  }
+
+  switch (*end) {
+
+    case 'G': case 'g': value <<= 10; /* fall through */
+    case 'M': case 'm': value <<= 10; /* fall through */
+    case 'K': case 'k': value <<= 10; end++; break;
+    default: break;
+
+  }
+
+  return *end == '\0' ? value : -1;
+
+}
+
+// Apply one setting, from /etc/pyram.conf or the environment
+void set_config_value(const char *origin, const char *key, const char *value) {
+
+  bool valid = true;
+
+  if (strcmp(key, "mount_point") == 0) {
+
+    valid = value[0] == '/' && strlen(value) < sizeof(config.mount_point);
+    snprintf(config.mount_point, sizeof(config.mount_point), "%s", value);
+    config.mount_point_set = true;
+
+  } else if (strcmp(key, "archive") == 0) {
+
+    valid = value[0] != '\0';
+    snprintf(config.archive, sizeof(config.archive), "%s", value);
+    config.archive_set = true;
+
+  } else if (strcmp(key, "image") == 0) {
+
+    // A file name part, pypy-<image>.so
+    valid = value[0] != '.' && strlen(value) < sizeof(config.image)
+            && strspn(value, "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-") == strlen(value);
+    snprintf(config.image, sizeof(config.image), "%s", value);
+
+  } else if (strcmp(key, "tmpfs_options") == 0) {
+
+    valid = strlen(value) < sizeof(config.tmpfs_options);
+    snprintf(config.tmpfs_options, sizeof(config.tmpfs_options), "%s", value);
+
+  } else if (strcmp(key, "size") == 0) {
+
+    config.size = strcmp(value, "auto") == 0 ? 0 : parse_size(value);
+    valid = config.size >= 0;
+
+  } else if (strcmp(key, "headroom") == 0) {
+
+    config.headroom = parse_size(value);
+    valid = config.headroom >= 0;
+
+  } else if (strcmp(key, "mount") == 0) {
+
+    valid = strcmp(value, "0") == 0 || strcmp(value, "1") == 0;
+    config.mount = strcmp(value, "0") != 0;
+
+  } else if (strcmp(key, "memory_max") == 0) {
+
+    config.memory_max = strcmp(value, "max") == 0 ? 0 : parse_size(value);
+    valid = config.memory_max >= 0;
+
+  } else if (strcmp(key, "cpu_max") == 0) {
+
+    // A number of CPUs, converted to a quota for a period of 100ms
+    char *end;
+    double cpus = strcmp(value, "max") == 0 ? 0 : strtod(value, &end);
+
+    valid = strcmp(value, "max") == 0 || (end != value && *end == '\0' && cpus >= 0.01);
+    config.cpu_quota = (long long)(cpus * 100000);
+
+  } else if (strcmp(key, "memfd") == 0) {
+
+    valid = strcmp(value, "0") == 0 || strcmp(value, "1") == 0;
+    config.memfd = strcmp(value, "1") == 0;
+
+  } else if (strcmp(key, "private") == 0) {
+
+    valid = strcmp(value, "0") == 0 || strcmp(value, "1") == 0;
+    config.private_mounts = strcmp(value, "1") == 0;
+
+  } else if (strcmp(key, "writeback_interval") == 0) {
+
+    char *end;
+    double seconds = strtod(value, &end);
+
+    valid = end != value && *end == '\0' && seconds >= 0.1;
+    config.writeback_interval_ms = (long long)(seconds * 1000);
+
+  } else if (strcmp(key, "cpuset") == 0) {
+
+    valid = strlen(value) < sizeof(config.cpuset) && strspn(value, "0123456789,-") == strlen(value);
+    snprintf(config.cpuset, sizeof(config.cpuset), "%s", value);
+
+  } else {
+
+    fprintf(stderr, "%s: unknown setting %s, ignored\n", origin, key);
+
+  }
+
+  if (!valid) {
+
+    fprintf(stderr, "%s: invalid value for %s: %s\n", origin, key, value);
+    exit(EXIT_FAILURE);
+
+  }
+
+}
+
+// Read /etc/pyram.conf, a missing file keeps the defaults
+void read_config_file(const char *path) {
+
+  char line[4096];
+  char origin[512];
+  int line_number = 0;
+
+  FILE *file = fopen(path, "r");
+
+  if (!file) {
+
+    return;
+
+  }
+
+  while (fgets(line, sizeof(line), file)) {
+
+    char *key = line;
+    char *value;
+    char *end;
+
+    line_number++;
+    line[strcspn(line, "#\n")] = '\0';
+
+    while (*key == ' ' || *key == '\t') {
+
+      key++;
+
+    }
+
+    if (*key == '\0') {
+
+      continue;
+
+    }
+
+    snprintf(origin, sizeof(origin), "%s:%d", path, line_number);
+    value = strchr(key, '=');
+
+    if (!value) {
+
+      fprintf(stderr, "%s: expected key=value\n", origin);
+      exit(EXIT_FAILURE);
+
+    }
+
+    // Trim the spaces around the key and the value
+    for (end = value; end > key && (end[-1] == ' ' || end[-1] == '\t'); end--) {}
+    *end = '\0';
+
+    for (value++; *value == ' ' || *value == '\t'; value++) {}
+    for (end = value + strlen(value); end > value && (end[-1] == ' ' || end[-1] == '\t'); end--) {}
+    *end = '\0';
+
+    set_config_value(origin, key, value);
+
+  }
+
+  fclose(file);
+
+}
+
+// Defaults, then /etc/pyram.conf, then the PYRAM_* environment variables
+void load_config() {
+
+  const char *environment[][2] = {
+
+    { "mount_point", "PYRAM_MOUNT_POINT" },
+    { "archive", "PYRAM_ARCHIVE" },
+    { "size", "PYRAM_SIZE" },
+    { "headroom", "PYRAM_HEADROOM" },
+    { "tmpfs_options", "PYRAM_TMPFS_OPTIONS" },
+    { "mount", "PYRAM_MOUNT" },
+    { "memory_max", "PYRAM_MEMORY_MAX" },
+    { "cpu_max", "PYRAM_CPU_MAX" },
+    { "cpuset", "PYRAM_CPUSET" },
+    { "private", "PYRAM_PRIVATE" },
+    { "memfd", "PYRAM_MEMFD" },
+    { "writeback_interval", "PYRAM_WRITEBACK_INTERVAL" },
+    { "image", "PYRAM_IMAGE" },
+
+  };
+
+  snprintf(config.mount_point, sizeof(config.mount_point), "%s", RAMDISK_PATH);
+  snprintf(config.archive, sizeof(config.archive), "%s", TAR_FILE_PATH);
+  config.archive_set = false;
+  config.image[0] = '\0';
+  config.tmpfs_options[0] = '\0';
+  config.size = 0;
+  config.headroom = DEFAULT_HEADROOM;
+  config.mount = true;
+  config.memory_max = 0;
+  config.cpu_quota = 0;
+  config.cpuset[0] = '\0';
+  config.private_mounts = false;
+  config.memfd = false;
+  config.mount_point_set = false;
+  config.writeback_interval_ms = DEFAULT_WRITEBACK_INTERVAL_MS;
+
+  read_config_file(CONFIG_PATH);
+
+  for (size_t i = 0; i < sizeof(environment) / sizeof(environment[0]); i++) {
+
+    const char *value = getenv(environment[i][1]);
+
+    if (value != NULL && value[0] != '\0') {
+
+      set_config_value(environment[i][1], environment[i][0], value);
+
+    }
+
+  }
+
+}
+
+/* Paths derived from the settings, once the command line was applied too.
+The memfd backend keeps the tree in a directory of the user, in the tmpfs of
+$XDG_RUNTIME_DIR or /dev/shm, and its locks next to it instead of /run/pyram. */
+void finish_config() {
+
+  if (config.memfd) {
+
+    const char *runtime_dir = getenv("XDG_RUNTIME_DIR");
+
+    config.mount = false;
+
+    if (!config.mount_point_set && runtime_dir && runtime_dir[0] == '/') {
+
+      snprintf(config.mount_point, sizeof(config.mount_point), "%s/pyram", runtime_dir);
+
+    } else if (!config.mount_point_set) {
+
+      snprintf(config.mount_point, sizeof(config.mount_point), "/dev/shm/pyram-%d", (int)getuid());
+
+    }
+
+  }
+
+  // Trailing slashes would not match the mount points of /proc/self/mountinfo
+  size_t length = strlen(config.mount_point);
+
+  while (length > 1 && config.mount_point[length - 1] == '/') {
+
+    config.mount_point[--length] = '\0';
+
+  }
+
+  // A slim image never shares the RAM disk of the full one, both can stay warm
+  if (config.image[0]) {
+
+    if (length + strlen(config.image) + 1 >= sizeof(config.mount_point)) {
+
+      fprintf(stderr, "mount_point is too long for the image %s\n", config.image);
+      exit(EXIT_FAILURE);
+
+    }
+
+    strcat(config.mount_point, "-");
+    strcat(config.mount_point, config.image);
+
+    if (!config.archive_set) {
+
+      snprintf(config.archive, sizeof(config.archive), SLIM_IMAGE_PATH, config.image);
+
+    }
+
+  }
+
+  snprintf(config.pypy_path, sizeof(config.pypy_path), "%s/pypy/bin/pypy.elf", config.mount_point);
+  snprintf(config.stamp_path, sizeof(config.stamp_path), "%s/.pyram_stamp", config.mount_point);
+  snprintf(config.pycache_path, sizeof(config.pycache_path), "%s/pycache", config.mount_point);
+
+  // One pair of locks per mount point, so differently configured images do not wait for each other
+  unsigned long long key = fnv1a(FNV_OFFSET_BASIS, (const unsigned char *)config.mount_point, strlen(config.mount_point));
+
+  if (config.memfd) {
+
+    snprintf(config.setup_lock_path, sizeof(config.setup_lock_path), "%s.lock", config.mount_point);
+    snprintf(config.ref_lock_path, sizeof(config.ref_lock_path), "%s.ref", config.mount_point);
+
+  } else {
+
+    snprintf(config.setup_lock_path, sizeof(config.setup_lock_path), "%s/image-%016llx.lock", RUN_DIR, key);
+    snprintf(config.ref_lock_path, sizeof(config.ref_lock_path), "%s/image-%016llx.ref", RUN_DIR, key);
+
+  }
+
+}
+
+// check if user is root
+bool is_sudo() {
+
+   return (geteuid() == 0);
+
+}
+
+/* Arguments of the interpreter, built from the original argv so nothing is
+quoted, split or truncated on the way. The returned array must be freed by
+the caller. */
+char **build_pypy_argv(int argc, char *argv[], const char *toram_script) {
+
+  char **pypy_argv = calloc((size_t)argc + 2, sizeof(char *));
+  int count = 0;
+  int first = find_script_index(argc, argv);
+
+  if (!pypy_argv) {
+
+    __raise__("Error allocating PyPy arguments");
+
+  }
+
+  pypy_argv[count++] = config.pypy_path;
+
+  // -m, -c, - (the script on stdin) and their arguments are given to PyPy untouched
+  if (strcmp(argv[1], "-m") == 0 || strcmp(argv[1], "-c") == 0 || strcmp(argv[1], "-") == 0) {
+
+    for (int i = 1; i < argc; i++) {
+
+      pypy_argv[count++] = argv[i];
+
+    }
+
+    return pypy_argv;
+
+  }
+
+  bool pass_args = false;
+
+  for (int i = 1; i < first; i++) {
+
+    if (strcmp(argv[i], "--args") == 0 || strcmp(argv[i], "-a") == 0) {
+
+      pass_args = true;
+
+    }
+
+  }
+
+  if (toram_script) {
+
+    pypy_argv[count++] = (char *)toram_script;
+
+  } else {
+
+    // Absolute path when it can be resolved, otherwise PyPy reports the error
+    char *resolved = realpath(argv[first], NULL);
+
+    pypy_argv[count++] = resolved ? resolved : argv[first];
+
+  }
+
+  // Script arguments are only forwarded with --args or -a
+  if (pass_args) {
+
+    for (int i = first + 1; i < argc; i++) {
+
+      pypy_argv[count++] = argv[i];
+
+    }
+
+  }
+
+  return pypy_argv;
+
+}
+
+// pypy.elf loaded in memory by the memfd backend, -1 otherwise
+static int pypy_memfd = -1;
+
+/* Run PyPy from the RAM disk with fork and execv, no shell involved.
+Returns the wait status of the interpreter, its resource usage is kept for
+the --rusage report. */
+int execute_pypy(char *const pypy_argv[]) {
+
+  int status;
+  struct timespec started;
+  struct timespec ended;
+
+  clock_gettime(CLOCK_MONOTONIC, &started);
+
+  pid_t pid = fork();
+
+  if (pid < 0) {
+
+    __raise__("Error while creating subprocess\n");
+
+  }
+
+  if (pid == 0) {
+
+    // argv[0] stays the path in the tree, PyPy finds its stdlib from it
+    if (pypy_memfd != -1) {
+
+      extern char **environ;
+
+      fexecve(pypy_memfd, pypy_argv, environ);
+
+    }
+
+    execv(config.pypy_path, pypy_argv);
+
+    perror("Error running PyPy");
+    _exit(127);
+
+  }
+
+  pypy_pid = pid;
+
+  while (wait4(pid, &status, 0, &resources.usage) == -1) {
+
+    if (errno != EINTR) {
+
+      __raise__("Error waiting for PyPy\n");
+
+    }
+
+  }
+
+  pypy_pid = 0;
+  clock_gettime(CLOCK_MONOTONIC, &ended);
+  resources.wall_ns = elapsed_ns(&started, &ended);
+
+  return status;
+
+}
+
+// Release the RAM disks of the run and exit with the status of the interpreter
+void exit_like_pypy(int status) {
+
+  measure_ramdisks();
+  report_cgroup_limits(status);
+  cleanup_owned_mounts();
+  release_run_cgroup();
+  mark_phase("cleanup");
+  emit_timings(status);
+  emit_resources(status);
+
+  if (WIFSIGNALED(status)) {
+
+    signal(WTERMSIG(status), SIG_DFL);
+    raise(WTERMSIG(status));
+
+  }
+
+  exit(WIFEXITED(status) ? WEXITSTATUS(status) : EXIT_FAILURE);
+
+}
+
+// File given to --trace-imports, NULL when the run is not traced
+static const char *trace_path = NULL;
+
+/* Put pyram_trace.py in front of the script, -m, -c or -, so the files of the
+PyPy tree used by the run are added to the trace. PYRAM_TRACE and
+PYRAM_TRACE_ROOT tell it where to write and which tree to record. */
+char **traced_argv(char **pypy_argv) {
+
+  int count = 0;
+
+  if (!trace_path) {
+
+    return pypy_argv;
+
+  }
+
+  while (pypy_argv[count]) {
+
+    count++;
+
+  }
+
+  char **traced = calloc((size_t)count + 2, sizeof(char *));
+
+  if (!traced) {
+
+    __raise__("Error allocating PyPy arguments");
+
+  }
+
+  traced[0] = pypy_argv[0];
+  traced[1] = TRACE_SCRIPT_PATH;
+  memcpy(traced + 2, pypy_argv + 1, (size_t)(count - 1) * sizeof(char *));
+  free(pypy_argv);
+
+  return traced;
+
+}
+
+// Most arguments of a --batch job
+#define MAX_JOB_ARGS 256
+
+/* A line of a --batch file: a script (or -m module) and its arguments. Its
+output, stdout and stderr together, is kept in a memfd until it ends. */
+struct batch_job {
+
+  int line;
+  char **words;
+  int word_count;
+  char **argv;
+
+  pid_t pid;
+  int output_fd;
+  struct timespec started;
+  long long ns;
+  int status;
+  bool done;
+
+};
+
+/* Split a line of a --batch file in place like a shell would for simple
+words: blanks separate them, '...' and "..." quote, \ escapes one character. */
+int split_job_line(char *line, char *words[], int max) {
+
+  int count = 0;
+  char *read = line;
+
+  while (*read) {
+
+    char *write;
+    char quote = 0;
+
+    while (*read == ' ' || *read == '\t') {
+
+      read++;
+
+    }
+
+    if (*read == '\0') {
+
+      break;
+
+    }
+
+    if (count == max) {
+
+      return -1;
+
+    }
+
+    words[count++] = write = read;
+
+    while (*read && (quote || (*read != ' ' && *read != '\t'))) {
+
+      if (quote ? *read == quote : (*read == '\'' || *read == '"')) {
+
+        quote = quote ? 0 : *read;
+        read++;
+
+      } else if (*read == '\\' && quote != '\'' && read[1]) {
+
+        *write++ = read[1];
+        read += 2;
+
+      } else {
+
+        *write++ = *read++;
+
+      }
+
+    }
+
+    if (quote) {
+
+      return -1;
+
+    }
+
+    if (*read) {
+
+      read++;
+
+    }
+
+    *write = '\0';
+
+  }
+
+  return count;
+
+}
+
+// Read the jobs of a --batch file, blank lines and lines starting with # are skipped
+struct batch_job *read_batch_file(const char *path, int *job_count) {
+
+  FILE *file = fopen(path, "r");
+  struct batch_job *jobs = NULL;
+  char *line = NULL;
+  size_t capacity = 0;
+  int count = 0;
+  int line_number = 0;
+
+  if (!file) {
+
+    fprintf(stderr, "Cannot read %s\n", path);
+    __raise__("Error opening the batch file");
+
+  }
+
+  while (getline(&line, &capacity, file) != -1) {
+
+    char *words[MAX_JOB_ARGS];
+    char *text = line + strspn(line, " \t");
+    int word_count;
+
+    line_number++;
+    text[strcspn(text, "\r\n")] = '\0';
+
+    if (text[0] == '\0' || text[0] == '#') {
+
+      continue;
+
+    }
+
+    word_count = split_job_line(text, words, MAX_JOB_ARGS);
+
+    bool flag = strcmp(words[0], "-m") == 0 || strcmp(words[0], "-c") == 0;
+
+    if (word_count < 1 || (flag ? word_count < 2 : strstr(words[0], ".py") == NULL)) {
+
+      fprintf(stderr, "%s:%d: expected <python_file.py>, -m <module> or -c <code>, then the arguments\n", path, line_number);
+      exit(EXIT_FAILURE);
+
+    }
+
+    jobs = realloc(jobs, (size_t)(count + 1) * sizeof(struct batch_job));
+
+    struct batch_job *job = jobs ? &jobs[count] : NULL;
+
+    if (!job || !(job->words = calloc((size_t)word_count, sizeof(char *)))
+        || !(job->argv = calloc((size_t)word_count + 2, sizeof(char *)))) {
+
+      __raise__("Error allocating the batch jobs");
+
+    }
+
+    job->line = line_number;
+    job->pid = 0;
+    job->output_fd = -1;
+    job->done = false;
+    job->word_count = word_count;
+    job->argv[0] = config.pypy_path;
+
+    for (int i = 0; i < word_count; i++) {
+
+      job->words[i] = strdup(words[i]);
+
+    }
+
+    // Like --args, the script is given to PyPy with an absolute path
+    for (int i = 0; i < word_count; i++) {
+
+      char *resolved = i == 0 && !flag ? realpath(words[0], NULL) : NULL;
+
+      job->argv[i + 1] = resolved ? resolved : job->words[i];
+
+    }
+
+    count++;
+
+  }
+
+  free(line);
+  fclose(file);
+
+  *job_count = count;
+
+  return jobs;
+
+}
+
+// Fork the interpreter of a job, with its output sent to a memfd
+void start_batch_job(struct batch_job *job, int slot) {
+
+  job->output_fd = memfd_create("pyram-job", MFD_CLOEXEC);
+
+  if (job->output_fd == -1) {
+
+    __raise__("Error creating the output of a batch job");
+
+  }
+
+  clock_gettime(CLOCK_MONOTONIC, &job->started);
+
+  pid_t pid = fork();
+
+  if (pid < 0) {
+
+    __raise__("Error while creating subprocess\n");
+
+  }
+
+  if (pid == 0) {
+
+    int null_fd = open("/dev/null", O_RDONLY);
+
+    if (null_fd == -1 || dup2(null_fd, STDIN_FILENO) == -1 || dup2(job->output_fd, STDOUT_FILENO) == -1
+        || dup2(job->output_fd, STDERR_FILENO) == -1) {
+
+      _exit(127);
+
+    }
+
+    if (pypy_memfd != -1) {
+
+      extern char **environ;
+
+      fexecve(pypy_memfd, job->argv, environ);
+
+    }
+
+    execv(config.pypy_path, job->argv);
+
+    perror("Error running PyPy");
+    _exit(127);
+
+  }
+
+  job->pid = pid;
+  batch_pids[slot] = pid;
+
+}
+
+/* Print the output of a job that ended, after a header with its command and
+exit code, and append its JSON line to PYRAM_BATCH_REPORT. */
+void report_batch_job(const char *batch_file, struct batch_job *job) {
+
+  off_t size = lseek(job->output_fd, 0, SEEK_END);
+  char *output = malloc(size > 0 ? (size_t)size + 1 : 1);
+  const char *sink = getenv("PYRAM_BATCH_REPORT");
+
+  if (!output || size < 0 || lseek(job->output_fd, 0, SEEK_SET) == -1 || !read_all(job->output_fd, output, (size_t)size)) {
+
+    __raise__("Error reading the output of a batch job");
+
+  }
+
+  output[size] = '\0';
+  close(job->output_fd);
+
+  printf("==> [%d]", job->line);
+
+  for (int i = 0; i < job->word_count; i++) {
+
+    printf(" %s", job->words[i]);
+
+  }
+
+  if (WIFSIGNALED(job->status)) {
+
+    printf(" (signal %d, %.3fs) <==\n", WTERMSIG(job->status), job->ns / 1e9);
+
+  } else {
+
+    printf(" (exit %d, %.3fs) <==\n", WEXITSTATUS(job->status), job->ns / 1e9);
+
+  }
+
+  fwrite(output, 1, (size_t)size, stdout);
+
+  if (size > 0 && output[size - 1] != '\n') {
+
+    putchar('\n');
+
+  }
+
+  fflush(stdout);
+
+  if (sink && sink[0]) {
+
+    char *line = NULL;
+    size_t line_size = 0;
+    struct timespec wall;
+    FILE *out = open_memstream(&line, &line_size);
+
+    if (out) {
+
+      clock_gettime(CLOCK_REALTIME, &wall);
+
+      fprintf(out, "{\"timestamp\": %lld.%03ld, \"pid\": %d, \"batch\": ",
+              (long long)wall.tv_sec, wall.tv_nsec / 1000000, (int)getpid());
+      write_json_string(out, batch_file);
+      fprintf(out, ", \"line\": %d, \"command\": [", job->line);
+
+      for (int i = 0; i < job->word_count; i++) {
+
+        fputs(i > 0 ? ", " : "", out);
+        write_json_string(out, job->words[i]);
+
+      }
+
+      fputs("]", out);
+
+      if (WIFSIGNALED(job->status)) {
+
+        fprintf(out, ", \"signal\": %d", WTERMSIG(job->status));
+
+      } else {
+
+        fprintf(out, ", \"exit_code\": %d", WEXITSTATUS(job->status));
+
+      }
+
+      fprintf(out, ", \"duration_ms\": %.3f, \"output\": ", job->ns / 1e6);
+      write_json_string(out, output);
+      write_report(out, &line, &line_size, sink);
+
+    }
+
+  }
+
+  free(output);
+
+}
+
+/* Run the jobs read from a --batch file, workers at a time, over the PyPy
+image set up once for all of them. Returns a wait status: 0 when every job
+succeeded, exit code 1 otherwise, or the signal which stopped the batch. */
+int run_batch(const char *batch_file, struct batch_job *jobs, int job_count, int workers) {
+
+  int next = 0;
+  int running = 0;
+  int failed = 0;
+  int finished = 0;
+  struct timespec started;
+  struct timespec ended;
+
+  clock_gettime(CLOCK_MONOTONIC, &started);
+  batch_running = 1;
+
+  while (next < job_count || running > 0) {
+
+    while (running < workers && next < job_count && !batch_signal) {
+
+      int slot = 0;
+
+      while (batch_pids[slot] != 0) {
+
+        slot++;
+
+      }
+
+      start_batch_job(&jobs[next++], slot);
+      running++;
+
+    }
+
+    if (running == 0) {
+
+      break;
+
+    }
+
+    int status;
+    pid_t pid = wait4(-1, &status, 0, NULL);
+
+    if (pid == -1) {
+
+      if (errno == EINTR) {
+
+        continue;
+
+      }
+
+      __raise__("Error waiting for PyPy\n");
+
+    }
+
+    for (int slot = 0; slot < workers; slot++) {
+
+      if (batch_pids[slot] == pid) {
+
+        batch_pids[slot] = 0;
+
+      }
+
+    }
+
+    for (int i = 0; i < next; i++) {
+
+      struct batch_job *job = &jobs[i];
+
+      if (job->pid == pid && !job->done) {
+
+        struct timespec now;
+
+        clock_gettime(CLOCK_MONOTONIC, &now);
+        job->ns = elapsed_ns(&job->started, &now);
+        job->status = status;
+        job->done = true;
+        running--;
+        finished++;
+        failed += !(WIFEXITED(status) && WEXITSTATUS(status) == 0);
+        report_batch_job(batch_file, job);
+
+      }
+
+    }
+
+  }
+
+  batch_running = 0;
+  clock_gettime(CLOCK_MONOTONIC, &ended);
+  resources.wall_ns = elapsed_ns(&started, &ended);
+  getrusage(RUSAGE_CHILDREN, &resources.usage);
+
+  fprintf(stderr, "PyRAM batch: %d jobs, %d succeeded, %d failed, %d not run, %.3fs with %d workers\n",
+          job_count, finished - failed, failed, job_count - finished, resources.wall_ns / 1e9, workers);
+
+  if (batch_signal) {
+
+    return W_EXITCODE(0, batch_signal);
+
+  }
+
+  return W_EXITCODE(failed > 0 ? EXIT_FAILURE : EXIT_SUCCESS, 0);
+
+}
+
+// Unix socket of the zygote daemon, PYRAM_SOCKET overrides the default one
+const char *zygote_socket_path() {
+
+  const char *path = getenv("PYRAM_SOCKET");
+
+  return (path != NULL && path[0] != '\0') ? path : ZYGOTE_SOCKET_PATH;
+
+}
+
+// Arguments of PyPy running the zygote daemon, must be freed by the caller
+char **build_daemon_argv(int argc, char *argv[]) {
+
+  char **pypy_argv = calloc(7, sizeof(char *));
+  int count = 0;
+
+  if (!pypy_argv) {
+
+    __raise__("Error allocating PyPy arguments");
+
+  }
+
+  pypy_argv[count++] = config.pypy_path;
+  pypy_argv[count++] = ZYGOTE_SCRIPT_PATH;
+  pypy_argv[count++] = "--socket";
+  pypy_argv[count++] = (char *)zygote_socket_path();
+
+  if (argc == 4) {
+
+    pypy_argv[count++] = argv[2];
+    pypy_argv[count++] = argv[3];
+
+  }
+
+  return pypy_argv;
+
+}
+
+/* Arguments of PyPy running the prefork WSGI server:
+--workers <n> [--bind <host:port>] <module>[:<callable>]. Must be freed by the caller. */
+char **build_server_argv(int argc, char *argv[]) {
+
+  char **pypy_argv = calloc(9, sizeof(char *));
+  int count = 0;
+
+  if (!pypy_argv) {
+
+    __raise__("Error allocating PyPy arguments");
+
+  }
+
+  pypy_argv[count++] = config.pypy_path;
+  pypy_argv[count++] = WSGI_SCRIPT_PATH;
+  pypy_argv[count++] = "--workers";
+  pypy_argv[count++] = argv[2];
+  pypy_argv[count++] = "--bind";
+  pypy_argv[count++] = argc == 6 ? argv[4] : DEFAULT_BIND;
+  pypy_argv[count++] = "--";
+  pypy_argv[count++] = argv[argc - 1];
+
+  return pypy_argv;
+
+}
+
+// Connection to the daemon, signals received by the client are written to it
+static int zygote_fd = -1;
+
+// Forward a signal to the script run by the daemon, "kill <signal>\n"
+void forward_signal_to_zygote(int signum) {
+
+  char message[32];
+  int length = 0;
+  char digits[12];
+  int digit_count = 0;
+
+  // snprintf is not async-signal-safe
+  memcpy(message, "kill ", 5);
+  length = 5;
+
+  for (int value = signum; value > 0 || digit_count == 0; value /= 10) {
+
+    digits[digit_count++] = (char)('0' + value % 10);
+
+  }
+
+  while (digit_count > 0) {
+
+    message[length++] = digits[--digit_count];
+
+  }
+
+  message[length++] = '\n';
+
+  write(zygote_fd, message, (size_t)length);
+
+}
+
+// Append a NUL terminated field to the request buffer
+void append_field(char **buffer, size_t *size, size_t *capacity, const char *field) {
+
+  size_t length = strlen(field) + 1;
+
+  while (*size + length > *capacity) {
+
+    *capacity = *capacity ? *capacity * 2 : 4096;
+    *buffer = realloc(*buffer, *capacity);
+
+    if (!*buffer) {
+
+      __raise__("Error allocating the daemon request");
+
+    }
+
+  }
+
+  memcpy(*buffer + *size, field, length);
+  *size += length;
+
+}
+
+/* Run a script in a process forked by the zygote daemon (pyram --daemon).
+The request holds the cwd, the arguments and the environment, and the client
+stdin, stdout and stderr are passed to the daemon, so the script reads and
+writes the terminal of the client directly. Never returns. */
+void run_zygote_client(int argc, char *argv[]) {
+
+  extern char **environ;
+  struct sockaddr_un address;
+  char *payload = NULL;
+  size_t size = 4;
+  size_t capacity = 0;
+  char number[32];
+  char cwd[4096];
+  int envc = 0;
+
+  zygote_fd = socket(AF_UNIX, SOCK_STREAM | SOCK_CLOEXEC, 0);
+
+  memset(&address, 0, sizeof(address));
+  address.sun_family = AF_UNIX;
+  snprintf(address.sun_path, sizeof(address.sun_path), "%s", zygote_socket_path());
+
+  if (zygote_fd == -1 || connect(zygote_fd, (struct sockaddr *)&address, sizeof(address)) == -1) {
+
+    fprintf(stderr, "No PyRAM daemon listening on %s, start one with: sudo pyram --daemon\n", address.sun_path);
+    exit(EXIT_FAILURE);
+
+  }
+
+  if (getcwd(cwd, sizeof(cwd)) == NULL) {
+
+    __raise__("Error in cwd\n");
+
+  }
+
+  // Room for the size of the payload, filled once it is complete
+  payload = malloc(4096);
+  capacity = 4096;
+
+  if (!payload) {
+
+    __raise__("Error allocating the daemon request");
+
+  }
+
+  append_field(&payload, &size, &capacity, cwd);
+  snprintf(number, sizeof(number), "%d", argc - 2);
+  append_field(&payload, &size, &capacity, number);
+
+  for (int i = 2; i < argc; i++) {
+
+    // The daemon runs in another directory, the script is given with an absolute path
+    char *resolved = (i == 2 && strcmp(argv[i], "-m") != 0) ? realpath(argv[i], NULL) : NULL;
+
+    append_field(&payload, &size, &capacity, resolved ? resolved : argv[i]);
+    free(resolved);
+
+  }
+
+  while (environ[envc]) {
+
+    envc++;
+
+  }
+
+  snprintf(number, sizeof(number), "%d", envc);
+  append_field(&payload, &size, &capacity, number);
+
+  for (int i = 0; i < envc; i++) {
+
+    append_field(&payload, &size, &capacity, environ[i]);
+
+  }
+
+  uint32_t payload_size = htonl((uint32_t)(size - 4));
+  memcpy(payload, &payload_size, 4);
+
+  // The first bytes carry the stdin, stdout and stderr of the client
+  int fds[3] = { STDIN_FILENO, STDOUT_FILENO, STDERR_FILENO };
+  char control[CMSG_SPACE(sizeof(fds))];
+  struct iovec iov = { payload, size };
+  struct msghdr message;
+
+  memset(&message, 0, sizeof(message));
+  memset(control, 0, sizeof(control));
+  message.msg_iov = &iov;
+  message.msg_iovlen = 1;
+  message.msg_control = control;
+  message.msg_controllen = sizeof(control);
+
+  struct cmsghdr *header = CMSG_FIRSTHDR(&message);
+  header->cmsg_level = SOL_SOCKET;
+  header->cmsg_type = SCM_RIGHTS;
+  header->cmsg_len = CMSG_LEN(sizeof(fds));
+  memcpy(CMSG_DATA(header), fds, sizeof(fds));
+
+  ssize_t sent = sendmsg(zygote_fd, &message, 0);
+
+  if (sent <= 0 || !write_all(zygote_fd, payload + sent, size - (size_t)sent)) {
+
+    __raise__("Error sending the request to the PyRAM daemon");
+
+  }
+
+  free(payload);
+
+  // The script is not in the terminal process group, so terminal signals are forwarded too
+  struct sigaction action;
+  int forwarded[] = { SIGINT, SIGTERM, SIGHUP, SIGQUIT, SIGUSR1, SIGUSR2, SIGWINCH };
+
+  memset(&action, 0, sizeof(action));
+  action.sa_handler = forward_signal_to_zygote;
+  sigemptyset(&action.sa_mask);
+
+  for (size_t i = 0; i < sizeof(forwarded) / sizeof(forwarded[0]); i++) {
+
+    sigaction(forwarded[i], &action, NULL);
+
+  }
+
+  // Read "pid <pid>" then "exit <code>" or "signal <signal>"
+  char reply[256];
+  size_t used = 0;
+
+  for (;;) {
+
+    ssize_t bytes = read(zygote_fd, reply + used, sizeof(reply) - used - 1);
+
+    if (bytes < 0 && errno == EINTR) {
+
+      continue;
+
+    }
+
+    if (bytes <= 0) {
+
+      fprintf(stderr, "Connection to the PyRAM daemon lost\n");
+      exit(EXIT_FAILURE);
+
+    }
+
+    used += (size_t)bytes;
+    reply[used] = '\0';
+
+    char *newline;
+
+    while ((newline = strchr(reply, '\n')) != NULL) {
+
+      int value;
+
+      *newline = '\0';
+
+      if (sscanf(reply, "exit %d", &value) == 1) {
+
+        exit(value);
+
+      } else if (sscanf(reply, "signal %d", &value) == 1) {
+
+        signal(value, SIG_DFL);
+        raise(value);
+        exit(128 + value);
+
+      }
+
+      used -= (size_t)(newline + 1 - reply);
+      memmove(reply, newline + 1, used + 1);
+
+    }
+
+  }
+
+}
+
+#define MAX_PATTERNS 16
+#define PAGE_BYTES 4096LL
+
+// Room left on --toram disks for what the script writes (e.g. __pycache__)
+#define TORAM_HEADROOM (16LL << 20)
+
+enum copy_kind {
+
+  COPY_DIR,
+  COPY_FILE,
+  COPY_SYMLINK
+
+};
+
+struct copy_entry {
+
+  enum copy_kind kind;
+  char *src;
+  char *dst;
+  struct stat st;
+
+};
+
+/* Files and directories to copy into a RAM disk. The tree is measured first
+so the tmpfs can be sized before anything is copied, then the directories are
+created in order and the files copied by several threads. */
+struct copy_plan {
+
+  struct copy_entry *entries;
+  size_t count;
+  size_t capacity;
+  long long bytes;
+
+  const char *includes[MAX_PATTERNS];
+  int include_count;
+  const char *excludes[MAX_PATTERNS];
+  int exclude_count;
+
+  // Shared by the copy threads
+  size_t next_file;
+  int error;
+  const char *failed_path;
+
+};
+
+void add_copy_entry(struct copy_plan *plan, enum copy_kind kind, const char *src, const char *dst, const struct stat *st) {
+
+  if (plan->count == plan->capacity) {
+
+    plan->capacity = plan->capacity ? plan->capacity * 2 : 256;
+    plan->entries = realloc(plan->entries, plan->capacity * sizeof(struct copy_entry));
+
+    if (!plan->entries) {
+
+      __raise__("Error allocating the copy plan");
+
+    }
+
+  }
+
+  struct copy_entry *entry = &plan->entries[plan->count++];
+
+  entry->kind = kind;
+  entry->src = strdup(src);
+  entry->dst = strdup(dst);
+  entry->st = *st;
+
+  if (!entry->src || !entry->dst) {
+
+    __raise__("Error allocating the copy plan");
+
+  }
+
+  if (kind == COPY_FILE) {
+
+    plan->bytes += ((long long)st->st_size + PAGE_BYTES - 1) / PAGE_BYTES * PAGE_BYTES;
+
+  }
+
+}
+
+// Check a path relative to the copied root, and its base name, against glob patterns
+bool matches_any(const char *relative, const char *const patterns[], int count) {
+
+  const char *base = strrchr(relative, '/');
+  base = base ? base + 1 : relative;
+
+  for (int i = 0; i < count; i++) {
+
+    if (fnmatch(patterns[i], relative, 0) == 0 || fnmatch(patterns[i], base, 0) == 0) {
+
+      return true;
+
+    }
+
+  }
+
+  return false;
+
+}
+
+// Walk a directory adding what passes the --include/--exclude patterns to the plan
+void plan_directory(struct copy_plan *plan, const char *src, const char *dst, const char *relative) {
+
+  DIR *dir = opendir(src);
+  struct dirent *entry;
+
+  if (!dir) {
+
+    __raise__("Error opening directory to copy to RAM");
+
+  }
+
+  while ((entry = readdir(dir)) != NULL) {
+
+    char src_path[4096];
+    char dst_path[4096];
+    char rel_path[4096];
+    struct stat st;
+
+    if (strcmp(entry->d_name, ".") == 0 || strcmp(entry->d_name, "..") == 0) {
+
+      continue;
+
+    }
+
+    snprintf(src_path, sizeof(src_path), "%s/%s", src, entry->d_name);
+    snprintf(dst_path, sizeof(dst_path), "%s/%s", dst, entry->d_name);
+    snprintf(rel_path, sizeof(rel_path), "%s%s%s", relative, relative[0] ? "/" : "", entry->d_name);
+
+    if (lstat(src_path, &st) == -1 || matches_any(rel_path, plan->excludes, plan->exclude_count)) {
+
+      continue;
+
+    }
+
+    if (S_ISDIR(st.st_mode)) {
+
+      add_copy_entry(plan, COPY_DIR, src_path, dst_path, &st);
+      plan_directory(plan, src_path, dst_path, rel_path);
+
+    } else if (plan->include_count == 0 || matches_any(rel_path, plan->includes, plan->include_count)) {
+
+      if (S_ISREG(st.st_mode)) {
+
+        add_copy_entry(plan, COPY_FILE, src_path, dst_path, &st);
+
+      } else if (S_ISLNK(st.st_mode)) {
+
+        add_copy_entry(plan, COPY_SYMLINK, src_path, dst_path, &st);
+
+      }
+
+    }
+
+  }
+
+  closedir(dir);
+
+}
+
+// Add a file or a whole directory tree to the plan, to be copied to dst
+void plan_copy(struct copy_plan *plan, const char *src, const char *dst) {
+
+  struct stat st;
+
+  if (stat(src, &st) == -1) {
+
+    fprintf(stderr, "Cannot copy %s to RAM\n", src);
+    __raise__("Error reading the file to copy to RAM");
+
+  }
+
+  if (S_ISDIR(st.st_mode)) {
+
+    add_copy_entry(plan, COPY_DIR, src, dst, &st);
+    plan_directory(plan, src, dst, "");
+
+  } else {
+
+    add_copy_entry(plan, COPY_FILE, src, dst, &st);
+
+  }
+
+}
+
+/* Copy one file inside the kernel: copy_file_range, then sendfile for the
+kernels refusing copies across filesystems, then read and write. The
+modification time is kept so the bytecode cached for the file stays valid. */
+bool copy_file(const char *src, const char *dst, const struct stat *st) {
+
+  int in = open(src, O_RDONLY | O_CLOEXEC);
+
+  if (in == -1) {
+
+    return false;
+
+  }
+
+  int out = open(dst, O_WRONLY | O_CREAT | O_TRUNC | O_CLOEXEC, st->st_mode & 07777);
+
+  if (out == -1) {
+
+    close(in);
+    return false;
+
+  }
+
+  off_t remaining = st->st_size;
+  bool use_copy_file_range = true;
+  bool use_sendfile = true;
+  bool ok = true;
+
+  while (ok && remaining > 0) {
+
+    ssize_t copied = -1;
+
+    if (use_copy_file_range) {
+
+      copied = copy_file_range(in, NULL, out, NULL, (size_t)remaining, 0);
+
+      if (copied == -1 && (errno == EXDEV || errno == ENOSYS || errno == EINVAL || errno == EOPNOTSUPP)) {
+
+        use_copy_file_range = false;
+        continue;
+
+      }
+
+    } else if (use_sendfile) {
+
+      copied = sendfile(out, in, NULL, (size_t)remaining);
+
+      if (copied == -1 && (errno == ENOSYS || errno == EINVAL)) {
+
+        use_sendfile = false;
+        continue;
+
+      }
+
+    } else {
+
+      char buffer[65536];
+
+      copied = read(in, buffer, sizeof(buffer));
+
+      if (copied > 0 && !write_all(out, buffer, (size_t)copied)) {
+
+        copied = -1;
+
+      }
+
+    }
+
+    if (copied == -1 && errno == EINTR) {
+
+      continue;
+
+    }
+
+    // The file shrank while being copied, keep what was read
+    if (copied == 0) {
+
+      break;
+
+    }
+
+    ok = copied > 0;
+    remaining -= copied;
+
+  }
+
+  struct timespec times[2] = { st->st_atim, st->st_mtim };
+  futimens(out, times);
+
+  close(in);
+
+  return close(out) == 0 && ok;
+
+}
+
+void *copy_thread(void *arg) {
+
+  struct copy_plan *plan = arg;
+
+  for (;;) {
+
+    size_t index = __atomic_fetch_add(&plan->next_file, 1, __ATOMIC_RELAXED);
+
+    if (index >= plan->count) {
+
+      return NULL;
+
+    }
+
+    struct copy_entry *entry = &plan->entries[index];
+
+    if (entry->kind == COPY_FILE && !copy_file(entry->src, entry->dst, &entry->st)) {
+
+      plan->error = errno;
+      plan->failed_path = entry->src;
+
+    }
+
+  }
+
+}
+
+// Number of threads copying files, one per core up to 8
+#define MAX_COPY_THREADS 8
+
+// Create the directories and symlinks of the plan, returns the number of files left to copy
+size_t create_copy_tree(struct copy_plan *plan) {
+
+  size_t file_count = 0;
+
+  for (size_t i = 0; i < plan->count; i++) {
+
+    struct copy_entry *entry = &plan->entries[i];
+
+    if (entry->kind == COPY_DIR) {
+
+      if (mkdir(entry->dst, entry->st.st_mode & 07777) == -1 && errno != EEXIST) {
+
+        __raise__("Error creating directory in RAM");
+
+      }
+
+    } else if (entry->kind == COPY_SYMLINK) {
+
+      char target[4096];
+      ssize_t length = readlink(entry->src, target, sizeof(target) - 1);
+
+      if (length >= 0) {
+
+        target[length] = '\0';
+        symlink(target, entry->dst);
+
+      }
+
+    } else {
+
+      file_count++;
+
+    }
+
+  }
+
+  return file_count;
+
+}
+
+/* Copy the files of the plan in parallel. Errors are left in plan->error, so
+it can also run in a background thread. */
+void copy_plan_files(struct copy_plan *plan, size_t file_count) {
+
+  pthread_t threads[MAX_COPY_THREADS];
+  int thread_count = online_cpus();
+
+  if (thread_count > MAX_COPY_THREADS) {
+
+    thread_count = MAX_COPY_THREADS;
+
+  }
+
+  if ((size_t)thread_count > file_count) {
+
+    thread_count = file_count > 0 ? (int)file_count : 1;
+
+  }
+
+  plan->next_file = 0;
+  plan->error = 0;
+
+  for (int i = 0; i < thread_count; i++) {
+
+    if (pthread_create(&threads[i], NULL, copy_thread, plan) != 0) {
+
+      thread_count = i;
+      break;
+
+    }
+
+  }
+
+  // Copy in this thread too if no thread could be started
+  if (thread_count == 0) {
+
+    copy_thread(plan);
+
+  }
+
+  for (int i = 0; i < thread_count; i++) {
+
+    pthread_join(threads[i], NULL);
+
+  }
+
+}
+
+void raise_copy_error(struct copy_plan *plan) {
+
+  if (plan->error != 0) {
+
+    errno = plan->error;
+    fprintf(stderr, "Error copying %s to RAM\n", plan->failed_path);
+    __raise__("Error copying to RAM");
+
+  }
+
+}
+
+// Create the directories and symlinks of the plan, then copy its files in parallel
+void run_copy_plan(struct copy_plan *plan) {
+
+  copy_plan_files(plan, create_copy_tree(plan));
+  raise_copy_error(plan);
+
+}
+
+void free_copy_plan(struct copy_plan *plan) {
+
+  for (size_t i = 0; i < plan->count; i++) {
+
+    free(plan->entries[i].src);
+    free(plan->entries[i].dst);
+
+  }
+
+  free(plan->entries);
+  plan->entries = NULL;
+  plan->count = 0;
+  plan->capacity = 0;
+
+}
+
+// What --toram copies to RAM, parsed from the options following it
+struct toram_options {
+
+  const char *project;
+  struct copy_plan plan;
+
+  // Path of the script inside the RAM disk
+  char script[4096];
+
+};
+
+/* The RAM copy made by --toram is gone after each run, and so would be the
+bytecode Python writes next to it. PYTHONPYCACHEPREFIX points the bytecode to
+the PyPy RAM disk instead, which is kept between runs, in a directory keyed
+by a hash of the source location so projects copied to the same RAM path do
+not share it. Copies keep the mtime of the sources, so the bytecode stays
+valid until a source changes. A PYTHONPYCACHEPREFIX set by the user wins. */
+void set_pycache_prefix(const char *source) {
+
+  char prefix[4096];
+  unsigned long long key = fnv1a(FNV_OFFSET_BASIS, (const unsigned char *)source, strlen(source));
+
+  snprintf(prefix, sizeof(prefix), "%s/%016llx", config.pycache_path, key);
+
+  if (setenv("PYTHONPYCACHEPREFIX", prefix, 0) == -1) {
+
+    __raise__("Error setting PYTHONPYCACHEPREFIX");
+
+  }
+
+}
+
+/* Copies the given Python file, or the whole project directory containing it,
+to a RAM disk of the run (PYFILE_RAMDISK_PATH/<pid>, or PYFILE_RAMDISK_PATH
+itself in a private namespace) sized from the measured tree. In project mode
+the script runs from the RAM copy of the project, which is also added to
+PYTHONPATH, so its imports are resolved from RAM. */
+void allocate_python_file_to_ram(const char *python_file, struct toram_options *toram) {
+
+   struct copy_plan *plan = &toram->plan;
+
+   if (config.private_mounts) {
+
+     snprintf(toram_root, sizeof(toram_root), "%s", PYFILE_RAMDISK_PATH);
+
+   } else {
+
+     if (mkdir(PYFILE_RAMDISK_PATH, 0755) == -1 && errno != EEXIST) {
+
+       __raise__("Error creating " PYFILE_RAMDISK_PATH);
+
+     }
+
+     snprintf(toram_root, sizeof(toram_root), "%s/%d", PYFILE_RAMDISK_PATH, (int)getpid());
+
+   }
+
+   if (toram->project) {
+
+     char root[4096];
+     char script[4096];
+     size_t root_length;
+
+     if (!realpath(toram->project, root) || !realpath(python_file, script)) {
+
+       __raise__("Error resolving the project to copy to RAM");
+
+     }
+
+     set_pycache_prefix(root);
+
+     root_length = strlen(root);
+
+     if (strncmp(script, root, root_length) != 0 || script[root_length] != '/') {
+
+       fprintf(stderr, "%s is not inside the project %s\n", python_file, toram->project);
+       exit(EXIT_FAILURE);
+
+     }
+
+     plan_copy(plan, root, toram_root);
+     snprintf(toram->script, sizeof(toram->script), "%s%s", toram_root, script + root_length);
+
+   } else {
+
+     const char *filename = strrchr(python_file, '/');
+     filename = filename ? filename + 1 : python_file;
+     char *script = realpath(python_file, NULL);
+
+     set_pycache_prefix(script ? script : python_file);
+     free(script);
+
+     snprintf(toram->script, sizeof(toram->script), "%s/%s", toram_root, filename);
+     plan_copy(plan, python_file, toram->script);
+
+   }
+
+   // Mount tmpfs for the pyfile RAM disk, it is unmounted when the run ends
+   unmount_all(toram_root);
+   mount_tmpfs(toram_root, plan->bytes + plan->bytes / 10 + TORAM_HEADROOM);
+   // rmdir would also detach the disks of the private runs from their namespaces
+   register_owned_mount(toram_root, !config.private_mounts, false);
+
+   run_copy_plan(plan);
+   free_copy_plan(plan);
+
+   if (access(toram->script, F_OK) != 0) {
+
+     fprintf(stderr, "%s was left out by --include/--exclude\n", python_file);
+     __raise__("Error copying the script to RAM");
+
+   }
+
+   if (toram->project) {
+
+     const char *python_path = getenv("PYTHONPATH");
+     char *new_path = NULL;
+
+     if (asprintf(&new_path, "%s%s%s", toram_root, python_path ? ":" : "", python_path ? python_path : "") == -1
+         || setenv("PYTHONPATH", new_path, 1) == -1 || chdir(toram_root) == -1) {
+
+       __raise__("Error setting up the project in RAM");
+
+     }
+
+     free(new_path);
+
+   }
+
+}
+
+/* Unmount and remove the RAM disks of the runs which are gone, kept in
+directories named after their pid, returns how many mounts were released.
+The disks of running processes are kept. */
+int release_dead_run_disks(const char *parent) {
+
+  DIR *dir = opendir(parent);
+  struct dirent *entry;
+  int released = 0;
+
+  if (!dir) {
+
+    return 0;
+
+  }
+
+  while ((entry = readdir(dir)) != NULL) {
+
+    char path[512];
+    char *end;
+    long pid = strtol(entry->d_name, &end, 10);
+
+    if (pid <= 0 || *end != '\0' || kill((pid_t)pid, 0) == 0 || errno != ESRCH) {
+
+      continue;
+
+    }
+
+    snprintf(path, sizeof(path), "%s/%s", parent, entry->d_name);
+    released += unmount_all(path);
+    rmdir(path);
+
+  }
+
+  closedir(dir);
+
+  return released;
+
+}
+
+#define MAX_STAGES 16
+
+struct stage_entry {
+
+  const char *source;
+  char name[256];
+  char path[4096];
+
+  // --writeback DIR:DEST, source is DEST and resolved its absolute path
+  bool writeback;
+  char resolved[4096];
+
+};
+
+/* Inputs given with --stage SRC[:DEST], copied into a RAM disk of the run
+(STAGE_RAMDISK_PATH/<pid>, or STAGE_RAMDISK_PATH itself in a private
+namespace) by a background thread while the PyPy image is set up. The
+directories given with --writeback are staged the same way, then written
+back while the run goes on. */
+static struct {
+
+  struct stage_entry entries[MAX_STAGES];
+  int count;
+  struct copy_plan plan;
+  pthread_t thread;
+  bool copying;
+
+} stage;
+
+// Parse a --stage SRC[:DEST] option, DEST defaults to the base name of SRC
+void add_stage(const char *spec) {
+
+  struct stage_entry *entry = &stage.entries[stage.count];
+  const char *colon = strrchr(spec, ':');
+  const char *name = colon && colon[1] ? colon + 1 : NULL;
+  size_t source_length = name ? (size_t)(colon - spec) : strlen(spec);
+  size_t name_length;
+
+  if (stage.count == MAX_STAGES) {
+
+    fprintf(stderr, "At most %d --stage options\n", MAX_STAGES);
+    exit(EXIT_FAILURE);
+
+  }
+
+  // Base name of the source, without its trailing slashes
+  while (source_length > 1 && spec[source_length - 1] == '/') {
+
+    source_length--;
+
+  }
+
+  entry->source = strndup(spec, source_length);
+
+  if (!name && entry->source) {
+
+    name = strrchr(entry->source, '/') ? strrchr(entry->source, '/') + 1 : entry->source;
+
+  }
+
+  name_length = name ? strlen(name) : 0;
+
+  if (!entry->source || source_length == 0 || name_length == 0 || name_length >= sizeof(entry->name)
+      || name[0] == '/' || strcmp(name, ".") == 0 || strstr(name, "..")) {
+
+    fprintf(stderr, "Invalid --stage %s, expected SRC[:DEST] with DEST a relative name\n", spec);
+    exit(EXIT_FAILURE);
+
+  }
+
+  memcpy(entry->name, name, name_length + 1);
+  stage.count++;
+
+}
+
+/* Parse a --writeback DIR:DEST option: the script writes in DIR, in the RAM
+disk, which starts as a copy of DEST and is written back to it. */
+void add_writeback(const char *spec) {
+
+  const char *colon = strchr(spec, ':');
+
+  if (!colon || colon == spec || colon[1] == '\0') {
+
+    fprintf(stderr, "Invalid --writeback %s, expected DIR:DEST\n", spec);
+    exit(EXIT_FAILURE);
+
+  }
+
+  char *swapped = NULL;
+
+  // Same entry as --stage DEST:DIR
+  if (asprintf(&swapped, "%s:%.*s", colon + 1, (int)(colon - spec), spec) == -1) {
+
+    __raise__("Error allocating the write-back directories");
+
+  }
+
+  add_stage(swapped);
+  stage.entries[stage.count - 1].writeback = true;
+  free(swapped);
+
+}
+
+/* Export where the inputs were staged: PYRAM_STAGE_DIR is the RAM disk and
+PYRAM_STAGE_<DEST> the copy of each input, with DEST in upper case and the
+characters which cannot appear in a variable name replaced by '_'. The
+--writeback directories are PYRAM_WRITEBACK_<DIR>. */
+void export_stage_paths() {
+
+  if (setenv("PYRAM_STAGE_DIR", stage_root, 1) == -1) {
+
+    __raise__("Error setting PYRAM_STAGE_DIR");
+
+  }
+
+  for (int i = 0; i < stage.count; i++) {
+
+    char variable[300];
+    size_t length = (size_t)snprintf(variable, sizeof(variable), "%s",
+                                     stage.entries[i].writeback ? "PYRAM_WRITEBACK_" : "PYRAM_STAGE_");
+
+    for (const char *c = stage.entries[i].name; *c && length < sizeof(variable) - 1; c++) {
+
+      variable[length++] = isalnum((unsigned char)*c) ? (char)toupper((unsigned char)*c) : '_';
+
+    }
+
+    variable[length] = '\0';
+
+    if (setenv(variable, stage.entries[i].path, 1) == -1) {
+
+      __raise__("Error setting the staged paths");
+
+    }
+
+  }
+
+}
+
+void *stage_thread(void *arg) {
+
+  size_t *file_count = arg;
+
+  copy_plan_files(&stage.plan, *file_count);
+
+  return NULL;
+
+}
+
+/* Measure the inputs, mount a RAM disk sized for them and start copying them
+in the background. The directories are created here, so every error but the
+ones of the file copies is reported before PyPy is set up. */
+void start_staging() {
+
+  static size_t file_count;
+
+  if (stage.count == 0) {
+
+    return;
+
+  }
+
+  if (config.private_mounts) {
+
+    snprintf(stage_root, sizeof(stage_root), "%s", STAGE_RAMDISK_PATH);
+
+  } else {
+
+    if (mkdir(STAGE_RAMDISK_PATH, 0755) == -1 && errno != EEXIST) {
+
+      __raise__("Error creating " STAGE_RAMDISK_PATH);
+
+    }
+
+    snprintf(stage_root, sizeof(stage_root), "%s/%d", STAGE_RAMDISK_PATH, (int)getpid());
+
+  }
+
+  for (int i = 0; i < stage.count; i++) {
+
+    struct stage_entry *entry = &stage.entries[i];
+    struct stat st;
+
+    // The destination of a write-back is created when missing
+    if (entry->writeback && mkdir(entry->source, 0755) == -1 && errno != EEXIST) {
+
+      fprintf(stderr, "Cannot create %s\n", entry->source);
+      __raise__("Error creating the write-back directory");
+
+    }
+
+    if (!realpath(entry->source, entry->resolved)) {
+
+      fprintf(stderr, "Cannot stage %s\n", entry->source);
+      __raise__("Error reading the input to stage");
+
+    }
+
+    if (entry->writeback && (stat(entry->resolved, &st) == -1 || !S_ISDIR(st.st_mode))) {
+
+      fprintf(stderr, "%s is not a directory\n", entry->source);
+      exit(EXIT_FAILURE);
+
+    }
+
+    snprintf(entry->path, sizeof(entry->path), "%s/%s", stage_root, entry->name);
+    plan_copy(&stage.plan, entry->resolved, entry->path);
+
+  }
+
+  unmount_all(stage_root);
+  mount_tmpfs(stage_root, stage.plan.bytes + stage.plan.bytes / 10 + TORAM_HEADROOM);
+  // As for --toram, the directory is shared with the private namespaces of other runs
+  register_owned_mount(stage_root, !config.private_mounts, false);
+
+  // Directories of the destinations given as a/b
+  for (int i = 0; i < stage.count; i++) {
+
+    char dir[4096];
+
+    snprintf(dir, sizeof(dir), "%s", stage.entries[i].path);
+
+    for (char *slash = strchr(dir + strlen(stage_root) + 1, '/'); slash; slash = strchr(slash + 1, '/')) {
+
+      *slash = '\0';
+
+      if (mkdir(dir, 0755) == -1 && errno != EEXIST) {
+
+        __raise__("Error creating directory in RAM");
+
+      }
+
+      *slash = '/';
+
+    }
+
+  }
+
+  file_count = create_copy_tree(&stage.plan);
+  export_stage_paths();
+
+  stage.copying = pthread_create(&stage.thread, NULL, stage_thread, &file_count) == 0;
+
+  if (!stage.copying) {
+
+    copy_plan_files(&stage.plan, file_count);
+
+  }
+
+  mark_phase("stage");
+
+}
+
+// Wait for the staged inputs to be in RAM
+void finish_staging() {
+
+  if (stage.count == 0) {
+
+    return;
+
+  }
+
+  if (stage.copying) {
+
+    pthread_join(stage.thread, NULL);
+    stage.copying = false;
+
+  }
+
+  raise_copy_error(&stage.plan);
+  free_copy_plan(&stage.plan);
+
+}
+
+/* Replace the arguments naming a staged input, or a path inside it, by its
+copy in RAM. Used for the script arguments and for those of --batch jobs. */
+void stage_argument_values(char *values[], int count) {
+
+  for (int i = 0; i < count; i++) {
+
+    for (int j = 0; j < stage.count; j++) {
+
+      const char *source = stage.entries[j].source;
+      size_t length = strlen(source);
+
+      if (strncmp(values[i], source, length) == 0 && (values[i][length] == '\0' || values[i][length] == '/')) {
+
+        if (asprintf(&values[i], "%s%s", stage.entries[j].path, values[i] + length) == -1) {
+
+          __raise__("Error allocating PyPy arguments");
+
+        }
+
+        break;
+
+      }
+
+    }
+
+  }
+
+}
+
+char **stage_arguments(int argc, char *argv[]) {
+
+  int first = strcmp(argv[1], "-m") == 0 || strcmp(argv[1], "-c") == 0 ? 3 : find_script_index(argc, argv) + 1;
+
+  // The daemon and the WSGI server take no script arguments
+  if (strcmp(argv[1], "--daemon") == 0 || strcmp(argv[1], "--workers") == 0) {
+
+    return argv;
+
+  }
+
+  char **staged = calloc((size_t)argc + 1, sizeof(char *));
+
+  if (!staged) {
+
+    __raise__("Error allocating PyPy arguments");
+
+  }
+
+  memcpy(staged, argv, (size_t)argc * sizeof(char *));
+
+  if (first < argc) {
+
+    stage_argument_values(staged + first, argc - first);
+
+  }
+
+  return staged;
+
+}
+
+/* Background thread writing the --writeback directories back while PyPy
+runs, every writeback_interval, then a last time once it exited. Only the
+files whose size or modification time differ from their copy on disk are
+written, so the writes made in RAM between two passes cost one copy. */
+static struct {
+
+  pthread_t thread;
+  pthread_mutex_t lock;
+  pthread_cond_t wake;
+  bool enabled;
+  bool running;
+  bool stopping;
+  bool failed;
+
+} writeback = { .lock = PTHREAD_MUTEX_INITIALIZER, .wake = PTHREAD_COND_INITIALIZER };
+
+/* Copy what changed in a RAM directory to its destination. Files go through a
+temporary name and rename, so the destination never holds a partial file.
+Files deleted in RAM are kept on disk. */
+bool write_back_directory(const char *src, const char *dst) {
+
+  DIR *dir = opendir(src);
+  struct dirent *entry;
+  bool ok = true;
+
+  if (!dir) {
+
+    return false;
+
+  }
+
+  while ((entry = readdir(dir)) != NULL) {
+
+    char src_path[4096];
+    char dst_path[4096];
+    char tmp_path[4096];
+    struct stat st;
+    struct stat current;
+
+    if (strcmp(entry->d_name, ".") == 0 || strcmp(entry->d_name, "..") == 0) {
+
+      continue;
+
+    }
+
+    snprintf(src_path, sizeof(src_path), "%s/%s", src, entry->d_name);
+    snprintf(dst_path, sizeof(dst_path), "%s/%s", dst, entry->d_name);
+
+    if (lstat(src_path, &st) == -1) {
+
+      continue;
+
+    }
+
+    if (S_ISDIR(st.st_mode)) {
+
+      if (mkdir(dst_path, st.st_mode & 07777) == -1 && errno != EEXIST) {
+
+        fprintf(stderr, "PyRAM: cannot write back %s: %s\n", src_path, strerror(errno));
+        ok = false;
+        continue;
+
+      }
+
+      ok = write_back_directory(src_path, dst_path) && ok;
+
+    } else if (S_ISREG(st.st_mode)) {
+
+      if (lstat(dst_path, &current) == 0 && current.st_size == st.st_size
+          && current.st_mtim.tv_sec == st.st_mtim.tv_sec && current.st_mtim.tv_nsec == st.st_mtim.tv_nsec) {
+
+        continue;
+
+      }
+
+      snprintf(tmp_path, sizeof(tmp_path), "%s/.%s.pyram-tmp", dst, entry->d_name);
+
+      if (!copy_file(src_path, tmp_path, &st) || rename(tmp_path, dst_path) == -1) {
+
+        fprintf(stderr, "PyRAM: cannot write back %s: %s\n", src_path, strerror(errno));
+        unlink(tmp_path);
+        ok = false;
+
+      }
+
+    } else if (S_ISLNK(st.st_mode) && lstat(dst_path, &current) == -1) {
+
+      char target[4096];
+      ssize_t length = readlink(src_path, target, sizeof(target) - 1);
+
+      if (length >= 0) {
+
+        target[length] = '\0';
+        symlink(target, dst_path);
+
+      }
+
+    }
+
+  }
+
+  closedir(dir);
+
+  return ok;
+
+}
+
+bool write_back_all() {
+
+  bool ok = true;
+
+  for (int i = 0; i < stage.count; i++) {
+
+    if (stage.entries[i].writeback) {
+
+      ok = write_back_directory(stage.entries[i].path, stage.entries[i].resolved) && ok;
+
+    }
+
+  }
+
+  return ok;
+
+}
+
+void *writeback_thread(void *arg) {
+
+  (void)arg;
+
+  pthread_mutex_lock(&writeback.lock);
+
+  while (!writeback.stopping) {
+
+    struct timespec deadline;
+
+    clock_gettime(CLOCK_REALTIME, &deadline);
+    deadline.tv_sec += config.writeback_interval_ms / 1000;
+    deadline.tv_nsec += (config.writeback_interval_ms % 1000) * 1000000;
+
+    if (deadline.tv_nsec >= 1000000000) {
+
+      deadline.tv_sec++;
+      deadline.tv_nsec -= 1000000000;
+
+    }
+
+    if (pthread_cond_timedwait(&writeback.wake, &writeback.lock, &deadline) == ETIMEDOUT && !writeback.stopping) {
+
+      pthread_mutex_unlock(&writeback.lock);
+      write_back_all();
+      pthread_mutex_lock(&writeback.lock);
+
+    }
+
+  }
+
+  pthread_mutex_unlock(&writeback.lock);
+
+  return NULL;
+
+}
+
+// Start writing the --writeback directories back in the background
+void start_writeback() {
+
+  for (int i = 0; i < stage.count; i++) {
+
+    if (stage.entries[i].writeback) {
+
+      writeback.enabled = true;
+      writeback.running = pthread_create(&writeback.thread, NULL, writeback_thread, NULL) == 0;
+      return;
+
+    }
+
+  }
+
+}
+
+/* Stop the background thread and write everything back before the RAM disk is
+released. A run whose outputs could not all be written back fails, even if
+the script succeeded. */
+int finish_writeback(int status) {
+
+  if (writeback.running) {
+
+    pthread_mutex_lock(&writeback.lock);
+    writeback.stopping = true;
+    pthread_cond_signal(&writeback.wake);
+    pthread_mutex_unlock(&writeback.lock);
+    pthread_join(writeback.thread, NULL);
+    writeback.running = false;
+
+  }
+
+  if (!write_back_all() && WIFEXITED(status) && WEXITSTATUS(status) == 0) {
+
+    return W_EXITCODE(EXIT_FAILURE, 0);
+
+  }
+
+  return status;
+
+}
+
+/* Unmount the RAM disks left by previous runs: the PyPy tree in RAM (and any
+tmpfs stacked under it by older versions of pyram) and the --toram and --stage
+disks of runs which were killed. */
+void gc_mounts_and_exit() {
+
+  const char *run_disks[] = { PYFILE_RAMDISK_PATH, STAGE_RAMDISK_PATH };
+  bool release_tree = true;
+
+  open_image_locks();
+  lock_image_setup();
+
+  // The PyPy tree is kept while runs execute from it
+  if (!take_image_exclusively()) {
+
+    printf("%s: in use by running processes, kept\n", config.mount_point);
+    release_tree = false;
+
+  } else if (!config.mount) {
+
+    // A PyPy tree in a directory of an existing tmpfs is removed instead
+
+    if (access(config.mount_point, F_OK) == 0) {
+
+      remove_tree_contents(config.mount_point);
+
+    }
+
+    printf("%s: PyPy tree removed\n", config.mount_point);
+    release_tree = false;
+
+  }
+
+  if (release_tree) {
+
+    int unmounted = unmount_all(config.mount_point);
+
+    printf("%s: %d mount(s) released\n", config.mount_point, unmounted);
+
+  }
+
+  // The disks of running processes are kept
+  for (size_t i = 0; i < sizeof(run_disks) / sizeof(run_disks[0]); i++) {
+
+    if (access(run_disks[i], F_OK) == 0) {
+
+      int released = release_dead_run_disks(run_disks[i]);
+
+      printf("%s: %d mount(s) released\n", run_disks[i], released);
+
+    }
+
+  }
+
+  // cgroups of runs which were killed, the ones still holding processes are kept
+  DIR *groups = opendir(CGROUP_PARENT);
+
+  if (groups) {
+
+    struct dirent *entry;
+    int removed = 0;
+
+    while ((entry = readdir(groups)) != NULL) {
+
+      char path[512];
+
+      snprintf(path, sizeof(path), "%s/%s", CGROUP_PARENT, entry->d_name);
+
+      if (strncmp(entry->d_name, "run-", 4) == 0 && rmdir(path) == 0) {
+
+        removed++;
+
+      }
+
+    }
+
+    closedir(groups);
+    printf("%s: %d cgroup(s) removed\n", CGROUP_PARENT, removed);
+
+  }
+
+  exit(EXIT_SUCCESS);
+
+}
+
+void validate_arguments(int argc, char *argv[]) {
+
+  if (argc < 2) {
+    __raise__(USAGE);
+  }
+
+  // Use switch on the first character for main options
+  switch (argv[1][0]) {
+
+    case '-':
+
+      if (strcmp(argv[1], "--toram") == 0) {
+
+        // The project directory, the patterns and --args or -a come before the file
+        int script = find_script_index(argc, argv);
+
+        if (script >= argc || strstr(argv[script], ".py") == NULL) {
+          __raise__(USAGE);
+        }
+        return;
+
+      } else if (strcmp(argv[1], "--args") == 0 || strcmp(argv[1], "-a") == 0) {
+
+        if (argc < 3 || strstr(argv[2], ".py") == NULL) {
+          __raise__(USAGE);
+        }
+        return;
+
+      } else if (strcmp(argv[1], "-m") == 0 || strcmp(argv[1], "-") == 0) {
+
+        return;
+
+      } else if (strcmp(argv[1], "-c") == 0) {
+
+        if (argc < 3) {
+          __raise__(USAGE);
+        }
+        return;
+
+      } else if (strcmp(argv[1], "--daemon") == 0) {
+
+        if (argc != 2 && !(argc == 4 && strcmp(argv[2], "--preload") == 0)) {
+          __raise__(USAGE);
+        }
+        return;
+
+      } else if (strcmp(argv[1], "--batch") == 0) {
+
+        char *end;
+        long workers = argc == 5 && strcmp(argv[3], "-j") == 0 ? strtol(argv[4], &end, 10) : 1;
+
+        if ((argc != 3 && argc != 5) || (argc == 5 && (workers < 1 || workers > MAX_BATCH_WORKERS || *end != '\0'))) {
+          __raise__(USAGE);
+        }
+        return;
+
+      } else if (strcmp(argv[1], "--workers") == 0) {
+
+        char *end;
+        long workers = argc >= 3 ? strtol(argv[2], &end, 10) : 0;
+
+        if (workers < 1 || *end != '\0' || (argc != 4 && !(argc == 6 && strcmp(argv[3], "--bind") == 0))) {
+          __raise__(USAGE);
+        }
+        return;
+
+      } else if (strcmp(argv[1], "--client") == 0) {
+
+        if (argc < 3 || (strcmp(argv[2], "-m") != 0 && strstr(argv[2], ".py") == NULL) || (strcmp(argv[2], "-m") == 0 && argc < 4)) {
+          __raise__(USAGE);
+        }
+        return;
+
+      } else if (strcmp(argv[1], "--help") == 0 || strcmp(argv[1], "--version") == 0 || strcmp(argv[1], "--gc-mounts") == 0) {
+
+        if (argc > 2) {
+          __raise__(USAGE);
+        }
+        return;
+      }
+
+      // Fall through for unknown options
+
+      break;
+
+    default:
+
+      // Not an option, check if it's a .py file
+      if (strstr(argv[1], ".py") != NULL) {
+        return;
+      }
+
+      break;
+
+  }
+
+  __raise__(USAGE);
+
+}
+
+// Print version and exit
+void print_version_and_exit() {
+
+  printf("PyRAM version 2.0.0\n");
+  exit(EXIT_SUCCESS);
+
+}
+
+// Print help and exit
+void print_help_and_exit() {
+
+  printf(
+    "************************************************************\n"
+    "*                   PyRAM - Python in RAM                  *\n"
+    "*                  Version 2.0.0 | MIT License             *\n"
+    "*                  Author: BrunoRNS                        *\n"
+    "************************************************************\n"
+    "\n"
+    "Description:\n"
+    "  PyRAM loads the PyPy interpreter and optionally your Python script into RAM\n"
+    "  for faster execution. It is designed for systems where running Python from\n"
+    "  RAM provides significant performance benefits.\n"
+    "\n"
+    "Usage:\n"
+    "  pyram [--toram [<project_dir>] [--include|--exclude <glob>]...] [--args|-a] <python_file.py> [args...]\n"
+    "  pyram -m <module> [args...]\n"
+    "  pyram -c <code> [args...]\n"
+    "  pyram - [args...]\n"
+    "  pyram --help\n"
+    "  pyram --version\n"
+    "  pyram --gc-mounts\n"
+    "  pyram --daemon [--preload <module,module...>]\n"
+    "  pyram --client <python_file.py>|-m <module> [args...]\n"
+    "  pyram --workers <n> [--bind <host:port>] <module>[:<callable>]\n"
+    "  pyram --batch <jobs.txt> [-j <n>]\n"
+    "\n"
+    "Options:\n"
+    "  --toram         Loads the specified Python file into RAM before execution.\n"
+    "                  This can improve performance for large scripts.\n"
+    "                  Given a project directory, the whole tree is copied to RAM and\n"
+    "                  the script runs from there, so its imports are read from RAM:\n"
+    "                      pyram --toram ./myproject ./myproject/main.py\n"
+    "  --include, --exclude\n"
+    "                  Glob patterns (matched against the path inside the project and\n"
+    "                  the file name) choosing what --toram copies, may be repeated:\n"
+    "                      pyram --toram . --exclude .git --exclude '*.log' main.py\n"
+    "  --args, -a      Allows passing arguments to the Python file. Must be used\n"
+    "                  BEFORE the file name and path, similar to --toram.\n"
+    "                  Example:\n"
+    "                      pyram --args myscript.py arg1 arg2\n"
+    "  -m              Runs a pre-installed library module as a script (like 'python -m').\n"
+    "                  Use this to execute a module with arguments:\n"
+    "                      pyram -m mymodule arg1 arg2\n"
+    "  -c, -           Runs a code string, or a script read from stdin, without any file\n"
+    "                  (like 'python -c' and 'python -'). The arguments are passed too:\n"
+    "                      pyram -c 'import sys; print(sys.argv)' arg1\n"
+    "                      generate_job | pyram - arg1\n"
+    "  --timings       Must be the first option. Prints a JSON line with the time spent\n"
+    "                  in each phase of the run (lock, extraction, copy, PyPy...) to\n"
+    "                  stderr, or appends it to the file given by PYRAM_TIMINGS:\n"
+    "                      pyram --timings --toram myscript.py\n"
+    "  --memory-max, --cpu-max, --cpuset\n"
+    "                  Run in a cgroup v2 group with these limits, given before the other\n"
+    "                  options: memory.max (e.g. 512M), a number of CPUs (e.g. 1.5) and the\n"
+    "                  cores allowed (e.g. 0-3). The --toram disk counts in the memory:\n"
+    "                      pyram --memory-max 1G --cpu-max 2 --toram myscript.py\n"
+    "  --private       Given before the other options, mounts the RAM disks of the run in\n"
+    "                  a private mount namespace: no contention with other runs, and the\n"
+    "                  kernel releases them when the run ends, even if it is killed.\n"
+    "                  Works without root too, PyPy is then extracted for each run,\n"
+    "                  once root has created the mount points (a root run does it):\n"
+    "                      sudo mkdir -p /mnt/pyram_disk /mnt/pyram_pyfile_ramdisk /mnt/pyram_stage\n"
+    "                      pyram --private --toram myscript.py\n"
+    "  --memfd         Given before the other options, runs without root and without\n"
+    "                  mounts: PyPy is kept in a directory of the user in $XDG_RUNTIME_DIR\n"
+    "                  or /dev/shm, and pypy.elf is run from memory (memfd_create):\n"
+    "                      pyram --memfd myscript.py\n"
+    "  --stage         Given before the other options, copies an input file or directory\n"
+    "                  to a RAM disk of the run while PyPy is set up, may be repeated.\n"
+    "                  The copy is PYRAM_STAGE_<DEST> (DEST defaults to the base name),\n"
+    "                  and script arguments naming the input are replaced by the copy:\n"
+    "                      pyram --stage data/ --stage big.csv:input.csv -a job.py data/\n"
+    "  --writeback     Given before the other options, the directory DIR of the RAM disk,\n"
+    "                  a copy of DEST, is written back to DEST while the script runs and\n"
+    "                  when it ends (PYRAM_WRITEBACK_<DIR>, PYRAM_WRITEBACK_INTERVAL):\n"
+    "                      pyram --writeback out:/var/lib/myjob -a job.py /var/lib/myjob\n"
+    "  --trace-imports Given before the other options, adds the files of the PyPy tree the\n"
+    "                  run imports, maps or opens to a file, for PYRAM_IMAGES of build/build:\n"
+    "                      pyram --trace-imports api.txt --workers 4 mysite.wsgi\n"
+    "  --image         Given before the other options, runs from the slim image\n"
+    "                  lib/pypy-<name>.so built from a trace, in its own RAM disk:\n"
+    "                      pyram --image api --workers 4 mysite.wsgi\n"
+    "  --rusage        Like --timings, prints the CPU time, peak memory, page faults,\n"
+    "                  context switches and block I/O of PyPy, and the bytes used in\n"
+    "                  the RAM disks, or appends them to the file given by PYRAM_RUSAGE.\n"
+    "  --help          Shows this detailed help message with usage examples.\n"
+    "  --version       Shows the program version.\n"
+    "  --gc-mounts     Unmounts the PyPy tree kept in RAM and the RAM disks left by\n"
+    "                  interrupted runs, freeing their memory.\n"
+    "  --daemon        Keeps a PyPy process in RAM, listening on a Unix socket\n"
+    "                  (PYRAM_SOCKET, default " ZYGOTE_SOCKET_PATH ").\n"
+    "                  --preload imports the given modules once in the daemon:\n"
+    "                      pyram --daemon --preload django,numpy,pymysql\n"
+    "  --client        Runs the script (or -m module) in a process forked from the\n"
+    "                  daemon, with the modules already imported. All arguments after\n"
+    "                  the file are passed to it; stdio, exit code and signals too.\n"
+    "                      pyram --client myscript.py arg1 arg2\n"
+    "  --workers       Serves a WSGI application (e.g. mysite.wsgi of a Django project,\n"
+    "                  imported from the current directory) with n processes forked\n"
+    "                  after importing it, each one pinned to a core. Crashed workers\n"
+    "                  are restarted. --bind defaults to " DEFAULT_BIND ":\n"
+    "                      pyram --workers 4 --bind 0.0.0.0:8000 mysite.wsgi\n"
+    "  --batch         Runs every line of a file (a script or -m module and its arguments)\n"
+    "                  with the PyPy image set up once, n jobs at a time (default: one per\n"
+    "                  core). The output of each job is printed when it ends, followed by\n"
+    "                  a summary; PYRAM_BATCH_REPORT gets a JSON line per job:\n"
+    "                      pyram --batch nightly.txt -j 8\n"
+    "\n"
+    "Important Notes:\n"
+    "  - The order of options matters! For example, '--toram' and '--args' or '-a' must come\n"
+    "    before the Python file name and path. '-m' must be the first argument if used.\n"
+    "  - '--toram' loads one Python file, or one project directory, into RAM at a time.\n"
+    "  - You must run PyRAM as root (sudo), unless --private or --memfd is used.\n"
+    "  - PyPy is only extracted to RAM again when lib/pypy.so changes.\n"
+    "    Set PYRAM_COLD=1 to force a fresh extraction.\n"
+    "  - Concurrent runs share the PyPy tree in RAM, it is only replaced or removed\n"
+    "    once no run uses it anymore.\n"
+    "  - The mount point, size and tmpfs options of the PyPy RAM disk are read from\n"
+    "    " CONFIG_PATH " and the PYRAM_MOUNT_POINT, PYRAM_SIZE, PYRAM_HEADROOM,\n"
+    "    PYRAM_TMPFS_OPTIONS and PYRAM_MOUNT environment variables.\n"
+    "\n"
+    "Examples:\n"
+    "  pyram --toram --args myscript.py arg1 arg2\n"
+    "  pyram --toram ./myproject --exclude '*.log' ./myproject/main.py\n"
+    "  pyram --args myscript.py arg1 arg2\n"
+    "  pyram myscript.py\n"
+    "  pyram -m mymodule arg1 arg2\n"
+    "\n"
+    "Arguments after the options are passed to the Python script or module.\n"
+    "\n"
+    "Usage summary:\n"
+    "  [--toram [<project_dir>] [--include|--exclude <glob>]...] [--args|-a] <python_file.py> [args...]\n"
+    "  -m <module> [args...]\n"
+    "  -c <code> [args...]\n"
+    "  - [args...]\n"
+    "  --help\n"
+    "  --version\n"
+    "  --gc-mounts\n"
+    "  --daemon [--preload <modules>]\n"
+    "  --client <python_file.py>|-m <module> [args...]\n"
+    "  --workers <n> [--bind <host:port>] <module>[:<callable>]\n"
+    "  --batch <jobs.txt> [-j <n>]\n\n"
+  );
+
+  exit(EXIT_SUCCESS);
+
+}
+
+// Ensure running as root
+void ensure_root() {
+
+  if (!is_sudo()) {
+    printf("You need to run this program as root\n");
+    exit(EXIT_FAILURE);
+  }
+
+}
+
+/* Compression formats accepted for lib/pypy.so, detected from the magic bytes
+of the file, so the build can trade archive size for startup time. */
+enum archive_format {
+
+  ARCHIVE_UNKNOWN,
+  ARCHIVE_TAR,
+  ARCHIVE_XZ,
+  ARCHIVE_ZSTD,
+  ARCHIVE_LZ4
+
+};
+
+// Path of the PyPy archive, see the archive setting of the configuration
+const char *archive_path() {
+
+  return config.archive;
+
+}
+
+/* Size of the PyPy RAM disk: the size setting when it is given, otherwise
+the uncompressed size written by build/build in <archive>.manifest plus the
+headroom. Archives without a manifest get the historical 360MB. */
+long long image_size() {
+
+  char path[4200];
+  long long uncompressed = -1;
+
+  if (config.size > 0) {
+
+    return config.size;
+
+  }
+
+  snprintf(path, sizeof(path), "%s.manifest", archive_path());
+
+  FILE *manifest = fopen(path, "r");
+
+  if (manifest) {
+
+    char line[256];
+
+    while (fgets(line, sizeof(line), manifest)) {
+
+      if (sscanf(line, "uncompressed_size=%lld", &uncompressed) == 1) {
+
+        break;
+
+      }
+
+    }
+
+    fclose(manifest);
+
+  }
+
+  if (uncompressed <= 0) {
+
+    return FALLBACK_IMAGE_SIZE;
+
+  }
+
+  return (uncompressed + config.headroom + PAGE_BYTES - 1) / PAGE_BYTES * PAGE_BYTES;
+
+}
+
+// Detect the format of the archive from its magic bytes
+enum archive_format detect_archive_format(const char *path) {
+
+  unsigned char magic[512];
+  ssize_t bytes;
+
+  int fd = open(path, O_RDONLY);
+
+  if (fd == -1) {
+
+    __raise__("Error opening pypy.so");
+
+  }
+
+  bytes = read(fd, magic, sizeof(magic));
+  close(fd);
+
+  if (bytes >= 6 && memcmp(magic, "\xFD" "7zXZ\0", 6) == 0) {
+
+    return ARCHIVE_XZ;
+
+  } else if (bytes >= 4 && memcmp(magic, "\x28\xB5\x2F\xFD", 4) == 0) {
+
+    return ARCHIVE_ZSTD;
+
+  } else if (bytes >= 4 && memcmp(magic, "\x04\x22\x4D\x18", 4) == 0) {
+
+    return ARCHIVE_LZ4;
+
+  } else if (bytes == 512 && memcmp(magic + 257, "ustar", 5) == 0) {
+
+    return ARCHIVE_TAR;
+
+  }
+
+  return ARCHIVE_UNKNOWN;
+
+}
+
+#if defined(PYRAM_HAVE_ZSTD) || defined(PYRAM_HAVE_LZMA) || defined(PYRAM_HAVE_LZ4)
+
+// Arguments of the in-process decompression thread
+struct decompressor {
+
+  enum archive_format format;
+  int in_fd;
+  int out_fd;
+  bool failed;
+
+};
+
+#define DECOMPRESS_CHUNK (1 << 20)
+
+#ifdef PYRAM_HAVE_ZSTD
+
+bool decompress_zstd(int in_fd, int out_fd, unsigned char *in_buf, unsigned char *out_buf) {
+
+  ZSTD_DStream *stream = ZSTD_createDStream();
+  bool ok = stream != NULL && !ZSTD_isError(ZSTD_initDStream(stream));
+  ssize_t bytes;
+
+  // 0 once the last frame is complete, anything else at EOF means a truncated archive
+  size_t remaining = 1;
+
+  while (ok && (bytes = read(in_fd, in_buf, DECOMPRESS_CHUNK)) > 0) {
+
+    ZSTD_inBuffer input = { in_buf, (size_t)bytes, 0 };
+    bool full = false;
+
+    /* A full output buffer may leave decoded data in the stream, the next call
+    flushes it. Once the frame is complete another call would start a new one. */
+    while (ok && (input.pos < input.size || full)) {
+
+      ZSTD_outBuffer output = { out_buf, DECOMPRESS_CHUNK, 0 };
+
+      remaining = ZSTD_decompressStream(stream, &output, &input);
+      ok = !ZSTD_isError(remaining) && write_all(out_fd, out_buf, output.pos);
+      full = output.pos == output.size && remaining != 0;
+
+    }
+
+  }
+
+  ZSTD_freeDStream(stream);
+
+  return ok && bytes == 0 && remaining == 0;
+
+}
+
+#endif
+
+#ifdef PYRAM_HAVE_LZMA
+
+/* xz archives packed with several blocks (xz -T0) are decompressed with one
+thread per core, older liblzma versions fall back to a single thread. */
+bool decompress_xz(int in_fd, int out_fd, unsigned char *in_buf, unsigned char *out_buf) {
+
+  lzma_stream stream = LZMA_STREAM_INIT;
+  lzma_action action = LZMA_RUN;
+  lzma_ret ret;
+
+#if LZMA_VERSION >= 50040002
+  lzma_mt options = { 0 };
+  options.threads = (uint32_t)online_cpus();
+  options.memlimit_threading = UINT64_MAX;
+  options.memlimit_stop = UINT64_MAX;
+
+  ret = lzma_stream_decoder_mt(&stream, &options);
+#else
+  ret = lzma_stream_decoder(&stream, UINT64_MAX, 0);
+#endif
+
+  if (ret != LZMA_OK) {
+
+    return false;
+
+  }
+
+  stream.next_out = out_buf;
+  stream.avail_out = DECOMPRESS_CHUNK;
+
+  do {
+
+    if (stream.avail_in == 0 && action == LZMA_RUN) {
+
+      ssize_t bytes = read(in_fd, in_buf, DECOMPRESS_CHUNK);
+
+      if (bytes < 0) {
+
+        break;
+
+      }
+
+      stream.next_in = in_buf;
+      stream.avail_in = (size_t)bytes;
+      action = bytes == 0 ? LZMA_FINISH : LZMA_RUN;
+
+    }
+
+    ret = lzma_code(&stream, action);
+
+    if (stream.avail_out == 0 || ret == LZMA_STREAM_END) {
+
+      if (!write_all(out_fd, out_buf, DECOMPRESS_CHUNK - stream.avail_out)) {
+
+        break;
+
+      }
+
+      stream.next_out = out_buf;
+      stream.avail_out = DECOMPRESS_CHUNK;
+
+    }
+
+  } while (ret == LZMA_OK);
+
+  lzma_end(&stream);
+
+  return ret == LZMA_STREAM_END;
+
+}
+
+#endif
+
+#ifdef PYRAM_HAVE_LZ4
+
+bool decompress_lz4(int in_fd, int out_fd, unsigned char *in_buf, unsigned char *out_buf) {
+
+  LZ4F_dctx *context = NULL;
+  size_t hint = 1;
+  ssize_t bytes;
+
+  if (LZ4F_isError(LZ4F_createDecompressionContext(&context, LZ4F_VERSION))) {
+
+    return false;
+
+  }
+
+  while (hint != 0 && (bytes = read(in_fd, in_buf, DECOMPRESS_CHUNK)) > 0) {
+
+    size_t offset = 0;
+    bool full = false;
+
+    // As for zstd, decoded data left in the context by a full output buffer is flushed by the next call
+    while (hint != 0 && (offset < (size_t)bytes || full)) {
+
+      size_t in_size = (size_t)bytes - offset;
+      size_t out_size = DECOMPRESS_CHUNK;
+
+      hint = LZ4F_decompress(context, out_buf, &out_size, in_buf + offset, &in_size, NULL);
+
+      if (LZ4F_isError(hint) || !write_all(out_fd, out_buf, out_size)) {
+
+        LZ4F_freeDecompressionContext(context);
+        return false;
+
+      }
+
+      offset += in_size;
+      full = out_size == DECOMPRESS_CHUNK;
+
+    }
+
+  }
+
+  LZ4F_freeDecompressionContext(context);
+
+  return hint == 0;
+
+}
+
+#endif
+
+// Thread decompressing the archive into the pipe read by the tar extractor
+void *decompress_thread(void *arg) {
+
+  struct decompressor *job = arg;
+  unsigned char *in_buf = malloc(DECOMPRESS_CHUNK);
+  unsigned char *out_buf = malloc(DECOMPRESS_CHUNK);
+
+  job->failed = true;
+
+  if (in_buf && out_buf) {
+
+    switch (job->format) {
+
+#ifdef PYRAM_HAVE_ZSTD
+      case ARCHIVE_ZSTD:
+        job->failed = !decompress_zstd(job->in_fd, job->out_fd, in_buf, out_buf);
+        break;
+#endif
+
+#ifdef PYRAM_HAVE_LZMA
+      case ARCHIVE_XZ:
+        job->failed = !decompress_xz(job->in_fd, job->out_fd, in_buf, out_buf);
+        break;
+#endif
+
+#ifdef PYRAM_HAVE_LZ4
+      case ARCHIVE_LZ4:
+        job->failed = !decompress_lz4(job->in_fd, job->out_fd, in_buf, out_buf);
+        break;
+#endif
+
+      default:
+        break;
+
+    }
+
+  }
+
+  free(in_buf);
+  free(out_buf);
+  close(job->in_fd);
+  close(job->out_fd);
+
+  return NULL;
+
+}
+
+#endif
+
+// Check if this build of pyram decompresses the format itself
+bool has_builtin_decompressor(enum archive_format format) {
+
+  switch (format) {
+
+#ifdef PYRAM_HAVE_ZSTD
+    case ARCHIVE_ZSTD:
+      return true;
+#endif
+
+#ifdef PYRAM_HAVE_LZMA
+    case ARCHIVE_XZ:
+      return true;
+#endif
+
+#ifdef PYRAM_HAVE_LZ4
+    case ARCHIVE_LZ4:
+      return true;
+#endif
+
+    default:
+      return false;
+
+  }
+
+}
+
+// Parse an octal or base-256 numeric field of a tar header
+long long tar_number(const char *field, size_t size) {
+
+  long long value = 0;
+
+  if ((unsigned char)field[0] & 0x80) {
+
+    for (size_t i = 1; i < size; i++) {
+
+      value = (value << 8) | (unsigned char)field[i];
+
+    }
+
+    return value;
+
+  }
+
+  for (size_t i = 0; i < size && field[i] != '\0' && field[i] != ' '; i++) {
+
+    if (field[i] >= '0' && field[i] <= '7') {
+
+      value = (value << 3) | (field[i] - '0');
+
+    }
+
+  }
+
+  return value;
+
+}
+
+// Refuse entries that would be written outside the extraction directory
+bool tar_path_is_safe(const char *name) {
+
+  if (name[0] == '/' || strcmp(name, "..") == 0 || strncmp(name, "../", 3) == 0) {
+
+    return false;
+
+  }
+
+  return strstr(name, "/../") == NULL && (strlen(name) < 3 || strcmp(name + strlen(name) - 3, "/..") != 0);
+
+}
+
+// Create every missing parent directory of path
+void make_parent_dirs(const char *path) {
+
+  char dir[4096];
+
+  snprintf(dir, sizeof(dir), "%s", path);
+
+  for (char *slash = strchr(dir + 1, '/'); slash; slash = strchr(slash + 1, '/')) {
+
+    *slash = '\0';
+
+    if (mkdir(dir, 0755) == -1 && errno != EEXIST) {
+
+      __raise__("Error creating directory while extracting pypy.so");
+
+    }
+
+    *slash = '/';
+
+  }
+
+}
+
+// Read a tar entry body (long names and pax headers) into a new string
+char *tar_read_body(int fd, long long size) {
+
+  long long padded = (size + 511) & ~511LL;
+  char *body = malloc((size_t)padded + 1);
+
+  if (!body || !read_all(fd, body, (size_t)padded)) {
+
+    __raise__("Error reading pypy.so");
+
+  }
+
+  body[size] = '\0';
+
+  return body;
+
+}
+
+// Take path, linkpath and size from the records of a pax extended header
+void tar_parse_pax(char *body, long long size, char **path, char **link, long long *entry_size) {
+
+  char *record = body;
+
+  while (record < body + size) {
+
+    char *key;
+    long length = strtol(record, &key, 10);
+
+    if (length <= 0 || *key != ' ' || record + length > body + size) {
+
+      break;
+
+    }
+
+    key++;
+    record[length - 1] = '\0';
+
+    char *value = strchr(key, '=');
+
+    if (value) {
+
+      *value++ = '\0';
+
+      if (strcmp(key, "path") == 0) {
+
+        free(*path);
+        *path = strdup(value);
+
+      } else if (strcmp(key, "linkpath") == 0) {
+
+        free(*link);
+        *link = strdup(value);
+
+      } else if (strcmp(key, "size") == 0) {
+
+        *entry_size = strtoll(value, NULL, 10);
+
+      }
+
+    }
+
+    record += length;
+
+  }
+
+}
+
+/* Extract a tar stream into dest. Handles the ustar, GNU long name and pax
+headers produced by GNU tar; modes and modification times are kept so the
+precompiled bytecode in the archive stays valid. */
+void extract_tar(int fd, const char *dest) {
+
+  static char buffer[1 << 20];
+  char header[512];
+  char path[4096];
+  char *long_name = NULL;
+  char *long_link = NULL;
+  long long pax_size = -1;
+  bool ended = false;
+
+  while (read_all(fd, header, sizeof(header))) {
+
+    if (header[0] == '\0') {
+
+      ended = true;
+      break;
+
+    }
+
+    char type = header[156];
+    long long size = tar_number(header + 124, 12);
+    mode_t mode = (mode_t)tar_number(header + 100, 8) & 07777;
+    struct timespec times[2] = { { 0, UTIME_OMIT }, { tar_number(header + 136, 12), 0 } };
+
+    if (type == 'L' || type == 'K' || type == 'x') {
+
+      char *body = tar_read_body(fd, size);
+
+      if (type == 'L') {
+
+        free(long_name);
+        long_name = body;
+
+      } else if (type == 'K') {
+
+        free(long_link);
+        long_link = body;
+
+      } else {
+
+        tar_parse_pax(body, size, &long_name, &long_link, &pax_size);
+        free(body);
+
+      }
+
+      continue;
+
+    }
+
+    if (pax_size >= 0) {
+
+      size = pax_size;
+
+    }
+
+    char name[257];
+
+    if (memcmp(header + 257, "ustar", 5) == 0 && header[345] != '\0') {
+
+      snprintf(name, sizeof(name), "%.155s/%.100s", header + 345, header);
+
+    } else {
+
+      snprintf(name, sizeof(name), "%.100s", header);
+
+    }
+
+    const char *entry = long_name ? long_name : name;
+
+    while (strncmp(entry, "./", 2) == 0) {
+
+      entry += 2;
+
+    }
+
+    if (!tar_path_is_safe(entry)) {
+
+      fprintf(stderr, "Unsafe path in pypy.so: %s\n", entry);
+      __raise__("Error extracting pypy.so");
+
+    }
+
+    snprintf(path, sizeof(path), "%s/%s", dest, entry);
+    make_parent_dirs(path);
+
+    char link_name[101];
+    snprintf(link_name, sizeof(link_name), "%.100s", header + 157);
+    const char *link_target = long_link ? long_link : link_name;
+
+    if (entry[0] == '\0') {
+
+      // The root "./" entry, nothing to create
+
+    } else if (type == '5') {
+
+      if (mkdir(path, mode) == -1 && errno != EEXIST) {
+
+        __raise__("Error creating directory while extracting pypy.so");
+
+      }
+
+      chmod(path, mode);
+
+    } else if (type == '2') {
+
+      unlink(path);
+
+      if (symlink(link_target, path) == -1) {
+
+        __raise__("Error creating symlink while extracting pypy.so");
+
+      }
+
+      utimensat(AT_FDCWD, path, times, AT_SYMLINK_NOFOLLOW);
+
+    } else if (type == '1') {
+
+      char target[4096];
+      snprintf(target, sizeof(target), "%s/%s", dest, link_target);
+      unlink(path);
+
+      if (!tar_path_is_safe(link_target) || link(target, path) == -1) {
+
+        __raise__("Error creating hard link while extracting pypy.so");
+
+      }
+
+    } else if (type == '0' || type == '\0' || type == '7') {
+
+      int out = open(path, O_WRONLY | O_CREAT | O_TRUNC, mode);
+
+      if (out == -1) {
+
+        __raise__("Error creating file while extracting pypy.so");
+
+      }
+
+      long long remaining = (size + 511) & ~511LL;
+      long long content = size;
+
+      while (remaining > 0) {
+
+        size_t chunk = remaining < (long long)sizeof(buffer) ? (size_t)remaining : sizeof(buffer);
+
+        if (!read_all(fd, buffer, chunk)) {
+
+          __raise__("Error reading pypy.so, the archive is truncated");
+
+        }
+
+        size_t useful = content < (long long)chunk ? (size_t)content : chunk;
+
+        if (!write_all(out, buffer, useful)) {
+
+          __raise__("Error writing file while extracting pypy.so");
+
+        }
+
+        content -= (long long)useful;
+        remaining -= (long long)chunk;
+
+      }
+
+      fchmod(out, mode);
+      futimens(out, times);
+      close(out);
+
+      size = 0;
+
+    }
+
+    // Skip the body of entries which were not written
+    for (long long skip = (size + 511) & ~511LL; skip > 0; ) {
+
+      size_t chunk = skip < (long long)sizeof(buffer) ? (size_t)skip : sizeof(buffer);
+
+      if (!read_all(fd, buffer, chunk)) {
+
+        __raise__("Error reading pypy.so, the archive is truncated");
+
+      }
+
+      skip -= (long long)chunk;
+
+    }
+
+    free(long_name);
+    free(long_link);
+    long_name = NULL;
+    long_link = NULL;
+    pax_size = -1;
+
+  }
+
+  free(long_name);
+  free(long_link);
+
+  // A partial copy of pypy.so must not be stamped as a complete image
+  if (!ended) {
+
+    errno = EIO;
+    __raise__("Error reading pypy.so, the archive is truncated");
+
+  }
+
+}
+
+// Read what is left of a stream, e.g. the zero padding after the end of a tar
+void drain_fd(int fd) {
+
+  char buffer[8192];
+
+  while (read(fd, buffer, sizeof(buffer)) > 0 || errno == EINTR) {
+
+    errno = 0;
+
+  }
+
+}
+
+/* Extract the PyPy archive into dest. Plain tar is read directly; compressed
+archives are decompressed in a separate thread (or by the xz, zstd or lz4
+tools when pyram was built without the library) so decompression and
+writing to the RAM disk run on different cores. */
+void extract_archive(const char *archive, const char *dest) {
+
+  enum archive_format format = detect_archive_format(archive);
+  int pipe_fds[2];
+  pid_t pid = -1;
+
+  if (format == ARCHIVE_UNKNOWN) {
+
+    __raise__("Unknown pypy.so format, expected tar, xz, zstd or lz4");
+
+  }
+
+  int archive_fd = open(archive, O_RDONLY);
+
+  if (archive_fd == -1) {
+
+    __raise__("Error opening pypy.so");
+
+  }
+
+  if (format == ARCHIVE_TAR) {
+
+    extract_tar(archive_fd, dest);
+    close(archive_fd);
+    return;
+
+  }
+
+  if (pipe(pipe_fds) == -1) {
+
+    __raise__("Error creating pipe for pypy.so decompression");
+
+  }
+
+#if defined(PYRAM_HAVE_ZSTD) || defined(PYRAM_HAVE_LZMA) || defined(PYRAM_HAVE_LZ4)
+  pthread_t thread;
+  struct decompressor job = { format, archive_fd, pipe_fds[1], false };
+
+  if (has_builtin_decompressor(format)) {
+
+    if (pthread_create(&thread, NULL, decompress_thread, &job) != 0) {
+
+      __raise__("Error starting pypy.so decompression thread");
+
+    }
+
+    extract_tar(pipe_fds[0], dest);
+    drain_fd(pipe_fds[0]);
+    close(pipe_fds[0]);
+    pthread_join(thread, NULL);
+
+    if (job.failed) {
+
+      __raise__("Error decompressing pypy.so");
+
+    }
+
+    return;
+
+  }
+#endif
+
+  pid = fork();
+
+  if (pid < 0) {
+
+    __raise__("Error while creating subprocess\n");
+
+  }
+
+  if (pid == 0) {
+
+    dup2(archive_fd, STDIN_FILENO);
+    dup2(pipe_fds[1], STDOUT_FILENO);
+    close(pipe_fds[0]);
+
+    if (format == ARCHIVE_XZ) {
+
+      execlp("xz", "xz", "-dcq", "-T0", (char *)NULL);
+
+    } else if (format == ARCHIVE_ZSTD) {
+
+      execlp("zstd", "zstd", "-dcq", (char *)NULL);
+
+    } else {
+
+      execlp("lz4", "lz4", "-dcq", (char *)NULL);
+
+    }
+
+    perror("Error running the pypy.so decompressor");
+    _exit(127);
+
+  }
+
+  close(archive_fd);
+  close(pipe_fds[1]);
+
+  extract_tar(pipe_fds[0], dest);
+  drain_fd(pipe_fds[0]);
+  close(pipe_fds[0]);
+
+  int status;
+
+  if (waitpid(pid, &status, 0) == -1 || !WIFEXITED(status) || WEXITSTATUS(status) != 0) {
+
+    __raise__("Error decompressing pypy.so");
+
+  }
+
+}
+
+/* Fingerprint of the pypy.so archive the RAM disk was extracted from.
+It is saved in the RAM disk once the extraction is complete, so later runs
+can tell whether the PyPy tree in RAM is still valid. */
+struct image_stamp {
+
+  unsigned long long hash;
+  long long size;
+  long long mtime_sec;
+  long mtime_nsec;
+
+};
+
+// FNV-1a 64 bits hash of the whole file, returns false if it cannot be read
+bool hash_file(const char *path, unsigned long long *hash) {
+
+  static unsigned char buffer[1 << 20];
+  unsigned long long h = FNV_OFFSET_BASIS;
+  ssize_t bytes;
+
+  int fd = open(path, O_RDONLY);
+
+  if (fd == -1) {
+
+    return false;
+
+  }
+
+  while ((bytes = read(fd, buffer, sizeof(buffer))) > 0) {
+
+    h = fnv1a(h, buffer, (size_t)bytes);
+
+  }
+
+  close(fd);
+
+  if (bytes < 0) {
+
+    return false;
+
+  }
+
+  *hash = h;
+  return true;
+
+}
+
+// Fill the size and mtime of the stamp from the archive, the hash is left untouched
+bool stat_archive(struct image_stamp *stamp) {
+
+  struct stat st;
+
+  if (stat(archive_path(), &st) == -1) {
+
+    return false;
+
+  }
+
+  stamp->size = (long long)st.st_size;
+  stamp->mtime_sec = (long long)st.st_mtim.tv_sec;
+  stamp->mtime_nsec = st.st_mtim.tv_nsec;
+
+  return true;
+
+}
+
+// Read the stamp left in the RAM disk by the last extraction
+bool read_stamp(struct image_stamp *stamp) {
+
+  FILE *file = fopen(config.stamp_path, "r");
+
+  if (!file) {
+
+    return false;
+
+  }
+
+  int fields = fscanf(file, "hash=%llx\nsize=%lld\nmtime=%lld.%ld\n",
+                      &stamp->hash, &stamp->size, &stamp->mtime_sec, &stamp->mtime_nsec);
+
+  fclose(file);
+
+  return fields == 4;
+
+}
+
+// Write the stamp atomically, so a half written stamp is never trusted
+void write_stamp(const struct image_stamp *stamp) {
+
+  char tmp_path[sizeof(config.stamp_path) + 8];
+  snprintf(tmp_path, sizeof(tmp_path), "%s.tmp", config.stamp_path);
+
+  FILE *file = fopen(tmp_path, "w");
+
+  if (!file) {
+
+    __raise__("Error creating the RAM disk stamp");
+
+  }
+
+  fprintf(file, "hash=%016llx\nsize=%lld\nmtime=%lld.%09ld\n",
+          stamp->hash, stamp->size, stamp->mtime_sec, stamp->mtime_nsec);
+
+  if (fclose(file) != 0 || rename(tmp_path, config.stamp_path) == -1) {
+
+    __raise__("Error writing the RAM disk stamp");
+
+  }
+
+}
+
+/* Check if the PyPy tree in RAM was extracted from the current pypy.so.
+Size and mtime are compared first, the archive is only hashed again when
+they changed, e.g. when the same package is reinstalled. */
+bool pypy_image_is_warm() {
+
+  struct image_stamp saved;
+  struct image_stamp current;
+
+  if (!read_stamp(&saved) || !stat_archive(&current) || access(config.pypy_path, X_OK) != 0) {
+
+    return false;
+
+  }
+
+  if (saved.size != current.size) {
+
+    return false;
+
+  }
+
+  if (saved.mtime_sec == current.mtime_sec && saved.mtime_nsec == current.mtime_nsec) {
+
+    return true;
+
+  }
+
+  if (!hash_file(archive_path(), &current.hash) || current.hash != saved.hash) {
+
+    return false;
+
+  }
+
+  // Same content with a new mtime, refresh the stamp to skip the hash next time
+  write_stamp(&current);
+
+  return true;
+
+}
+
+// Setting PYRAM_COLD to anything but 0 forces a fresh extraction
+bool cold_start_requested() {
+
+  const char *cold = getenv("PYRAM_COLD");
+
+  return cold != NULL && cold[0] != '\0' && strcmp(cold, "0") != 0;
+
+}
+
+/* With mount=0 the PyPy tree lives in a plain directory of a tmpfs mounted
+by someone else, e.g. /dev/shm/pyram, which is created if needed and must
+belong to the user (check_owner). A private run only mounts its own tmpfs
+over the directory, which may then be the one created by a root run. */
+void prepare_image_directory(bool check_owner) {
+
+  char path[sizeof(config.mount_point)];
+
+  snprintf(path, sizeof(path), "%s", config.mount_point);
+
+  for (char *slash = strchr(path + 1, '/'); ; slash = strchr(slash + 1, '/')) {
+
+    if (slash) {
+
+      *slash = '\0';
+
+    }
+
+    if (mkdir(path, 0755) == -1 && errno != EEXIST) {
+
+      __raise__("Error creating the PyPy directory");
+
+    }
+
+    if (!slash) {
+
+      break;
+
+    }
+
+    *slash = '/';
+
+  }
+
+  // In a shared tmpfs such as /dev/shm the directory could have been created by another user
+  struct stat st;
+
+  if (lstat(config.mount_point, &st) == -1 || !S_ISDIR(st.st_mode) || (check_owner && st.st_uid != geteuid())) {
+
+    fprintf(stderr, "%s must be a directory%s\n", config.mount_point, check_owner ? " owned by the user running PyRAM" : "");
+    __raise__("Error preparing the PyPy directory");
+
+  }
+
+}
+
+/* Give the run its own mount namespace: the RAM disks mounted from now on are
+only seen by this run, and the kernel releases them when its last process
+exits, even after SIGKILL. Without root, a user namespace mapping the user to
+itself gives pyram the right to mount them; PyPy runs without privileges. */
+void enter_private_namespace() {
+
+  char map[64];
+  uid_t uid = getuid();
+  gid_t gid = getgid();
+  bool rootless = !is_sudo();
+
+  if (unshare(CLONE_NEWNS | (rootless ? CLONE_NEWUSER : 0)) == -1) {
+
+    if (rootless) {
+
+      fprintf(stderr, "Unprivileged user namespaces are disabled, run PyRAM as root\n");
+
+    }
+
+    __raise__("Error creating the mount namespace of the run");
+
+  }
+
+  if (rootless) {
+
+    snprintf(map, sizeof(map), "%d %d 1", (int)uid, (int)uid);
+
+    if (!write_text_file("/proc/self/setgroups", "deny") || !write_text_file("/proc/self/uid_map", map)) {
+
+      __raise__("Error mapping the user in the user namespace");
+
+    }
+
+    snprintf(map, sizeof(map), "%d %d 1", (int)gid, (int)gid);
+
+    if (!write_text_file("/proc/self/gid_map", map)) {
+
+      __raise__("Error mapping the group in the user namespace");
+
+    }
+
+  }
+
+  // Mounts made here must not propagate back to the host
+  if (mount(NULL, "/", NULL, MS_REC | MS_PRIVATE, NULL) == -1) {
+
+    __raise__("Error making the mounts of the run private");
+
+  }
+
+}
+
+/* Load pypy.elf from the tree into a sealed memfd, executed with fexecve: the
+interpreter runs from memory even when the directory of the tree is mounted
+noexec, and without a mount of its own. The shared libraries next to it are
+found through LD_LIBRARY_PATH, since $ORIGIN cannot be resolved for a memfd.
+When the kernel refuses executable memfds PyPy is run from the tree. */
+void load_pypy_memfd() {
+
+  char *library_path = NULL;
+  const char *current = getenv("LD_LIBRARY_PATH");
+  struct stat st;
+
+  int in = open(config.pypy_path, O_RDONLY | O_CLOEXEC);
+  int fd = memfd_create("pypy.elf", MFD_CLOEXEC | MFD_ALLOW_SEALING);
+
+  if (in == -1 || fd == -1 || fstat(in, &st) == -1) {
+
+    __raise__("Error loading pypy.elf in memory");
+
+  }
+
+  for (off_t copied = 0; copied < st.st_size; ) {
+
+    ssize_t bytes = sendfile(fd, in, NULL, (size_t)(st.st_size - copied));
+
+    if (bytes <= 0 && errno != EINTR) {
+
+      __raise__("Error loading pypy.elf in memory");
+
+    }
+
+    copied += bytes > 0 ? bytes : 0;
+
+  }
+
+  close(in);
+  fcntl(fd, F_ADD_SEALS, F_SEAL_SHRINK | F_SEAL_GROW | F_SEAL_WRITE | F_SEAL_SEAL);
+
+  if (asprintf(&library_path, "%s/pypy/bin%s%s", config.mount_point, current ? ":" : "", current ? current : "") == -1
+      || setenv("LD_LIBRARY_PATH", library_path, 1) == -1) {
+
+    __raise__("Error setting LD_LIBRARY_PATH");
+
+  }
+
+  free(library_path);
+  pypy_memfd = fd;
+
+}
+
+/* PyPy tree of a private run which cannot use the shared one: a cold start,
+or a run without root which cannot take the locks of the shared image. It is
+extracted into a tmpfs of the private namespace, so no lock is needed and the
+kernel releases it with the namespace. */
+void setup_private_pypy_image() {
+
+  struct stat st;
+
+  prepare_image_directory(false);
+  mount_tmpfs(config.mount_point, image_size());
+  mark_phase("mount");
+
+  extract_archive(archive_path(), config.mount_point);
+  mark_phase("extract");
+
+  if (stat(config.pypy_path, &st) == -1 || chmod(config.pypy_path, (st.st_mode & 07777) | 0111) == -1) {
+
+    __raise__("Error making pypy.elf executable");
+
+  }
+
+  timings.image = "private";
+  mark_phase("chmod");
+
+}
+
+/* Setup RAM disk for PyPy, skipped when the RAM disk already holds the current pypy.so.
+Concurrent runs share the image: the first one extracts it under the setup
+lock while the others wait, then each one attaches with a shared reference.
+An image which must be replaced (pypy.so changed, PYRAM_COLD) is only touched
+once the runs executing from it have ended. */
+void setup_pypy_ramdisk() {
+  struct image_stamp stamp;
+  struct stat st;
+
+  bool healthy_mount = true;
+
+  open_image_locks();
+
+  for (;;) {
+
+    lock_image_setup();
+    mark_phase("lock_wait");
+
+    if (config.mount) {
+
+      healthy_mount = is_single_tmpfs(config.mount_point);
+
+    } else {
+
+      prepare_image_directory(true);
+
+    }
+
+    /* Locks are taken in order, the setup lock then the reference lock. The
+    runs holding the reference lock exclusively with the setup lock (extraction,
+    --gc-mounts, the last run releasing the image) cannot be here at the same
+    time. wait_for_image_users takes it exclusively without the setup lock, once
+    no run uses the image, and releases it at once, so this waits only for that. */
+    if (healthy_mount && !cold_start_requested() && pypy_image_is_warm()) {
+
+      flock_retry(image_ref_fd, LOCK_SH);
+      unlock_image_setup();
+      timings.image = "warm";
+      mark_phase("warm_check");
+      return;
+
+    }
+
+    mark_phase("warm_check");
+
+    if (take_image_exclusively()) {
+
+      break;
+
+    }
+
+    unlock_image_setup();
+    wait_for_image_users();
+    mark_phase("lock_wait");
+
+  }
+
+  // Reuse a single tmpfs, tmpfs layers stacked by older versions are released
+  if (healthy_mount) {
+
+    remove_tree_contents(config.mount_point);
+
+  } else {
+
+    unmount_all(config.mount_point);
+    mount_tmpfs(config.mount_point, image_size());
+
+  }
+
+  mark_phase("mount");
+
+  // Until the stamp is written a failed extraction must not leave a broken tree mounted
+  if (config.mount) {
+
+    register_owned_mount(config.mount_point, false, true);
+
+  }
+
+  extract_archive(archive_path(), config.mount_point);
+  mark_phase("extract");
+
+  if (stat(config.pypy_path, &st) == -1 || chmod(config.pypy_path, (st.st_mode & 07777) | 0111) == -1) {
+
+    __raise__("Error making pypy.elf executable");
+
+  }
+
+  mark_phase("chmod");
+
+  if (!stat_archive(&stamp) || !hash_file(archive_path(), &stamp.hash)) {
+
+    __raise__("Error reading pypy.so\n");
+
+  }
+
+  write_stamp(&stamp);
+
+  // Without the warm image the PyPy tree is unmounted by the last run using it
+  if (!cold_start_requested()) {
+
+    forget_owned_mount(config.mount_point);
+
+  }
+
+  // Let the other runs attach, the setup lock keeps them out until the downgrade is done
+  flock_retry(image_ref_fd, LOCK_SH);
+  unlock_image_setup();
+  timings.image = "extracted";
+  mark_phase("stamp");
+
+}
+
+// Allocate Python file to RAM if needed
+void handle_toram(int argc, char *argv[], bool *use_toram, struct toram_options *toram) {
+
+  if (argc > 1 && strcmp(argv[1], "--toram") == 0) {
+
+    struct stat st;
+    int script = find_script_index(argc, argv);
+
+    // The disks of killed runs, each run only unmounts its own when it ends
+    if (!config.private_mounts) {
+
+      release_dead_run_disks(PYFILE_RAMDISK_PATH);
+
+    }
+
+    *use_toram = true;
+
+    memset(toram, 0, sizeof(*toram));
+
+    /* The project is resolved once, before the run moves into its RAM copy, so
+    the later lookups of the script and of --args still find it */
+    if (stat(argv[2], &st) == 0 && S_ISDIR(st.st_mode)) {
+
+      char *project = realpath(argv[2], NULL);
+
+      if (!project) {
+
+        __raise__("Error resolving the project to copy to RAM");
+
+      }
+
+      argv[2] = project;
+      toram->project = project;
+
+    }
+
+    for (int i = 2; i < script - 1; i++) {
+
+      bool include = strcmp(argv[i], "--include") == 0;
+
+      if (!include && strcmp(argv[i], "--exclude") != 0) {
+
+        continue;
+
+      }
+
+      if (toram->plan.include_count == MAX_PATTERNS || toram->plan.exclude_count == MAX_PATTERNS) {
+
+        fprintf(stderr, "At most %d --include and %d --exclude patterns\n", MAX_PATTERNS, MAX_PATTERNS);
+        exit(EXIT_FAILURE);
+
+      }
+
+      if (include) {
+
+        toram->plan.includes[toram->plan.include_count++] = argv[++i];
+
+      } else {
+
+        toram->plan.excludes[toram->plan.exclude_count++] = argv[++i];
+
+      }
+
+    }
+
+  }
+
+}
+
+int main(int argc, char *argv[]) {
+  bool use_toram = false;
+  struct toram_options toram;
+  char **pypy_argv = NULL;
+  const char *timings_sink = getenv("PYRAM_TIMINGS");
+  const char *rusage_sink = getenv("PYRAM_RUSAGE");
+
+  // Settings given on the command line, they override the configuration
+  const char *limit_options[][2] = {
+
+    { "--memory-max", "memory_max" },
+    { "--cpu-max", "cpu_max" },
+    { "--cpuset", "cpuset" },
+
+  };
+  const char *limits[3] = { NULL, NULL, NULL };
+  bool private_mounts = false;
+  bool memfd = false;
+  const char *image = NULL;
+
+  timings_sink = timings_sink && timings_sink[0] ? timings_sink : NULL;
+  rusage_sink = rusage_sink && rusage_sink[0] ? rusage_sink : NULL;
+
+  // The run options come before everything else and are removed from the arguments
+  while (argc > 1) {
+
+    int used = 1;
+
+    if (strcmp(argv[1], "--timings") == 0) {
+
+      start_timings(timings_sink);
+
+    } else if (strcmp(argv[1], "--rusage") == 0) {
+
+      resources.enabled = true;
+      resources.sink = rusage_sink;
+
+    } else if (strcmp(argv[1], "--private") == 0) {
+
+      private_mounts = true;
+
+    } else if (strcmp(argv[1], "--memfd") == 0) {
+
+      memfd = true;
+
+    } else if (strcmp(argv[1], "--stage") == 0 && argc > 2) {
+
+      add_stage(argv[2]);
+      used = 2;
+
+    } else if (strcmp(argv[1], "--writeback") == 0 && argc > 2) {
+
+      add_writeback(argv[2]);
+      used = 2;
+
+    } else if (strcmp(argv[1], "--image") == 0 && argc > 2) {
+
+      image = argv[2];
+      used = 2;
+
+    } else if (strcmp(argv[1], "--trace-imports") == 0 && argc > 2) {
+
+      trace_path = argv[2];
+      used = 2;
+
+    } else {
+
+      used = 0;
+
+      for (int i = 0; i < 3; i++) {
+
+        if (strcmp(argv[1], limit_options[i][0]) == 0 && argc > 2) {
+
+          limits[i] = argv[2];
+          used = 2;
+
+        }
+
+      }
+
+    }
+
+    if (used == 0) {
+
+      break;
+
+    }
+
+    argv[used] = argv[0];
+    argv += used;
+    argc -= used;
+
+  }
+
+  if (timings_sink && !timings.enabled) {
+
+    start_timings(timings_sink);
+
+  }
+
+  if (rusage_sink) {
+
+    resources.enabled = true;
+    resources.sink = rusage_sink;
+
+  }
+
+  report_command.argc = argc;
+  report_command.argv = argv;
+
+  // Validate arguments
+  validate_arguments(argc, argv);
+
+  // /etc/pyram.conf and the PYRAM_* environment variables, then the command line
+  load_config();
+
+  for (int i = 0; i < 3; i++) {
+
+    if (limits[i]) {
+
+      set_config_value(limit_options[i][0], limit_options[i][1], limits[i]);
+
+    }
+
+  }
+
+  if (private_mounts) {
+
+    set_config_value("--private", "private", "1");
+
+  }
+
+  if (memfd) {
+
+    set_config_value("--memfd", "memfd", "1");
+
+  }
+
+  if (image) {
+
+    set_config_value("--image", "image", image);
+
+  }
+
+  finish_config();
+
+  // The trace is written by PyPy, possibly from another working directory
+  if (trace_path) {
+
+    static char absolute[8192];
+    char cwd[4096];
+
+    if (trace_path[0] != '/' && getcwd(cwd, sizeof(cwd))) {
+
+      snprintf(absolute, sizeof(absolute), "%s/%s", cwd, trace_path);
+      trace_path = absolute;
+
+    }
+
+    if (setenv("PYRAM_TRACE", trace_path, 1) == -1
+        || setenv("PYRAM_TRACE_ROOT", config.mount_point, 1) == -1) {
+
+      __raise__("Error setting up the import trace");
+
+    }
+
+  }
+
+  // Handle --version and --help
+  if (argc > 1 && strcmp(argv[1], "--version") == 0) {
+
+    print_version_and_exit();
+
+  } else if (argc > 1 && strcmp(argv[1], "--help") == 0) {
+
+    print_help_and_exit();
+
+  } else if (argc > 1 && strcmp(argv[1], "--gc-mounts") == 0) {
+
+    ensure_root();
+    gc_mounts_and_exit();
+
+  } else if (argc > 1 && strcmp(argv[1], "--client") == 0) {
+
+    // Only the daemon needs the RAM disk, access is checked by the socket permissions
+    run_zygote_client(argc, argv);
+
+  }
+
+  // Ensure root, a private run gets the right to mount from a user namespace
+  if (!config.private_mounts && !config.memfd) {
+
+    ensure_root();
+
+  }
+
+  // The memfd backend never mounts, the --toram and --stage (--writeback) disks need root or a private namespace
+  if (config.memfd && !config.private_mounts && !is_sudo() && (strcmp(argv[1], "--toram") == 0 || stage.count > 0)) {
+
+    fprintf(stderr, "%s root or --private\n", stage.count > 0 ? "--stage and --writeback need" : "--toram needs");
+    exit(EXIT_FAILURE);
+
+  }
+
+  // Unmount the RAM disks of this run on SIGINT/SIGTERM
+  install_signal_handlers();
+
+  mark_phase("startup");
+
+  if (config.private_mounts && (!is_sudo() || cold_start_requested())) {
+
+    enter_private_namespace();
+    mark_phase("namespace");
+    start_staging();
+    setup_private_pypy_image();
+
+  } else {
+
+    // The inputs are copied while the PyPy image is checked or extracted
+    if (!config.private_mounts) {
+
+      start_staging();
+
+    }
+
+    // The shared PyPy image is set up in the host namespace, where the other runs see it
+    setup_pypy_ramdisk();
+
+    if (config.private_mounts) {
+
+      enter_private_namespace();
+      mark_phase("namespace");
+      start_staging();
+
+    }
+
+  }
+
+  // After the shared PyPy image, which must not be charged to this run
+  if (config.memfd) {
+
+    load_pypy_memfd();
+    mark_phase("memfd");
+
+  }
+
+  create_run_cgroup();
+
+  if (run_cgroup.active) {
+
+    mark_phase("cgroup");
+
+  }
+
+  // Handle --toram
+  handle_toram(argc, argv, &use_toram, &toram);
+
+  if (use_toram) {
+
+    allocate_python_file_to_ram(argv[find_script_index(argc, argv)], &toram);
+    mark_phase("toram_copy");
+
+  }
+
+  if (stage.count > 0) {
+
+    finish_staging();
+    argv = stage_arguments(argc, argv);
+    mark_phase("stage_wait");
+
+  }
+
+  if (strcmp(argv[1], "--batch") == 0) {
+
+    int workers = argc == 5 ? atoi(argv[4]) : online_cpus();
+    int job_count;
+    struct batch_job *jobs = read_batch_file(argv[2], &job_count);
+
+    // The arguments of every job read the staged inputs from RAM, like those of a script
+    for (int i = 0; i < job_count; i++) {
+
+      int first = (strcmp(jobs[i].words[0], "-m") == 0 || strcmp(jobs[i].words[0], "-c") == 0) ? 2 : 1;
+
+      stage_argument_values(jobs[i].argv + 1 + first, jobs[i].word_count - first);
+      jobs[i].argv = traced_argv(jobs[i].argv);
+
+    }
+
+    start_writeback();
+
+    int status = run_batch(argv[2], jobs, job_count, workers < MAX_BATCH_WORKERS ? workers : MAX_BATCH_WORKERS);
+
+    mark_phase("batch");
+
+    if (writeback.enabled) {
+
+      status = finish_writeback(status);
+      mark_phase("writeback");
+
+    }
+
+    exit_like_pypy(status);
+
+  }
+
+  if (strcmp(argv[1], "--daemon") == 0) {
+
+    pypy_argv = build_daemon_argv(argc, argv);
+
+  } else if (strcmp(argv[1], "--workers") == 0) {
+
+    pypy_argv = build_server_argv(argc, argv);
+
+  } else {
+
+    pypy_argv = build_pypy_argv(argc, argv, use_toram ? toram.script : NULL);
+
+  }
+
+  pypy_argv = traced_argv(pypy_argv);
+
+  mark_phase("prepare_argv");
+
+  start_writeback();
+
+  int status = execute_pypy(pypy_argv);
+
+  free(pypy_argv);
+
+  mark_phase("pypy");
+
+  if (writeback.enabled) {
+
+    status = finish_writeback(status);
+    mark_phase("writeback");
+
+  }
+
+  exit_like_pypy(status);
+
+}
@@ -0,0 +1,215 @@
+"""
+pyram_trace.py
+Started by `pyram --trace-imports <file>` in front of the script (or -m module, -c code, -). It runs
+the script like the interpreter would and, when the process ends, adds to <file> every file of the
+PyPy tree the process used: the modules imported with their bytecode, the shared libraries mapped
+and the files opened. The file keeps one path per line, relative to the RAM disk (pypy/lib/...),
+and is merged under a lock, so several runs and forked workers can add to the same trace.
+
+build/build packs the files listed by a trace, plus pypy/bin, into a slim image (PYRAM_IMAGES)
+that `pyram --image <name>` runs from.
+"""
+import os
+import io
+import sys
+import fcntl
+import runpy
+import atexit
+import builtins
+import importlib.util
+
+from typing import Callable, List, Set
+
+ROOT = os.environ.get("PYRAM_TRACE_ROOT", "").rstrip("/")
+TRACE = os.environ.get("PYRAM_TRACE", "")
+
+# Absolute paths of the files used by this process
+used: Set[str] = set()
+
+
+def record(path) -> None:
+    """
+    Remembers a file if it lives in the PyPy tree, both as given and with its symlinks resolved.
+    Args:
+        path (str | bytes | os.PathLike): File opened, imported or mapped.
+    """
+
+    try:
+
+        path = os.path.abspath(os.fsdecode(path))
+
+    except (TypeError, ValueError):
+
+        return
+
+    for candidate in (path, os.path.realpath(path)):
+
+        if candidate.startswith(ROOT + "/"):
+
+            used.add(candidate)
+
+
+def audit(event: str, args: tuple) -> None:
+
+    if event == "open" and args and isinstance(args[0], (str, bytes, os.PathLike)):
+
+        record(args[0])
+
+
+def watch_open() -> None:
+    """
+    Records the files opened from Python, with an audit hook when the interpreter has them.
+    """
+
+    if hasattr(sys, "addaudithook"):
+
+        sys.addaudithook(audit)
+        return
+
+    original: Callable = builtins.open
+
+    def traced_open(file, *args, **kwargs):
+
+        if isinstance(file, (str, bytes, os.PathLike)):
+
+            record(file)
+
+        return original(file, *args, **kwargs)
+
+    builtins.open = traced_open
+    io.open = traced_open
+
+
+def collect() -> List[str]:
+    """
+    Lists the files of the tree used so far, relative to the RAM disk.
+    Returns:
+        list[str]: Paths such as pypy/lib/pypy3.10/os.py.
+    """
+
+    for module in list(sys.modules.values()):
+
+        path = getattr(module, "__file__", None)
+
+        if not path:
+
+            continue
+
+        record(path)
+
+        if path.endswith(".py"):
+
+            try:
+
+                cached = importlib.util.cache_from_source(path)
+
+            except (NotImplementedError, ValueError):
+
+                continue
+
+            if os.path.exists(cached):
+
+                record(cached)
+
+    # libpypy, the C extensions and the libraries they load
+    try:
+
+        with open("/proc/self/maps") as maps:
+
+            for line in maps:
+
+                fields = line.split(None, 5)
+
+                if len(fields) == 6 and fields[5].startswith("/"):
+
+                    record(fields[5].strip())
+
+    except OSError:
+
+        pass
+
+    return [os.path.relpath(path, ROOT) for path in used if os.path.isfile(path) or os.path.islink(path)]
+
+
+def save() -> None:
+    """
+    Merges the files used by this process into the trace file.
+    """
+
+    if not TRACE or not ROOT:
+
+        return
+
+    paths = collect()
+
+    try:
+
+        with open(TRACE, "a+") as trace:
+
+            fcntl.flock(trace, fcntl.LOCK_EX)
+            trace.seek(0)
+            known = {line.rstrip("\n") for line in trace if line.strip()}
+
+            if not known.issuperset(paths):
+
+                trace.seek(0)
+                trace.truncate()
+                trace.write("".join(path + "\n" for path in sorted(known.union(paths))))
+
+    except OSError as e:
+
+        print(f"pyram trace: cannot write {TRACE}: {e}", file=sys.stderr)
+
+
+def run(args: List[str]) -> None:
+    """
+    Runs the target given to the interpreter after this script.
+    Args:
+        args (list[str]): <script> [args...], -m <module> [args...], -c <code> [args...] or - [args...].
+    """
+
+    main = {"__name__": "__main__", "__builtins__": builtins}
+
+    if args[0] == "-m":
+
+        sys.argv = args[1:]
+        sys.path[0] = os.getcwd()
+        runpy.run_module(args[1], run_name="__main__", alter_sys=True)
+
+    elif args[0] == "-c":
+
+        sys.argv = ["-c"] + args[2:]
+        sys.path[0] = ""
+        exec(compile(args[1], "<string>", "exec"), main)
+
+    elif args[0] == "-":
+
+        sys.argv = args
+        sys.path[0] = ""
+        exec(compile(sys.stdin.read(), "<stdin>", "exec"), main)
+
+    else:
+
+        sys.argv = args
+        sys.path[0] = os.path.dirname(os.path.abspath(args[0]))
+        runpy.run_path(args[0], run_name="__main__")
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+
+        raise SystemExit("usage: pyram_trace.py <script> [args...] | -m <module> | -c <code> | -")
+
+    # Forked workers (pyram --workers, --daemon) leave with os._exit, which skips atexit
+    exit_now = os._exit
+
+    def traced_exit(code: int) -> None:
+
+        save()
+        exit_now(code)
+
+    os._exit = traced_exit
+    atexit.register(save)
+    watch_open()
+    run(sys.argv[1:])
@@ -0,0 +1,264 @@
+"""
+pyram_wsgi.py
+Prefork WSGI server started by `pyram --workers N --bind host:port module[:callable]`. The
+application is imported once by the master process, then N workers are forked and share it.
+
+Every worker accepts connections on its own listening socket, all of them bound to the same
+address with SO_REUSEPORT so the kernel spreads the connections among the workers, and is pinned
+to one core. The sockets are opened by the master, so a worker which dies is forked again with
+the socket of the one it replaces and the connections waiting in its queue are not lost.
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import argparse
+import importlib
+
+from typing import Callable, Dict, List, Tuple
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+DEFAULT_BIND = "127.0.0.1:8000"
+
+# A worker dying sooner than this (in seconds) after its start is restarted after a pause
+MIN_WORKER_LIFETIME = 1.0
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """
+    Request handler which does not log every request, errors are still written to stderr.
+    """
+
+    def log_request(self, code="-", size="-") -> None:
+
+        pass
+
+
+def load_application(target: str) -> Callable:
+    """
+    Imports the WSGI application, the working directory is searched first like a project root.
+    Args:
+        target (str): "module" or "module:callable", the callable defaults to `application`.
+    Returns:
+        callable: The WSGI application.
+    """
+
+    module_name, _, attribute = target.partition(":")
+    attribute = attribute or "application"
+
+    sys.path.insert(0, os.getcwd())
+    module = importlib.import_module(module_name)
+
+    if not hasattr(module, attribute):
+
+        raise SystemExit(f"pyram server: {module_name} has no attribute {attribute}")
+
+    return getattr(module, attribute)
+
+
+def parse_bind(bind: str) -> Tuple[str, int]:
+    """
+    Splits a host:port address, IPv6 hosts may be written between brackets.
+    Args:
+        bind (str): Address given with --bind, e.g. "0.0.0.0:8000" or "[::1]:8000".
+    Returns:
+        tuple: Host and port.
+    """
+
+    host, separator, port = bind.rpartition(":")
+
+    if not separator or not port.isdigit() or not 0 < int(port) < 65536:
+
+        raise SystemExit(f"pyram server: invalid address {bind}, expected host:port")
+
+    return host.strip("[]") or "0.0.0.0", int(port)
+
+
+def open_listener(host: str, port: int) -> socket.socket:
+    """
+    Opens one listening socket of the pool, several of them can be bound to the same address.
+    Args:
+        host (str): Address to bind.
+        port (int): Port to bind.
+    Returns:
+        socket.socket: The listening socket.
+    """
+
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+
+    return sock
+
+
+def run_worker(sock: socket.socket, server_name: str, cpu: int, app: Callable) -> None:
+    """
+    Serves requests in a forked worker until it is terminated. Never returns.
+    Args:
+        sock (socket.socket): Listening socket of this worker.
+        server_name (str): Name reported to the application as SERVER_NAME.
+        cpu (int): Core the worker is pinned to.
+        app (callable): The WSGI application.
+    """
+
+    # Ctrl+C reaches the whole process group, the master stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+    try:
+
+        os.sched_setaffinity(0, {cpu})
+
+    except OSError:
+
+        pass
+
+    code = 0
+
+    try:
+
+        server = WSGIServer(sock.getsockname()[:2], QuietRequestHandler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = sock
+        server.server_name = server_name
+        server.server_port = sock.getsockname()[1]
+        server.setup_environ()
+        server.set_app(app)
+        server.serve_forever()
+
+    except BaseException as e:
+
+        print(f"pyram server: worker {os.getpid()} stopped: {e!r}", file=sys.stderr)
+        code = 1
+
+    finally:
+
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def describe_status(status: int) -> str:
+    """
+    Describes how a worker ended, for the restart message.
+    Args:
+        status (int): Status returned by os.wait.
+    Returns:
+        str: e.g. "exited with 1" or "killed by signal 9".
+    """
+
+    if os.WIFSIGNALED(status):
+
+        return f"killed by signal {os.WTERMSIG(status)}"
+
+    return f"exited with {os.WEXITSTATUS(status)}"
+
+
+def serve(app: Callable, host: str, port: int, workers: int) -> None:
+    """
+    Forks the workers, restarts the ones which die and stops them all on SIGTERM, SIGINT or SIGHUP.
+    Args:
+        app (callable): The WSGI application, shared by the workers.
+        host (str): Address to bind.
+        port (int): Port to bind.
+        workers (int): Number of worker processes.
+    """
+
+    cpus = sorted(os.sched_getaffinity(0))
+    sockets = [open_listener(host, port) for _ in range(workers)]
+    server_name = socket.getfqdn(host)
+    children: Dict[int, int] = {}
+    started: List[float] = [0.0] * workers
+    stopping = False
+
+    def spawn(index: int) -> None:
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+
+        if pid == 0:
+
+            for other, sock in enumerate(sockets):
+
+                if other != index:
+
+                    sock.close()
+
+            run_worker(sockets[index], server_name, cpus[index % len(cpus)], app)
+
+        children[pid] = index
+        started[index] = time.monotonic()
+
+    def stop(signum, frame):
+
+        nonlocal stopping
+        stopping = True
+
+        for pid in list(children):
+
+            try:
+
+                os.kill(pid, signal.SIGTERM)
+
+            except ProcessLookupError:
+
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, stop)
+
+    for index in range(workers):
+
+        spawn(index)
+
+    print(f"pyram server: {workers} workers listening on {host}:{port}", file=sys.stderr)
+
+    while children:
+
+        try:
+
+            pid, status = os.wait()
+
+        except ChildProcessError:
+
+            break
+
+        index = children.pop(pid, None)
+
+        if index is None or stopping:
+
+            continue
+
+        print(f"pyram server: worker {index} (pid {pid}) {describe_status(status)}, restarting", file=sys.stderr)
+
+        # Do not fork in a loop when the application cannot start
+        if time.monotonic() - started[index] < MIN_WORKER_LIFETIME:
+
+            time.sleep(MIN_WORKER_LIFETIME)
+
+        if not stopping:
+
+            spawn(index)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="PyRAM prefork WSGI server")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--bind", default=DEFAULT_BIND, help="host:port to listen on")
+    parser.add_argument("app", help="WSGI application, module or module:callable")
+    options = parser.parse_args()
+
+    if options.workers < 1:
+
+        parser.error("--workers must be at least 1")
+
+    host, port = parse_bind(options.bind)
+    serve(load_application(options.app), host, port, options.workers)
@@ -0,0 +1,358 @@
+"""
+pyram_zygote.py
+Resident PyPy process started by `pyram --daemon`. It imports a list of modules once, listens on a
+Unix socket and forks a child for every `pyram --client` request, so scripts start with the
+modules already imported instead of starting PyPy cold.
+
+Protocol (all integers are decimal text, strings are NUL terminated):
+    client -> zygote: a 4 bytes big endian payload size followed by the payload, with the client
+                      stdin, stdout and stderr attached to the first message (SCM_RIGHTS).
+                      payload = cwd, argument count, arguments, environment count, "KEY=VALUE"...
+                      The first argument is the script path, or "-m" followed by a module name.
+    client -> zygote: "kill <signal>\n" lines, forwarded to the script.
+    zygote -> client: "pid <pid>\n" once the script started, then "exit <code>\n" or
+                      "signal <signal>\n" when it ended.
+
+Every connection is served by its own forked session process, which forks the script process and
+relays signals and the exit status, so the accept loop never waits for a script.
+"""
+import os
+import sys
+import socket
+import signal
+import struct
+import select
+import atexit
+import argparse
+import importlib
+import traceback
+
+from typing import Dict, List, Tuple
+
+DEFAULT_SOCKET = "/run/pyram/zygote.sock"
+
+
+def preload(modules: List[str]) -> None:
+    """
+    Imports the modules inherited by every script forked from the zygote.
+    Args:
+        modules (list[str]): Module names, a module which fails to import is reported and skipped.
+    """
+
+    for name in modules:
+
+        try:
+
+            importlib.import_module(name)
+
+        except Exception as e:
+
+            print(f"pyram daemon: could not preload {name}: {e}", file=sys.stderr)
+
+
+def receive_request(conn: socket.socket) -> Tuple[str, List[str], Dict[str, str], List[int]]:
+    """
+    Reads a request sent by `pyram --client`.
+    Args:
+        conn (socket.socket): Connection accepted from the client.
+    Returns:
+        tuple: cwd, arguments, environment and the client stdin, stdout and stderr file descriptors.
+    Raises:
+        ConnectionError: If the client disconnects before sending the whole request.
+    """
+
+    data, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+
+    if len(data) < 4 or len(fds) != 3:
+
+        raise ConnectionError("incomplete request")
+
+    size = struct.unpack("!I", data[:4])[0]
+    payload = bytearray(data[4:])
+
+    while len(payload) < size:
+
+        chunk = conn.recv(size - len(payload))
+
+        if not chunk:
+
+            raise ConnectionError("incomplete request")
+
+        payload += chunk
+
+    fields = [field.decode("utf-8", "surrogateescape") for field in bytes(payload).split(b"\0")]
+    cwd = fields[0]
+    argc = int(fields[1])
+    args = fields[2:2 + argc]
+    envc = int(fields[2 + argc])
+    env = dict(entry.split("=", 1) for entry in fields[3 + argc:3 + argc + envc] if "=" in entry)
+
+    return cwd, args, env, fds
+
+
+def run_script(cwd: str, args: List[str], env: Dict[str, str], fds: List[int]) -> None:
+    """
+    Runs the script in the forked child, with the stdio of the client. Never returns.
+    Args:
+        cwd (str): Working directory of the client.
+        args (list[str]): Script path and its arguments, or "-m", the module and its arguments.
+        env (dict): Environment of the client.
+        fds (list[int]): Client stdin, stdout and stderr.
+    """
+
+    import runpy
+
+    for target, fd in zip((0, 1, 2), fds):
+
+        os.dup2(fd, target)
+        os.close(fd)
+
+    for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGCHLD, signal.SIGQUIT):
+
+        signal.signal(signum, signal.SIG_DFL)
+
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.set_wakeup_fd(-1)
+
+    sys.stdin = sys.__stdin__ = open(0, "r", closefd=False)
+    sys.stdout = sys.__stdout__ = open(1, "w", buffering=1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = sys.__stderr__ = open(2, "w", buffering=1, closefd=False)
+
+    code = 0
+
+    try:
+
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+
+        if args[0] == "-m":
+
+            # Like python -m, the modules next to the caller are importable
+            sys.argv = args[1:]
+            sys.path[0] = os.getcwd()
+            runpy.run_module(args[1], run_name="__main__", alter_sys=True)
+
+        else:
+
+            sys.argv = list(args)
+            sys.path[0] = os.path.dirname(os.path.abspath(args[0]))
+            runpy.run_path(args[0], run_name="__main__")
+
+    except SystemExit as e:
+
+        if e.code is None:
+
+            code = 0
+
+        elif isinstance(e.code, int):
+
+            code = e.code
+
+        else:
+
+            print(e.code, file=sys.stderr)
+            code = 1
+
+    except BaseException as e:
+
+        # Hide the frames of the zygote and runpy, like a script run by PyPy directly
+        tb = e.__traceback__
+
+        while tb is not None and (tb.tb_frame.f_code.co_filename == __file__ or "runpy" in tb.tb_frame.f_code.co_filename):
+
+            tb = tb.tb_next
+
+        traceback.print_exception(type(e), e, tb)
+        code = 1
+
+    try:
+
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    finally:
+
+        os._exit(code & 0xFF)
+
+
+def session(conn: socket.socket) -> None:
+    """
+    Serves one client in a forked session process: forks the script, forwards the signals sent
+    by the client and reports the exit status. Never returns.
+    Args:
+        conn (socket.socket): Connection accepted from the client.
+    """
+
+    # The handlers of the daemon would remove its socket
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+
+        signal.signal(signum, signal.SIG_DFL)
+
+    try:
+
+        cwd, args, env, fds = receive_request(conn)
+
+    except (ConnectionError, OSError, ValueError) as e:
+
+        print(f"pyram daemon: bad request: {e}", file=sys.stderr)
+        os._exit(1)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    # Wake up the select below when the script exits
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.set_wakeup_fd(wakeup_w)
+
+    child = os.fork()
+
+    if child == 0:
+
+        conn.close()
+        os.close(wakeup_r)
+        os.close(wakeup_w)
+        run_script(cwd, args, env, fds)
+
+    for fd in fds:
+
+        os.close(fd)
+
+    conn.sendall(f"pid {child}\n".encode())
+
+    watched = [conn, wakeup_r]
+    pending = b""
+
+    while True:
+
+        pid, status = os.waitpid(child, os.WNOHANG)
+
+        if pid == child:
+
+            break
+
+        readable, _, _ = select.select(watched, [], [])
+
+        if wakeup_r in readable:
+
+            os.read(wakeup_r, 512)
+
+        if conn in readable:
+
+            chunk = conn.recv(512)
+
+            if not chunk:
+
+                # The client is gone, nobody can interact with the script anymore
+                watched.remove(conn)
+                os.kill(child, signal.SIGHUP)
+                continue
+
+            pending += chunk
+
+            while b"\n" in pending:
+
+                line, pending = pending.split(b"\n", 1)
+
+                if line.startswith(b"kill "):
+
+                    try:
+
+                        os.kill(child, int(line[5:]))
+
+                    except (ValueError, OSError):
+
+                        pass
+
+    if os.WIFSIGNALED(status):
+
+        report = f"signal {os.WTERMSIG(status)}\n"
+
+    else:
+
+        report = f"exit {os.WEXITSTATUS(status)}\n"
+
+    try:
+
+        conn.sendall(report.encode())
+
+    except OSError:
+
+        pass
+
+    os._exit(0)
+
+
+def serve(path: str) -> None:
+    """
+    Accepts clients forever, forking a session process for each one.
+    Args:
+        path (str): Path of the Unix socket, only the owner (root) can connect to it.
+    """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if os.path.exists(path):
+
+        os.unlink(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    server.bind(path)
+    os.umask(old_umask)
+    server.listen(128)
+
+    def stop(signum, frame):
+
+        server.close()
+
+        if os.path.exists(path):
+
+            os.unlink(path)
+
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, stop)
+
+    # Session processes are reaped by the kernel
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    print(f"pyram daemon: listening on {path}", file=sys.stderr)
+
+    while True:
+
+        try:
+
+            conn, _ = server.accept()
+
+        except InterruptedError:
+
+            continue
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        if os.fork() == 0:
+
+            server.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            session(conn)
+
+        conn.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="PyRAM zygote daemon")
+    parser.add_argument("--socket", default=os.environ.get("PYRAM_SOCKET") or DEFAULT_SOCKET)
+    parser.add_argument("--preload", default=os.environ.get("PYRAM_PRELOAD", ""),
+                        help="comma separated modules imported once by the daemon")
+    options = parser.parse_args()
+
+    preload([name.strip() for name in options.preload.split(",") if name.strip()])
+    serve(options.socket)
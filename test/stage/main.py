@@ -0,0 +1,4 @@
+import sys
+
+# Prints its first argument: the --stage test checks it names the copy in RAM, the --toram one that it is passed
+print(sys.argv[1])
@@ -70,11 +70,91 @@ pyram -a ./simpleDjango/manage.py migrate
 
 pyram --args ./simpleDjango/manage.py runserver
 
+# Test --workers option
+cd ./simpleDjango
+pyram --workers 2 --bind 127.0.0.1:8001 testing.wsgi &
+SERVER_PID=$!
+cd ..
+
+sleep 5
+curl -s -o /dev/null http://127.0.0.1:8001/ && echo "pyram --workers: Success" || echo "pyram --workers: Failure"
+
+kill -TERM $SERVER_PID
+wait $SERVER_PID || true
+
 rm -rf ./simpleDjango/*
 
 # Create a .keepme file to keep the directory
 
 touch ./simpleDjango/.keepme
 
+# Test concurrent runs sharing the PyPy image
+pyram ./pythonBuiltin/main.py &
+FIRST_PID=$!
+pyram ./pythonBuiltin/main.py &
+SECOND_PID=$!
+
+wait $FIRST_PID
+wait $SECOND_PID
+
+# Test -c and - options, the code is not written to any file
+pyram -c 'import sys; print("pyram -c:", sys.argv[1])' Success
+echo 'print("pyram -: Success")' | pyram -
+
+# Test --trace-imports option, the trace lists the files of the PyPy tree used by the script
+pyram --trace-imports ./trace.txt ./pythonBuiltin/main.py
+[ -s ./trace.txt ] && echo "pyram --trace-imports: Success" || echo "pyram --trace-imports: Failure"
+rm -f ./trace.txt
+
+# Test --batch option, the jobs share one setup of the PyPy image
+printf '%s\n' './pythonBuiltin/main.py' './toram/main.py' > ./batch.txt
+pyram --batch ./batch.txt -j 2
+rm -f ./batch.txt
+
 # Test --toram option
-pyram --toram ./toram/main.py
\ No newline at end of file
+pyram --toram ./toram/main.py
+
+# Test --toram option with a project directory
+pyram --toram ./testModules/ --exclude '__pycache__' ./testModules/controller.py
+
+# Test concurrent --toram runs, each one copies its script or project to its own RAM disk
+pyram --toram ./testModules/ --exclude '__pycache__' ./testModules/controller.py &
+FIRST_PID=$!
+pyram --toram ./toram/main.py
+
+wait $FIRST_PID
+
+# The script of a relative project directory still receives its arguments once copied to RAM
+ARGUMENT=$(pyram --toram ./stage/ -a ./stage/main.py first second)
+[ "$ARGUMENT" = "first" ] && echo "pyram --toram project --args: Success" || echo "pyram --toram project --args: Failure ($ARGUMENT)"
+
+# Test --stage option, the argument naming the staged directory points to its copy in RAM
+STAGED=$(pyram --stage ./testModules/ --args ./stage/main.py ./testModules/controller.py)
+
+case "$STAGED" in
+  /mnt/pyram_stage/*/testModules/controller.py) echo "pyram --stage: Success" ;;
+  *) echo "pyram --stage: Failure ($STAGED)" ;;
+esac
+
+# Test --writeback option, the directory is created and the file written in RAM is copied to it when the run ends
+pyram --writeback out:./writebackOut --toram ./writeback/main.py
+[ -f ./writebackOut/result.txt ] && echo "pyram --writeback: Success" || echo "pyram --writeback: Failure"
+rm -rf ./writebackOut
+
+# Test --private without root, over the mount points created by the root runs above
+( cd /tmp && setpriv --reuid=65534 --regid=65534 --clear-groups pyram --private -c 'print("pyram --private without root: Success")' ) \
+  || echo "pyram --private without root: Failure"
+
+# Test --gc-mounts option
+pyram --gc-mounts
+
+# Test --daemon and --client options
+pyram --daemon --preload json &
+DAEMON_PID=$!
+
+while [ ! -S /run/pyram/zygote.sock ]; do sleep 0.1; done
+
+pyram --client ./pythonBuiltin/main.py
+
+kill -TERM $DAEMON_PID
+wait $DAEMON_PID || true
@@ -0,0 +1,6 @@
+import os
+
+# pyram --writeback out:DEST gives the RAM directory written back to DEST
+with open(os.path.join(os.environ["PYRAM_WRITEBACK_OUT"], "result.txt"), "w") as f:
+
+    f.write("--writeback SUCCESS\n")